@@ -113,15 +113,94 @@ EMAIL_USE_TLS = True if os.getenv("EMAIL_USE_TLS") == "True" else False
 EMAIL_USE_SSL = True if os.getenv("EMAIL_USE_SSL") == "True" else False
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
+# Сколько секунд ждать ответа SMTP-сервера. Зависшая отправка завершается временной ошибкой
+# и уходит в повтор, а не держит задание рассылки бесконечно.
+EMAIL_TIMEOUT = 60
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 
+# Сколько писем рассылки отправлять через одно SMTP-соединение
+# перед переподключением.
+MAILING_CONNECTION_BATCH_SIZE = 100
+# Движок отправки рассылок: "serial" - последовательно через одно соединение,
+# "threaded" - параллельно через пул SMTP-соединений.
+MAILING_ENGINE = "serial"
+# Число параллельных SMTP-соединений движка "threaded".
+MAILING_CONCURRENCY = 8
+# Предельное число одновременных соединений к одному SMTP-серверу.
+MAILING_HOST_CONCURRENCY = 4
+# Сколько получателей рассылки читать из БД за один запрос при отправке.
+MAILING_RECIPIENT_CHUNK_SIZE = 1000
+# Сколько попыток отправки копить перед записью в БД одним bulk_create.
+MAILING_ATTEMPTS_BATCH_SIZE = 500
+# Темп отправки писем с одного SMTP-аккаунта (писем в секунду, 0 - без ограничения)
+# и допустимый всплеск. Ограничение общее для всех процессов и хранится в Redis.
+MAILING_RATE_LIMIT = 10
+MAILING_RATE_BURST = 20
+# Пауза в секундах между опросами пустой очереди воркером run_mail_worker.
+MAILING_WORKER_POLL_INTERVAL = 5
+# Повторы писем после временных ошибок SMTP: предельное число попыток,
+# начальная и предельная задержка в секундах, сколько повторов забирать за раз.
+MAILING_RETRY_MAX_ATTEMPTS = 5
+MAILING_RETRY_BASE_DELAY = 60
+MAILING_RETRY_MAX_DELAY = 3600
+MAILING_RETRY_BATCH_SIZE = 500
+# Период в секундах, с которым планировщик run_scheduler проверяет расписание рассылок.
+MAILING_SCHEDULER_TICK = 30
+# Через сколько секунд без признака жизни задание считается брошенным
+# и забирается другим воркером для продолжения отправки.
+MAILING_JOB_LEASE = 600
+# Раз в столько секунд фоновый поток обновляет признак жизни выполняемого задания,
+# отправка записывает накопленные попытки, а отправка повторов продлевает их аренду.
+# Должно быть заметно меньше MAILING_JOB_LEASE, иначе медленную отправку заберёт второй воркер.
+# Аренда повторов продлевается только между отправками, поэтому MAILING_JOB_LEASE должен быть
+# больше EMAIL_TIMEOUT вместе с ожиданием ограничителя темпа.
+MAILING_JOB_HEARTBEAT_INTERVAL = 60
+# Сколько строк файла импорта получателей проверять и записывать в БД за раз.
+RECIPIENT_IMPORT_CHUNK_SIZE = 1000
+# Сколько отклонённых строк импорта показывать на странице с итогами.
+RECIPIENT_IMPORT_REPORT_LIMIT = 100
+# Сколько строк выгрузки попыток читать из БД за раз серверным курсором.
+ATTEMPTS_EXPORT_CHUNK_SIZE = 2000
+# Хранение попыток отправки: попытки старше ATTEMPTS_RETENTION_DAYS дней командой archive_attempts
+# переносятся в помесячные сжатые архивы в ATTEMPTS_ARCHIVE_DIR и удаляются из БД
+# пачками по ATTEMPTS_ARCHIVE_BATCH_SIZE строк.
+# В архивах адреса и ответы серверов всех владельцев, поэтому каталог должен быть вне MEDIA_ROOT
+# и каталогов статики: их раздаёт веб-сервер без проверки прав.
+ATTEMPTS_RETENTION_DAYS = 180
+ATTEMPTS_ARCHIVE_DIR = os.getenv("ATTEMPTS_ARCHIVE_DIR", os.path.join(BASE_DIR, "var", "attempts_archive"))
+ATTEMPTS_ARCHIVE_BATCH_SIZE = 5000
+
 # reiman79!
+REDIS_URL = "redis://redis:6379/1"
 CACHE_ENABLED = True
+# Время жизни списков в кэше, сек. Списки сбрасываются сигналами при изменении данных.
+LIST_CACHE_TIMEOUT = 60 * 60
+# Время жизни фрагментов страниц со списками в кэше, сек. Ключ фрагмента меняется
+# вместе с версией данных пользователя, поэтому срок может быть долгим.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Время жизни статистики главной страницы в кэше, сек. Счётчики обновляются сигналами,
+# срок нужен только для того, чтобы время от времени сверять их с БД.
+STATS_CACHE_TIMEOUT = 60 * 60
+# Число строк на одной странице списков.
+LIST_PAGE_SIZE = 50
+# Пересчёт истёкших значений кэша: значение хранится ещё CACHE_STALE_TIMEOUT сек. после срока,
+# чтобы его отдавали, пока один процесс под блокировкой на CACHE_LOCK_TIMEOUT сек. считает новое.
+# При пустом кэше остальные процессы ждут результат до CACHE_LOCK_WAIT сек.
+CACHE_STALE_TIMEOUT = 60 * 5
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 2
+# Коэффициент досрочного пересчёта: чем больше, тем раньше срока обновляются часто читаемые ключи.
+CACHE_EARLY_REFRESH_BETA = 1.0
 if CACHE_ENABLED:
     CACHES = {
         "default": {
-            "BACKEND": "django.core.cache.backends.redis.RedisCache",
-            "LOCATION": "redis://redis:6379/1",
+            "BACKEND": "mail.cache.TwoTierRedisCache",
+            "LOCATION": REDIS_URL,
+            # Небольшие часто читаемые ключи дополнительно хранятся в памяти процесса:
+            # версии кэшированных списков и счётчики главной страницы.
+            "LOCAL_KEYS": [r":version:", r"^dashboard_stats:(mailings|active|recipients)$"],
+            "LOCAL_MAX_ENTRIES": 1000,
+            "LOCAL_TIMEOUT": 5,
         }
     }
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Mailing, Recipient, Attempts, Message
+from .models import Mailing, MailingJob, MailingRetry, MailingStats, Recipient, Attempts, Message, Segment
 
 
 @admin.register(Recipient)
@@ -16,12 +16,41 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = ("subject",)
 
 
+@admin.register(Segment)
+class SegmentAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "comment_contains", "email_domain", "owner")
+    list_select_related = ("owner",)
+    search_fields = ("name",)
+    raw_id_fields = ("owner",)
+
+
+class MailingListFilter(admin.SimpleListFilter):
+    """Фильтр по рассылке, читающий темы сообщений рассылок одним запросом."""
+    title = "Рассылка"
+    parameter_name = "mailing"
+
+    def lookups(self, request, model_admin):
+        return [(mailing.pk, str(mailing)) for mailing in Mailing.objects.select_related("message")]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(mailing_id=self.value())
+        return queryset
+
+
 @admin.register(Mailing)
 class MailingAdmin(admin.ModelAdmin):
-    list_display = ("id", "start_at", "end_at", "status", "message")
+    list_display = ("id", "start_at", "end_at", "status", "message", "segment")
+    list_select_related = ("message", "segment")
     search_fields = ("status", "message")
     list_filter = ("status", "message")
 
+    def get_queryset(self, request):
+        # Mailing.__str__ показывает тему сообщения, в том числе в заголовке страницы изменения.
+        # Список изменений не применяет list_select_related к запросу, у которого select_related уже задан,
+        # поэтому здесь перечислены все связи списка.
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
 
 # Register your models here.
 @admin.register(Attempts)
@@ -33,5 +62,29 @@ class AttemptsAdmin(admin.ModelAdmin):
         "mail_server_response",
         "mailing",
     )
+    list_select_related = ("mailing__message",)
     search_fields = ("attempt_status", "mailing")
-    list_filter = ("attempt_status", "mailing")
+    list_filter = ("attempt_status", MailingListFilter)
+    raw_id_fields = ("mailing", "owner", "recipient")
+
+
+@admin.register(MailingJob)
+class MailingJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "mailing", "status", "created_at", "started_at", "finished_at")
+    list_select_related = ("mailing__message",)
+    list_filter = ("status",)
+    raw_id_fields = ("mailing",)
+
+
+@admin.register(MailingRetry)
+class MailingRetryAdmin(admin.ModelAdmin):
+    list_display = ("id", "mailing", "recipient", "attempts", "next_attempt_at", "last_error")
+    list_select_related = ("mailing__message", "recipient")
+    raw_id_fields = ("mailing", "recipient")
+
+
+@admin.register(MailingStats)
+class MailingStatsAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "owner", "success", "failure")
+    list_select_related = ("mailing__message", "owner")
+    raw_id_fields = ("mailing", "owner")
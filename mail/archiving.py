@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .exporting import format_row
+from .models import Attempts, Mailing
+from .service import invalidate_cache
+
+# Поля попыток в архиве: все столбцы таблицы, чтобы попытку можно было восстановить.
+ARCHIVE_FIELDS = (
+    "id",
+    "attempt_date",
+    "attempt_status",
+    "mail_server_response",
+    "mailing_id",
+    "owner_id",
+    "recipient_id",
+    "run_id",
+)
+
+
+def check_archive_dir():
+    """Проверяет, что каталог архивов не лежит в каталогах, которые раздаются без проверки прав."""
+    archive_dir = os.path.realpath(settings.ATTEMPTS_ARCHIVE_DIR)
+    public_dirs = [settings.MEDIA_ROOT, settings.STATIC_ROOT, *settings.STATICFILES_DIRS]
+    for public_dir in filter(None, public_dirs):
+        public_dir = os.path.realpath(public_dir)
+        if os.path.commonpath([archive_dir, public_dir]) == public_dir:
+            raise ImproperlyConfigured(
+                f"ATTEMPTS_ARCHIVE_DIR не должен находиться в общедоступном каталоге {public_dir}."
+            )
+
+
+def get_archive_path(month):
+    """Путь к архиву попыток за месяц month (дата любого дня месяца)."""
+    return os.path.join(settings.ATTEMPTS_ARCHIVE_DIR, f"attempts-{month:%Y-%m}.ndjson.gz")
+
+
+def write_archive(rows):
+    """Дописывает строки попыток в архивы их месяцев: сжатые файлы NDJSON, по объекту JSON на строку.
+    Каждая запись добавляет в файл отдельный участок gzip, а gzip читает такие участки подряд,
+    как один поток, поэтому архив месяца можно пополнять, не перепаковывая его.
+    Каталог и файлы архивов доступны только пользователю, от имени которого идёт архивирование."""
+    months = {}
+    for row in rows:
+        months.setdefault(timezone.localtime(row[1]).date().replace(day=1), []).append(row)
+    os.makedirs(settings.ATTEMPTS_ARCHIVE_DIR, mode=0o700, exist_ok=True)
+    for month, month_rows in months.items():
+        descriptor = os.open(get_archive_path(month), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with open(descriptor, "ab") as raw_file, gzip.open(raw_file, "at", encoding="utf-8") as file:
+            for row in month_rows:
+                file.write(json.dumps(dict(zip(ARCHIVE_FIELDS, format_row(row))), ensure_ascii=False, default=str))
+                file.write("\n")
+
+
+def delete_attempts(pks):
+    """Удаляет попытки одним запросом DELETE по первичным ключам. QuerySet.delete() загрузил бы
+    каждую попытку в память ради сигналов post_delete, а сигналы попыток только сбрасывают кэш
+    списка, который сбрасывается после каждой пачки. На попытки не ссылаются другие таблицы,
+    поэтому удалять каскадом нечего. Счётчики MailingStats не уменьшаются,
+    поэтому итоги рассылок после архивирования остаются прежними."""
+    queryset = Attempts.objects.filter(pk__in=pks)
+    return queryset._raw_delete(queryset.db)
+
+
+def archive_mailing_attempts(mailing_id, cutoff, batch_size, dry_run=False):
+    """Переносит в архив попытки рассылки старше cutoff пачками по batch_size.
+    Пачка сначала дописывается в архив и только потом удаляется из БД, каждая пачка
+    удаляется в своей короткой транзакции. Если процесс упадёт между записью и удалением,
+    повторный запуск запишет пачку в архив ещё раз: такие повторы отличаются по id.
+    Возвращает число перенесённых попыток."""
+    queryset = Attempts.objects.filter(mailing_id=mailing_id, attempt_date__lt=cutoff).order_by("attempt_date", "pk")
+    if dry_run:
+        return queryset.count()
+    archived = 0
+    while True:
+        rows = list(queryset.values_list(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return archived
+        write_archive(rows)
+        with transaction.atomic():
+            delete_attempts([row[0] for row in rows])
+            invalidate_cache("mailing_attempts_list", {row[5] for row in rows})
+        archived += len(rows)
+
+
+def archive_attempts(days=None, batch_size=None, dry_run=False):
+    """Переносит попытки отправки старше days дней из таблицы попыток в помесячные архивы
+    в ATTEMPTS_ARCHIVE_DIR. Попытки выбираются по рассылкам: так каждая выборка идёт
+    по индексу (рассылка, дата попытки). Итоги рассылок остаются в MailingStats.
+    При dry_run только считает попытки, которые были бы перенесены.
+    Возвращает число перенесённых попыток."""
+    check_archive_dir()
+    days = settings.ATTEMPTS_RETENTION_DAYS if days is None else days
+    batch_size = batch_size or settings.ATTEMPTS_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+    old_attempts = Attempts.objects.filter(mailing_id=OuterRef("pk"), attempt_date__lt=cutoff)
+    mailing_ids = Mailing.objects.filter(Exists(old_attempts)).order_by("pk").values_list("pk", flat=True)
+    return sum(
+        archive_mailing_attempts(mailing_id, cutoff, batch_size, dry_run) for mailing_id in list(mailing_ids)
+    )
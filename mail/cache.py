@@ -0,0 +1,244 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+from redis.exceptions import RedisError
+
+# Локальные уровни кэша общие для всех потоков процесса: Django создаёт
+# отдельный экземпляр бэкенда кэша на каждый поток.
+local_tiers = {}
+local_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    """Ограниченный по размеру LRU-кэш процесса со сроком жизни значений.
+    Согласованность с Redis поддерживает поток-подписчик: другие процессы публикуют
+    в канал channel ключи, которые они изменили, и подписчик выбрасывает их из
+    локального уровня. Пока подписка не установлена, локальный уровень не используется."""
+
+    def __init__(self, channel, max_entries, timeout):
+        self.channel = channel
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.listening = False
+        self.pid = None
+        self.stats = {"local_hits": 0, "local_misses": 0, "invalidations": 0, "redis_hits": 0, "redis_misses": 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.entries.pop(key, None)
+                self.stats["local_misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["local_hits"] += 1
+            return entry
+
+    def set(self, key, value, generation):
+        """Запоминает значение, прочитанное из Redis, если за время чтения
+        не пришло ни одной инвалидации: иначе значение могло уже устареть."""
+        with self.lock:
+            if generation != self.generation or not self.listening:
+                return
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, keys):
+        with self.lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def ensure_listening(self, get_client):
+        """Запускает поток-подписчик в текущем процессе. После fork поток родителя
+        не наследуется, поэтому подписчик заводится заново в каждом процессе."""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.listening = False
+            self.entries.clear()
+        threading.Thread(target=self.listen, args=(get_client,), daemon=True).start()
+
+    def listen(self, get_client):
+        while True:
+            try:
+                pubsub = get_client().pubsub(ignore_subscribe_messages=False)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        self.listening = True
+                    elif message["type"] == "message":
+                        key = message["data"].decode()
+                        if key == "*":
+                            self.clear()
+                        else:
+                            self.evict([key])
+            except RedisError:
+                pass
+            # Пока подписки нет, инвалидации теряются: локальный уровень отключается и очищается.
+            self.listening = False
+            self.clear()
+            time.sleep(1)
+
+
+class TwoTierRedisCache(RedisCache):
+    """Бэкенд кэша Redis с локальным уровнем в памяти процесса перед ним.
+    В локальном уровне хранятся только ключи, подходящие под шаблоны LOCAL_KEYS,
+    - небольшие и часто читаемые значения, например версии списков и счётчики
+    главной страницы. Их изменения публикуются в канал Redis, по которому
+    остальные процессы выбрасывают свои локальные копии; LOCAL_TIMEOUT
+    ограничивает время жизни копии на случай потерянного сообщения.
+
+    Параметры в CACHES (рядом с LOCATION):
+        LOCAL_KEYS - регулярные выражения ключей для локального уровня;
+        LOCAL_MAX_ENTRIES - наибольшее число ключей в локальном уровне;
+        LOCAL_TIMEOUT - время жизни локальной копии, сек.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self.local_keys = [re.compile(pattern) for pattern in params.get("LOCAL_KEYS", [])]
+        channel = f"cache:invalidate:{self.key_prefix}"
+        with local_tiers_lock:
+            if channel not in local_tiers:
+                local_tiers[channel] = LocalTier(
+                    channel, params.get("LOCAL_MAX_ENTRIES", 1000), params.get("LOCAL_TIMEOUT", 5)
+                )
+            self.local = local_tiers[channel]
+
+    def is_local(self, key):
+        return any(pattern.search(key) for pattern in self.local_keys)
+
+    def publish(self, keys):
+        """Выбрасывает ключи из локального уровня этого процесса и сообщает о них остальным."""
+        self.local.evict(keys)
+        client = self._cache.get_client(write=True)
+        for key in keys:
+            client.publish(self.local.channel, key)
+
+    def get_remote(self, key, default, version):
+        self.local.ensure_listening(lambda: self._cache.get_client(write=False))
+        generation = self.local.generation
+        missing = object()
+        value = super().get(key, missing, version=version)
+        if value is missing:
+            self.local.count("redis_misses")
+            return default, None
+        self.local.count("redis_hits")
+        return value, generation
+
+    def get(self, key, default=None, version=None):
+        if not self.is_local(key):
+            return self.get_remote(key, default, version)[0]
+        full_key = self.make_and_validate_key(key, version=version)
+        entry = self.local.get(full_key)
+        if entry is not None:
+            return entry[0]
+        value, generation = self.get_remote(key, default, version)
+        if generation is not None:
+            self.local.set(full_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote_keys = []
+        for key in keys:
+            entry = self.local.get(self.make_and_validate_key(key, version=version)) if self.is_local(key) else None
+            if entry is not None:
+                found[key] = entry[0]
+            else:
+                remote_keys.append(key)
+        if remote_keys:
+            self.local.ensure_listening(lambda: self._cache.get_client(write=False))
+            generation = self.local.generation
+            remote = super().get_many(remote_keys, version=version)
+            self.local.count("redis_hits", len(remote))
+            self.local.count("redis_misses", len(remote_keys) - len(remote))
+            for key, value in remote.items():
+                if self.is_local(key):
+                    self.local.set(self.make_and_validate_key(key, version=version), value, generation)
+            found.update(remote)
+        return found
+
+    def changed(self, keys, version=None):
+        """Сообщает об изменении ключей, если какие-то из них хранятся в локальном уровне."""
+        local = [self.make_and_validate_key(key, version=version) for key in keys if self.is_local(key)]
+        if local:
+            self.publish(local)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version=version)
+        if added:
+            self.changed([key], version)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version=version)
+        self.changed([key], version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = super().touch(key, timeout, version=version)
+        self.changed([key], version)
+        return touched
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version=version)
+        self.changed([key], version)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version=version)
+        self.changed([key], version)
+        return value
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version=version)
+        self.changed(data, version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version=version)
+        self.changed(keys, version)
+
+    def clear(self):
+        cleared = super().clear()
+        self.local.clear()
+        self._cache.get_client(write=True).publish(self.local.channel, "*")
+        return cleared
+
+    def get_stats(self):
+        """Возвращает счётчики попаданий и промахов обоих уровней кэша в этом процессе
+        и счётчики попаданий и промахов всего сервера Redis."""
+        with self.local.lock:
+            stats = dict(self.local.stats, local_size=len(self.local.entries), listening=self.local.listening)
+        try:
+            info = self._cache.get_client(write=False).info("stats")
+            stats["redis_server_hits"] = info["keyspace_hits"]
+            stats["redis_server_misses"] = info["keyspace_misses"]
+        except RedisError:
+            pass
+        stats["pid"] = os.getpid()
+        return stats
@@ -0,0 +1,99 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Attempts
+from .service import ATTEMPT_KEY, LIST_PERMISSIONS, get_scope, scoped
+
+# Поля попыток в выгрузке: читаются одним запросом через JOIN, без обращений к БД за каждой строкой.
+EXPORT_FIELDS = (
+    "pk",
+    "attempt_date",
+    "attempt_status",
+    "mail_server_response",
+    "mailing_id",
+    "mailing__message__subject",
+    "owner_id",
+    "owner__email",
+    "recipient_id",
+    "recipient__email",
+)
+# Названия полей в заголовке CSV и ключи объектов NDJSON.
+EXPORT_COLUMNS = (
+    "id",
+    "attempt_date",
+    "attempt_status",
+    "mail_server_response",
+    "mailing_id",
+    "subject",
+    "owner_id",
+    "owner_email",
+    "recipient_id",
+    "recipient_email",
+)
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def get_export_queryset(user, mailing=None, owner=None, status=None, date_from=None, date_to=None):
+    """Возвращает попытки для выгрузки, видимые пользователю, с фильтрами по рассылке,
+    владельцу, статусу и дате попытки (date_from включительно, date_to - до конца этого дня).
+    Фильтр по владельцу действует только для пользователей, видящих попытки всех владельцев.
+    Попытки идут в порядке списка попыток, который покрывают индексы по ключу сортировки."""
+    scope = get_scope(user, LIST_PERMISSIONS["mailing_attempts_list"])
+    queryset = scoped(Attempts.objects.all(), scope, user)
+    if mailing is not None:
+        queryset = queryset.filter(mailing_id=mailing)
+    if owner is not None and scope == "all":
+        queryset = queryset.filter(owner_id=owner)
+    if status:
+        queryset = queryset.filter(attempt_status=status)
+    if date_from is not None:
+        queryset = queryset.filter(attempt_date__gte=start_of_day(date_from))
+    if date_to is not None:
+        queryset = queryset.filter(attempt_date__lt=start_of_day(date_to + timedelta(days=1)))
+    return queryset.order_by(*ATTEMPT_KEY).values_list(*EXPORT_FIELDS)
+
+
+def iter_export_rows(queryset, chunk_size=None):
+    """Потоково отдаёт строки выгрузки. iterator() читает их серверным курсором
+    пачками по chunk_size, поэтому в памяти одновременно не больше одной пачки."""
+    return queryset.iterator(chunk_size=chunk_size or settings.ATTEMPTS_EXPORT_CHUNK_SIZE)
+
+
+def format_row(row):
+    """Приводит строку выгрузки к значениям для CSV и JSON: дата и время - в ISO 8601 с микросекундами."""
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
+
+
+class Echo:
+    """Файлоподобный объект для csv.writer: возвращает записанную строку вместо того, чтобы её хранить."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """Отдаёт выгрузку построчно в формате CSV с заголовком."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(format_row(row))
+
+
+def stream_ndjson(rows):
+    """Отдаёт выгрузку построчно в формате NDJSON: по одному объекту JSON на строку."""
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, format_row(row))), ensure_ascii=False) + "\n"
+
+
+# Форматы выгрузки: функция, превращающая строки в части ответа, и тип содержимого.
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv; charset=utf-8"),
+    "ndjson": (stream_ndjson, "application/x-ndjson; charset=utf-8"),
+}
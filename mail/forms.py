@@ -1,7 +1,9 @@
 from django import forms
 from django.core.exceptions import ValidationError
 
-from .models import Mailing, Message, Recipient
+from users.models import normalize_email
+
+from .models import Attempts, Mailing, Message, Recipient, Segment
 
 
 class RecipientForm(forms.ModelForm):
@@ -22,12 +24,23 @@ class RecipientForm(forms.ModelForm):
         )
 
     def clean_email(self):
-        email = self.cleaned_data.get("email")
-        if Recipient.objects.filter(email=email).exists():
+        email = normalize_email(self.cleaned_data.get("email"))
+        if Recipient.objects.filter(email__lower=email).exclude(pk=self.instance.pk).exists():
             raise ValidationError("Такой адрес электронной почты уже есть.")
         return email
 
 
+class RecipientImportForm(forms.Form):
+    file = forms.FileField(
+        label="Файл с получателями",
+        help_text="CSV или XLSX со столбцами email, full_name и comment",
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(RecipientImportForm, self).__init__(*args, **kwargs)
+        self.fields["file"].widget.attrs.update({"class": "form-control", "accept": ".csv,.xlsx"})
+
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
@@ -43,13 +56,33 @@ class MessageForm(forms.ModelForm):
         )
 
 
+class SegmentForm(forms.ModelForm):
+    class Meta:
+        model = Segment
+        fields = ("name", "comment_contains", "email_domain")
+
+    def __init__(self, *args, **kwargs):
+        super(SegmentForm, self).__init__(*args, **kwargs)
+        self.fields["name"].widget.attrs.update({"class": "form-control", "placeholder": "Введите название сегмента"})
+        self.fields["comment_contains"].widget.attrs.update(
+            {"class": "form-control", "placeholder": "Текст в комментарии получателя"}
+        )
+        self.fields["email_domain"].widget.attrs.update({"class": "form-control", "placeholder": "example.com"})
+
+    def clean_email_domain(self):
+        return self.cleaned_data.get("email_domain", "").strip().lstrip("@").lower()
+
+
 class MailingForm(forms.ModelForm):
     class Meta:
         model = Mailing
-        fields = ("start_at", "end_at", "status", "message", "recipients")
+        fields = ("start_at", "end_at", "status", "message", "segment", "recipients")
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, user=None, **kwargs):
         super(MailingForm, self).__init__(*args, **kwargs)
+        # Сегмент отбирает получателей своего владельца, поэтому выбрать можно только свои сегменты.
+        self.fields["segment"].queryset = Segment.objects.filter(owner_id=user.pk if user is not None else None)
+        self.fields["segment"].widget.attrs.update({"class": "form-control"})
         self.fields["start_at"].widget.attrs.update(
             {"class": "form-control", "type": "datetime-local"}
         )
@@ -59,3 +92,24 @@ class MailingForm(forms.ModelForm):
         self.fields["recipients"].widget.attrs.update({"class": "form-control"})
         self.fields["status"].widget.attrs.update({"class": "form-control"})
         self.fields["message"].widget.attrs.update({"class": "form-control"})
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if "segment" in self.errors or "recipients" in self.errors:
+            return cleaned_data
+        recipients = cleaned_data.get("recipients")
+        has_recipients = recipients is not None and recipients.exists()
+        if cleaned_data.get("segment") is not None and has_recipients:
+            raise ValidationError("Выберите либо сегмент, либо получателей списком.")
+        if cleaned_data.get("segment") is None and not has_recipients:
+            raise ValidationError("Выберите сегмент или получателей рассылки.")
+        return cleaned_data
+
+
+class AttemptsExportForm(forms.Form):
+    """Фильтры выгрузки попыток рассылок, передаются в строке запроса."""
+    mailing = forms.IntegerField(required=False, min_value=1)
+    owner = forms.IntegerField(required=False, min_value=1)
+    status = forms.ChoiceField(required=False, choices=[("", "все")] + Attempts.ATTEMPT_STATUS_CHOICES)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
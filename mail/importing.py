@@ -0,0 +1,180 @@
+import codecs
+import csv
+import os
+import zipfile
+from itertools import chain, islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from users.models import normalize_email
+
+from .models import Recipient
+from .service import invalidate_cache, invalidate_dashboard_stats
+
+# Столбцы файла импорта: адрес и ФИО обязательны, комментарий - нет.
+IMPORT_COLUMNS = ("email", "full_name", "comment")
+
+
+# Размер блока, которым файл CSV читается при проверке кодировки.
+ENCODING_CHECK_BLOCK_SIZE = 64 * 1024
+
+
+class ImportFileError(Exception):
+    """Файл импорта нельзя прочитать: неизвестный формат, неверная кодировка,
+    испорченное содержимое или нет обязательных столбцов."""
+
+
+def check_encoding(file):
+    """Проверяет, что файл, открытый в двоичном режиме, целиком в кодировке UTF-8,
+    и возвращается в его начало. Файл читается блоками, поэтому в памяти не оказывается целиком.
+    Проверка идёт до записи первой пачки, чтобы файл в другой кодировке не был импортирован наполовину."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    position = 0
+    try:
+        for block in iter(lambda: file.read(ENCODING_CHECK_BLOCK_SIZE), b""):
+            decoder.decode(block)
+            position += len(block)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError as error:
+        raise ImportFileError(
+            f"Файл не в кодировке UTF-8: недопустимый байт на позиции {position + error.start}. "
+            "Сохраните файл в UTF-8 и загрузите снова."
+        )
+    file.seek(0)
+
+
+def read_csv(file):
+    """Потоково читает строки CSV-файла, открытого в двоичном режиме.
+    Разделитель (запятая или точка с запятой) определяется по строке заголовков."""
+    check_encoding(file)
+    lines = codecs.iterdecode(file, "utf-8-sig")
+    header = next(lines, "")
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.reader(chain([header], lines), delimiter=delimiter)
+    try:
+        yield from reader
+    except (csv.Error, UnicodeDecodeError) as error:
+        raise ImportFileError(f"Не удалось прочитать строку {reader.line_num} файла CSV ({error}).")
+
+
+def read_xlsx(file):
+    """Потоково читает строки первого листа XLSX-файла. Книга открывается в режиме
+    только для чтения, при котором openpyxl не загружает лист в память целиком."""
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ImportFileError("Файл не является книгой XLSX или повреждён.")
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename):
+    """Возвращает номера и строки файла импорта в виде словарей по столбцам IMPORT_COLUMNS.
+    Формат определяется по расширению имени файла."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".csv":
+        rows = read_csv(file)
+    elif extension == ".xlsx":
+        rows = read_xlsx(file)
+    else:
+        raise ImportFileError("Поддерживаются файлы CSV и XLSX.")
+    header = [str(name).strip().lower() for name in next(rows, [])]
+    missing = [name for name in IMPORT_COLUMNS[:2] if name not in header]
+    if missing:
+        raise ImportFileError("В файле нет столбцов: " + ", ".join(missing))
+    positions = {name: header.index(name) for name in IMPORT_COLUMNS if name in header}
+    return (
+        (line, {name: row[index] if index < len(row) else "" for name, index in positions.items()})
+        for line, row in enumerate(rows, start=2)
+        if any(str(value).strip() for value in row)
+    )
+
+
+def clean_row(row):
+    """Проверяет и нормализует строку импорта, возвращает несохранённого получателя
+    или выбрасывает ValidationError с причиной отказа."""
+    email = normalize_email(row["email"])
+    full_name = row["full_name"].strip()
+    comment = row.get("comment", "").strip() or None
+    if not email:
+        raise ValidationError("Не указан адрес электронной почты.")
+    validate_email(email)
+    if len(email) > Recipient._meta.get_field("email").max_length:
+        raise ValidationError("Слишком длинный адрес электронной почты.")
+    if not full_name:
+        raise ValidationError("Не указано ФИО.")
+    if len(full_name) > Recipient._meta.get_field("full_name").max_length:
+        raise ValidationError("Слишком длинное ФИО.")
+    return Recipient(email=email, full_name=full_name, comment=comment)
+
+
+def import_chunk(chunk, owner, report):
+    """Записывает пачку строк импорта: проверяет строки, отбрасывает повторы внутри пачки
+    и адреса, которые уже есть в БД (одним запросом на пачку), остальных получателей
+    вставляет одним bulk_create. Если другой запрос успел добавить адрес между проверкой
+    и вставкой, вставка откатывается до точки сохранения и повторяется без таких адресов,
+    а их строки попадают в отчёт как повторы. Возвращает число вставленных получателей."""
+    recipients = {}
+    rejected = []
+    for line, row in chunk:
+        try:
+            recipient = clean_row(row)
+        except ValidationError as error:
+            rejected.append((line, row["email"], " ".join(error.messages)))
+            continue
+        if recipient.email in recipients:
+            rejected.append((line, recipient.email, "Адрес повторяется в файле."))
+            continue
+        recipient.owner = owner
+        recipients[recipient.email] = (line, recipient)
+    while recipients:
+        existing = Recipient.objects.filter(email__lower__in=list(recipients)).values_list("email", flat=True)
+        for email in existing:
+            line = recipients.pop(normalize_email(email))[0]
+            rejected.append((line, email, "Такой адрес электронной почты уже есть."))
+        try:
+            with transaction.atomic():
+                Recipient.objects.bulk_create([recipient for line, recipient in recipients.values()])
+            break
+        except IntegrityError:
+            # Нарушено не ограничение уникальности адреса: повтор вставки не поможет.
+            if not Recipient.objects.filter(email__lower__in=list(recipients)).exists():
+                raise
+    for line, email, error in sorted(rejected):
+        report(line, email, error)
+    return len(recipients)
+
+
+def import_recipients(rows, owner, report, chunk_size=None):
+    """Импортирует получателей владельца owner из строк rows (номер строки и словарь по столбцам)
+    пачками по chunk_size строк. В памяти одновременно находится не больше одной пачки,
+    повторы между пачками находит проверка по БД. Об отклонённых строках сообщает
+    через report(номер строки, адрес, причина). Возвращает число импортированных получателей.
+    Если файл оказался испорчен посреди импорта, записанные пачки остаются в БД,
+    а ImportFileError сообщает, сколько получателей успело импортироваться.
+    bulk_create не отправляет сигналы, поэтому кэш списка и статистика главной страницы
+    сбрасываются здесь."""
+    chunk_size = chunk_size or settings.RECIPIENT_IMPORT_CHUNK_SIZE
+    created = 0
+    try:
+        while True:
+            try:
+                chunk = list(islice(rows, chunk_size))
+            except ImportFileError as error:
+                raise ImportFileError(f"{error} Импорт прерван, до ошибки импортировано получателей: {created}.")
+            if not chunk:
+                return created
+            with transaction.atomic():
+                created += import_chunk(chunk, owner, report)
+    finally:
+        if created:
+            invalidate_cache("recipient_list", [owner.pk if owner is not None else None])
+            invalidate_dashboard_stats()
@@ -0,0 +1,178 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Mailing, MailingJob, MailingRetry
+from .sending import send_mailing, send_retries
+from .service import adjust_dashboard_stats, invalidate_cache, invalidate_dashboard_stats
+
+
+def enqueue_mailing(mailing):
+    """Ставит рассылку в очередь на отправку и сразу возвращает задание.
+    Если рассылка уже стоит в очереди или отправляется, возвращает существующее задание.
+    Если последнее задание рассылки завершилось ошибкой, оно возвращается в очередь
+    с тем же run_id: запуск продолжится с получателей без успешной попытки,
+    и уже получившим письмо оно не уйдёт повторно.
+    Если задание одновременно создал другой запрос, возвращает его задание;
+    если и оно успело завершиться, пробрасывает IntegrityError."""
+    try:
+        with transaction.atomic():
+            job = MailingJob.objects.filter(mailing=mailing).order_by("-created_at").first()
+            if job is not None and job.status == MailingJob.FAILED:
+                requeued = MailingJob.objects.filter(pk=job.pk, status=MailingJob.FAILED).update(
+                    status=MailingJob.QUEUED, error="", finished_at=None, heartbeat_at=None
+                )
+                if requeued:
+                    job.refresh_from_db()
+                    return job
+            return MailingJob.objects.create(mailing=mailing)
+    except IntegrityError:
+        job = MailingJob.objects.filter(mailing=mailing, status__in=[MailingJob.QUEUED, MailingJob.RUNNING]).first()
+        if job is None:
+            raise
+        return job
+
+
+def claim_job():
+    """Забирает из очереди самое старое задание и помечает его выполняемым.
+    SELECT ... FOR UPDATE SKIP LOCKED позволяет нескольким воркерам
+    разбирать очередь параллельно, не получая одно и то же задание.
+    Выполняемые задания, от которых дольше MAILING_JOB_LEASE секунд нет признака жизни,
+    считаются брошенными упавшим воркером и забираются повторно:
+    их запуск продолжится с получателей без успешной попытки."""
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.MAILING_JOB_LEASE)
+    with transaction.atomic():
+        job = (
+            MailingJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=MailingJob.QUEUED) | Q(status=MailingJob.RUNNING, heartbeat_at__lt=stale))
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == MailingJob.QUEUED:
+            job.started_at = now
+        job.status = MailingJob.RUNNING
+        job.heartbeat_at = now
+        job.save(update_fields=["status", "started_at", "heartbeat_at"])
+    return job
+
+
+class JobHeartbeat:
+    """Фоновый поток, который раз в MAILING_JOB_HEARTBEAT_INTERVAL секунд обновляет
+    признак жизни выполняемого задания. Признак обновляется независимо от хода отправки,
+    поэтому задание не считается брошенным, даже если одна отправка надолго зависла
+    на ответе сервера или ожидании ограничителя темпа. Упавший воркер перестаёт
+    обновлять признак вместе с потоком, и его задание забирает другой воркер."""
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or settings.MAILING_JOB_HEARTBEAT_INTERVAL
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    MailingJob.objects.filter(pk=self.job.pk, status=MailingJob.RUNNING).update(
+                        heartbeat_at=timezone.now()
+                    )
+                except DatabaseError:
+                    # БД недоступна: следующая попытка через интервал, аренда задания ещё не истекла.
+                    pass
+        finally:
+            # У потока своё соединение с БД, закрываем его вместе с потоком.
+            connection.close()
+
+
+def run_job(job):
+    """Выполняет задание: отправляет рассылку и записывает итог задания.
+    Пока идёт отправка, признак жизни задания обновляет JobHeartbeat.
+    Рассылки, завершённые до начала выполнения задания, не отправляются."""
+    try:
+        if job.mailing.status != Mailing.FINISHED:
+            with JobHeartbeat(job):
+                send_mailing(job.mailing, job=job)
+        job.status = MailingJob.DONE
+    except Exception as e:
+        job.status = MailingJob.FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at"])
+    return job
+
+
+def process_due_retries(limit=None):
+    """Забирает до limit повторов, время которых наступило, и отправляет их.
+    Повторы отбираются с SKIP LOCKED и сразу сдвигаются на MAILING_JOB_LEASE секунд вперёд,
+    чтобы другие воркеры их не взяли, пока идёт отправка; долгая отправка продлевает этот срок.
+    Возвращает число обработанных повторов."""
+    limit = limit or settings.MAILING_RETRY_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        retries = list(
+            MailingRetry.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("mailing__message", "recipient")
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:limit]
+        )
+        if not retries:
+            return 0
+        MailingRetry.objects.filter(pk__in=[retry.pk for retry in retries]).update(
+            next_attempt_at=now + timedelta(seconds=settings.MAILING_JOB_LEASE)
+        )
+    send_retries(retries)
+    return len(retries)
+
+
+def dispatch_due_mailings():
+    """Ставит в очередь созданные рассылки, у которых наступило время начала
+    и ещё не прошло время окончания, и переводит их в статус "запущена".
+    Рассылки отбираются одним запросом по индексу (status, start_at) с SKIP LOCKED,
+    поэтому несколько планировщиков не поставят одну рассылку в очередь дважды.
+    Возвращает число поставленных в очередь рассылок."""
+    now = timezone.now()
+    with transaction.atomic():
+        due = dict(
+            Mailing.objects.select_for_update(skip_locked=True)
+            .filter(status=Mailing.CREATED, start_at__lte=now)
+            .filter(Q(end_at__isnull=True) | Q(end_at__gt=now))
+            .order_by("start_at")
+            .values_list("pk", "owner_id")
+        )
+        if not due:
+            return 0
+        MailingJob.objects.bulk_create([MailingJob(mailing_id=pk) for pk in due], ignore_conflicts=True)
+        Mailing.objects.filter(pk__in=due).update(status=Mailing.ACTIVE)
+        invalidate_cache("mailing_list", set(due.values()))
+        invalidate_cache("mailing_attempts_list", set(due.values()))
+        adjust_dashboard_stats(active=len(due))
+    return len(due)
+
+
+def finish_expired_mailings():
+    """Одним UPDATE помечает завершёнными рассылки, у которых прошло время окончания.
+    Возвращает число завершённых рассылок."""
+    expired = Mailing.objects.filter(status__in=[Mailing.CREATED, Mailing.ACTIVE], end_at__lte=timezone.now())
+    with transaction.atomic():
+        owner_ids = set(expired.values_list("owner_id", flat=True).distinct())
+        finished = expired.update(status=Mailing.FINISHED)
+        if finished:
+            invalidate_cache("mailing_list", owner_ids)
+            invalidate_cache("mailing_attempts_list", owner_ids)
+            invalidate_dashboard_stats()
+    return finished
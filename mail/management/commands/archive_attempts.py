@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from mail.archiving import archive_attempts
+
+
+class Command(BaseCommand):
+    help = (
+        "Перенос старых попыток отправки в помесячные архивы NDJSON (gzip) в ATTEMPTS_ARCHIVE_DIR "
+        "с удалением из БД пачками. Итоги рассылок остаются в статистике рассылок."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ATTEMPTS_RETENTION_DAYS,
+            help="Переносить попытки старше этого числа дней.",
+        )
+        parser.add_argument("--batch-size", type=int, help="Сколько попыток переносить за одну транзакцию.")
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать попытки, ничего не переносить.")
+
+    def handle(self, *args, **options):
+        archived = archive_attempts(options["days"], options["batch_size"], options["dry_run"])
+        if options["dry_run"]:
+            self.stdout.write(f"Будет перенесено попыток: {archived}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Перенесено в архив попыток: {archived}"))
@@ -0,0 +1,178 @@
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from mail import sending
+from mail.jobs import enqueue_mailing, run_job
+from mail.models import Attempts, Mailing, MailingJob, Message, Recipient
+from mail.service import invalidate_dashboard_stats
+from mail.smtp_sink import SmtpSink
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер скорости отправки рассылки: заводит N получателей и рассылку, "
+        "отправляет её через очередь заданий на локальный SMTP-приёмник и пишет итоги в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=1000, help="Число получателей рассылки.")
+        parser.add_argument("--engine", default=None, help="Движок отправки (по умолчанию MAILING_ENGINE).")
+        parser.add_argument("--latency", type=float, default=0, help="Задержка ответа приёмника на письмо, сек.")
+        parser.add_argument("--failure-rate", type=float, default=0, help="Доля временных ошибок 451.")
+        parser.add_argument("--reject-rate", type=float, default=0, help="Доля постоянных ошибок 550.")
+        parser.add_argument(
+            "--disconnect-rate", type=float, default=0, help="Доля писем, после которых рвётся соединение."
+        )
+        parser.add_argument("--output", help="Файл, в который записать итоги замера в формате JSON.")
+        parser.add_argument("--compare", help="Файл с итогами прошлого замера для сравнения.")
+        parser.add_argument(
+            "--no-trace-memory",
+            action="store_true",
+            help="Не замерять пиковую память (tracemalloc замедляет отправку).",
+        )
+        parser.add_argument("--keep", action="store_true", help="Не удалять заведённые для замера данные.")
+
+    def handle(self, *args, **options):
+        mailing = self.seed(options["recipients"])
+        try:
+            with SmtpSink(
+                latency=options["latency"],
+                failure_rate=options["failure_rate"],
+                reject_rate=options["reject_rate"],
+                disconnect_rate=options["disconnect_rate"],
+            ) as sink:
+                result = self.run(mailing, sink, options)
+        finally:
+            if not options["keep"]:
+                mailing.owner.delete()
+
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        self.stdout.write(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(report)
+        if options["compare"]:
+            self.compare(result, options["compare"])
+
+    def seed(self, count):
+        """Заводит владельца, сообщение, count получателей и рассылку на них."""
+        tag = uuid.uuid4().hex[:12]
+        owner = CustomUser.objects.create(email=f"bench-{tag}@example.com", is_active=False)
+        message = Message.objects.create(subject="Замер скорости", text="Тестовое письмо", owner=owner)
+        mailing = Mailing.objects.create(message=message, owner=owner)
+        batch = 5000
+        for start in range(0, count, batch):
+            recipients = Recipient.objects.bulk_create(
+                [
+                    Recipient(full_name=f"Получатель {i}", email=f"bench-{tag}-{i}@example.com", owner=owner)
+                    for i in range(start, min(start + batch, count))
+                ]
+            )
+            Mailing.recipients.through.objects.bulk_create(
+                [Mailing.recipients.through(mailing=mailing, recipient=recipient) for recipient in recipients]
+            )
+        # bulk_create не посылает сигналов, поэтому счётчики главной страницы пересчитываются.
+        invalidate_dashboard_stats()
+        return mailing
+
+    def run(self, mailing, sink, options):
+        """Отправляет рассылку через задание очереди и собирает замеры."""
+        engine = options["engine"] or settings.MAILING_ENGINE
+        latencies = []
+
+        def timed_engine(messages):
+            # Время от передачи письма движку до получения результата его отправки.
+            started = {}
+
+            def tracked():
+                for recipient, message in messages:
+                    started[recipient] = time.perf_counter()
+                    yield recipient, message
+
+            for recipient, error in sending.ENGINES[engine](tracked()):
+                latencies.append(time.perf_counter() - started.pop(recipient))
+                yield recipient, error
+
+        sending.ENGINES["bench"] = timed_engine
+        trace_memory = not options["no_trace_memory"]
+        try:
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_HOST=sink.host,
+                EMAIL_PORT=sink.port,
+                EMAIL_USE_TLS=False,
+                EMAIL_USE_SSL=False,
+                EMAIL_HOST_USER="bench@example.com",
+                EMAIL_HOST_PASSWORD="",
+                MAILING_ENGINE="bench",
+                MAILING_RATE_LIMIT=0,
+            ):
+                job = enqueue_mailing(mailing)
+                # Задание выполняется здесь же, а не воркером очереди.
+                MailingJob.objects.filter(pk=job.pk).update(status=MailingJob.RUNNING, started_at=timezone.now())
+                if trace_memory:
+                    tracemalloc.start()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    job = run_job(job)
+                    elapsed = time.perf_counter() - started
+                peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            del sending.ENGINES["bench"]
+
+        sent = len(latencies)
+        latencies.sort()
+        db_time = sum(float(query["time"]) for query in queries.captured_queries)
+        return {
+            "date": timezone.now().isoformat(),
+            "engine": engine,
+            "recipients": options["recipients"],
+            "sink": {
+                "latency": options["latency"],
+                "failure_rate": options["failure_rate"],
+                "reject_rate": options["reject_rate"],
+                "disconnect_rate": options["disconnect_rate"],
+                "stats": dict(sink.stats),
+            },
+            "job_status": job.status,
+            "sent": sent,
+            "success": Attempts.objects.filter(mailing=mailing, attempt_status=Attempts.SUCCESS).count(),
+            "failure": Attempts.objects.filter(mailing=mailing, attempt_status=Attempts.FAILURE).count(),
+            "elapsed": round(elapsed, 4),
+            "messages_per_sec": round(sent / elapsed, 2) if elapsed else None,
+            "latency_p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+            "latency_p99_ms": round(latencies[int(0.99 * (sent - 1))] * 1000, 3) if latencies else None,
+            "db_queries": len(queries.captured_queries),
+            "db_queries_per_message": round(len(queries.captured_queries) / sent, 4) if sent else None,
+            "db_time": round(db_time, 4),
+            "db_time_per_10k": round(db_time / sent * 10000, 4) if sent else None,
+            "peak_memory_bytes": peak_memory,
+        }
+
+    def compare(self, result, path):
+        """Печатает изменение основных замеров относительно прошлого прогона."""
+        with open(path, encoding="utf-8") as file:
+            previous = json.load(file)
+        for key in (
+            "messages_per_sec",
+            "latency_p50_ms",
+            "latency_p99_ms",
+            "db_queries_per_message",
+            "db_time_per_10k",
+            "peak_memory_bytes",
+        ):
+            before, after = previous.get(key), result.get(key)
+            if before and after is not None:
+                self.stdout.write(f"{key}: {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
@@ -0,0 +1,47 @@
+import csv
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from mail.importing import ImportFileError, import_recipients, read_rows
+from users.models import CustomUser, normalize_email
+
+
+class Command(BaseCommand):
+    help = (
+        "Импорт получателей из файла CSV или XLSX со столбцами email, full_name и comment. "
+        "Файл читается потоково и записывается пачками, отклонённые строки выводятся отчётом в CSV."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу CSV или XLSX.")
+        parser.add_argument("--owner", help="Адрес электронной почты владельца получателей.")
+        parser.add_argument("--chunk-size", type=int, help="Сколько строк записывать в БД за раз.")
+        parser.add_argument("--report", help="Файл для отчёта об отклонённых строках (по умолчанию stderr).")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options["owner"]:
+            owner = CustomUser.objects.filter(email__lower=normalize_email(options["owner"])).first()
+            if owner is None:
+                raise CommandError(f"Пользователь {options['owner']} не найден")
+        report_file = open(options["report"], "w", newline="", encoding="utf-8") if options["report"] else sys.stderr
+        writer = csv.writer(report_file)
+        writer.writerow(["line", "email", "error"])
+        rejected = 0
+
+        def report(line, email, error):
+            nonlocal rejected
+            rejected += 1
+            writer.writerow([line, email, error])
+
+        try:
+            with open(options["path"], "rb") as file:
+                rows = read_rows(file, options["path"])
+                created = import_recipients(rows, owner, report, options["chunk_size"])
+        except (ImportFileError, OSError) as error:
+            raise CommandError(str(error))
+        finally:
+            if report_file is not sys.stderr:
+                report_file.close()
+        self.stdout.write(self.style.SUCCESS(f"Импортировано получателей: {created}, отклонено строк: {rejected}"))
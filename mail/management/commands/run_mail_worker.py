@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from mail.jobs import claim_job, process_due_retries, run_job
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди рассылок: забирает задания из БД, отправляет рассылки и отложенные повторы."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Разобрать очередь и завершиться, не дожидаясь новых заданий."
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=settings.MAILING_WORKER_POLL_INTERVAL,
+            help="Пауза в секундах между опросами пустой очереди.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                job = claim_job()
+                if job is None:
+                    retried = process_due_retries()
+                    if retried:
+                        self.stdout.write(f"Повторно отправлено писем: {retried}")
+                        continue
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+                    continue
+                self.stdout.write(f"Отправка рассылки {job.mailing_id}...")
+                job = run_job(job)
+                if job.error:
+                    self.stdout.write(self.style.ERROR(f"Рассылка {job.mailing_id}: {job.error}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"Рассылка {job.mailing_id} отправлена"))
+        except KeyboardInterrupt:
+            self.stdout.write("Воркер остановлен")
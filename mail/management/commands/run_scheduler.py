@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from mail.jobs import dispatch_due_mailings, finish_expired_mailings
+
+
+class Command(BaseCommand):
+    help = "Планировщик рассылок: запускает рассылки по времени начала и завершает по времени окончания."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Выполнить одну проверку расписания и завершиться.")
+        parser.add_argument(
+            "--tick",
+            type=float,
+            default=settings.MAILING_SCHEDULER_TICK,
+            help="Период проверки расписания в секундах.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                started = time.monotonic()
+                finished = finish_expired_mailings()
+                dispatched = dispatch_due_mailings()
+                if finished:
+                    self.stdout.write(self.style.SUCCESS(f"Завершено рассылок: {finished}"))
+                if dispatched:
+                    self.stdout.write(self.style.SUCCESS(f"Поставлено в очередь рассылок: {dispatched}"))
+                if options["once"]:
+                    break
+                time.sleep(max(0, options["tick"] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write("Планировщик остановлен")
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0002_alter_attempts_options_alter_mailing_options_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("в очереди", "в очереди"),
+                            ("выполняется", "выполняется"),
+                            ("выполнено", "выполнено"),
+                            ("ошибка", "ошибка"),
+                        ],
+                        default="в очереди",
+                        max_length=100,
+                        verbose_name="Статус задания",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Поставлено в очередь"
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Начало выполнения"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Окончание выполнения"
+                    ),
+                ),
+                (
+                    "error",
+                    models.TextField(blank=True, default="", verbose_name="Ошибка"),
+                ),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="mail.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "задание рассылки",
+                "verbose_name_plural": "задания рассылки",
+                "ordering": ["created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "created_at"],
+                        name="mail_job_status_created_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="mailingjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["в очереди", "выполняется"])),
+                fields=("mailing",),
+                name="mail_job_one_active_per_mailing",
+            ),
+        ),
+    ]
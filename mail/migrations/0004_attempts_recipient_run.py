@@ -0,0 +1,74 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def fill_job_run_ids(apps, schema_editor):
+    MailingJob = apps.get_model("mail", "MailingJob")
+    for job in MailingJob.objects.only("pk"):
+        job.run_id = uuid.uuid4()
+        job.save(update_fields=["run_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0003_mailingjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attempts",
+            name="recipient",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="attempts",
+                to="mail.recipient",
+                verbose_name="Получатель",
+            ),
+        ),
+        migrations.AddField(
+            model_name="attempts",
+            name="run_id",
+            field=models.UUIDField(
+                blank=True, null=True, verbose_name="Запуск рассылки"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailingjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Последний признак жизни"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailingjob",
+            name="run_id",
+            field=models.UUIDField(
+                editable=False, null=True, verbose_name="Запуск рассылки"
+            ),
+        ),
+        migrations.RunPython(fill_job_run_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="mailingjob",
+            name="run_id",
+            field=models.UUIDField(
+                default=uuid.uuid4,
+                editable=False,
+                unique=True,
+                verbose_name="Запуск рассылки",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attempts",
+            index=models.Index(
+                condition=models.Q(("attempt_status", "успешно")),
+                fields=["run_id", "recipient"],
+                name="mail_attempt_run_success_idx",
+            ),
+        ),
+    ]
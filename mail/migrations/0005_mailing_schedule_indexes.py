@@ -0,0 +1,25 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0004_attempts_recipient_run"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="mailing",
+            index=models.Index(
+                fields=["status", "start_at"], name="mail_mailing_status_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailing",
+            index=models.Index(
+                fields=["status", "end_at"], name="mail_mailing_status_end_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0005_mailing_schedule_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingRetry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("run_id", models.UUIDField(verbose_name="Запуск рассылки")),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=1, verbose_name="Сделано попыток"
+                    ),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(verbose_name="Следующая попытка"),
+                ),
+                (
+                    "last_error",
+                    models.TextField(
+                        blank=True, default="", verbose_name="Последняя ошибка"
+                    ),
+                ),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="retries",
+                        to="mail.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="retries",
+                        to="mail.recipient",
+                        verbose_name="Получатель",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "повтор отправки",
+                "verbose_name_plural": "повторы отправки",
+                "ordering": ["next_attempt_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["next_attempt_at"], name="mail_retry_next_attempt_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="mailingretry",
+            constraint=models.UniqueConstraint(
+                fields=("run_id", "recipient"), name="mail_retry_unique_run_recipient"
+            ),
+        ),
+    ]
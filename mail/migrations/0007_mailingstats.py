@@ -0,0 +1,85 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_mailing_stats(apps, schema_editor):
+    Attempts = apps.get_model("mail", "Attempts")
+    MailingStats = apps.get_model("mail", "MailingStats")
+    counts = (
+        Attempts.objects.order_by()
+        .values("mailing_id", "mailing__owner_id")
+        .annotate(
+            success=models.Count("pk", filter=models.Q(attempt_status="успешно")),
+            failure=models.Count("pk", filter=~models.Q(attempt_status="успешно")),
+        )
+    )
+    MailingStats.objects.bulk_create(
+        (
+            MailingStats(
+                mailing_id=row["mailing_id"],
+                owner_id=row["mailing__owner_id"],
+                success=row["success"],
+                failure=row["failure"],
+            )
+            for row in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("mail", "0006_mailingretry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingStats",
+            fields=[
+                (
+                    "mailing",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="mail.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "success",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Успешных попыток"
+                    ),
+                ),
+                (
+                    "failure",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Неуспешных попыток"
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="mailing_stats",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "статистика рассылки",
+                "verbose_name_plural": "статистика рассылок",
+            },
+        ),
+        migrations.RunPython(fill_mailing_stats, migrations.RunPython.noop),
+    ]
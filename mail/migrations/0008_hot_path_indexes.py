@@ -0,0 +1,71 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("mail", "0007_mailingstats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="attempts",
+            index=models.Index(
+                fields=["mailing", "attempt_date"], name="mail_attempt_mailing_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attempts",
+            index=models.Index(
+                fields=["owner", "attempt_status"], name="mail_attempt_owner_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attempts",
+            index=models.Index(
+                fields=["owner", "attempt_date"], name="mail_attempt_owner_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailing",
+            index=models.Index(
+                fields=["owner", "status"], name="mail_mailing_owner_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipient",
+            index=models.Index(
+                fields=["owner", "full_name"], name="mail_recipient_owner_name_idx"
+            ),
+        ),
+        # Одиночные индексы по FK удаляются после создания составных, которые их заменяют.
+        migrations.AlterField(
+            model_name="attempts",
+            name="mailing",
+            field=models.ForeignKey(
+                db_index=False,
+                help_text="Выберите рассылку для попытки",
+                on_delete=django.db.models.deletion.CASCADE,
+                to="mail.mailing",
+                verbose_name="Рассылка",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="attempts",
+            name="owner",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="mailing_attempts",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Владелец",
+            ),
+        ),
+    ]
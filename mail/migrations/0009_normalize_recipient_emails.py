@@ -0,0 +1,72 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models.functions import Lower, Trim
+
+
+def merge_recipient(apps, keep_id, duplicate_ids):
+    """Переносит рассылки, попытки и повторы получателей-дублей на получателя keep_id и удаляет дубли."""
+    Mailing = apps.get_model("mail", "Mailing")
+    Attempts = apps.get_model("mail", "Attempts")
+    MailingRetry = apps.get_model("mail", "MailingRetry")
+    Recipient = apps.get_model("mail", "Recipient")
+    Through = Mailing.recipients.through
+    mailing_ids = Through.objects.filter(recipient_id__in=duplicate_ids).values_list(
+        "mailing_id", flat=True
+    )
+    Through.objects.bulk_create(
+        [
+            Through(mailing_id=mailing_id, recipient_id=keep_id)
+            for mailing_id in set(mailing_ids)
+        ],
+        ignore_conflicts=True,
+    )
+    Through.objects.filter(recipient_id__in=duplicate_ids).delete()
+    Attempts.objects.filter(recipient_id__in=duplicate_ids).update(recipient_id=keep_id)
+    kept_runs = set(
+        MailingRetry.objects.filter(recipient_id=keep_id).values_list(
+            "run_id", flat=True
+        )
+    )
+    for retry in MailingRetry.objects.filter(recipient_id__in=duplicate_ids):
+        if retry.run_id in kept_runs:
+            retry.delete()
+        else:
+            retry.recipient_id = keep_id
+            retry.save(update_fields=["recipient"])
+            kept_runs.add(retry.run_id)
+    Recipient.objects.filter(pk__in=duplicate_ids).delete()
+
+
+def normalize_recipient_emails(apps, schema_editor):
+    """Приводит адреса получателей к нормализованному виду. Получатели, чьи адреса
+    совпадают без учёта регистра и пробелов, сливаются в получателя с наименьшим id."""
+    Recipient = apps.get_model("mail", "Recipient")
+    duplicates = (
+        Recipient.objects.order_by()
+        .values(normalized=Lower(Trim("email")))
+        .annotate(count=models.Count("pk"), keep_id=models.Min("pk"))
+        .filter(count__gt=1)
+    )
+    for group in list(duplicates):
+        duplicate_ids = list(
+            Recipient.objects.annotate(normalized=Lower(Trim("email")))
+            .filter(normalized=group["normalized"])
+            .exclude(pk=group["keep_id"])
+            .values_list("pk", flat=True)
+        )
+        merge_recipient(apps, group["keep_id"], duplicate_ids)
+    Recipient.objects.exclude(email=Lower(Trim("email"))).update(
+        email=Lower(Trim("email"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0008_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_recipient_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0009_normalize_recipient_emails"),
+    ]
+
+    operations = [
+        # Уникальность без учёта регистра вводится до того, как снимается прежний уникальный индекс.
+        migrations.AddConstraint(
+            model_name="recipient",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("email"),
+                name="mail_recipient_email_lower_uniq",
+                violation_error_message="Такой адрес электронной почты уже есть.",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipient",
+            name="email",
+            field=models.EmailField(
+                help_text="Введите адрес электронной почты получателя",
+                max_length=254,
+                verbose_name="Адрес электронной почты",
+            ),
+        ),
+    ]
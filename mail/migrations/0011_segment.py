@@ -0,0 +1,95 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("mail", "0010_recipient_email_lower_uniq"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mailing",
+            name="recipients",
+            field=models.ManyToManyField(
+                blank=True,
+                help_text="Выберите получателей для рассылки",
+                to="mail.recipient",
+                verbose_name="Получатели",
+            ),
+        ),
+        migrations.CreateModel(
+            name="Segment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Введите название сегмента",
+                        max_length=150,
+                        verbose_name="Название сегмента",
+                    ),
+                ),
+                (
+                    "comment_contains",
+                    models.CharField(
+                        blank=True,
+                        help_text="Отбирать получателей, в комментарии которых есть этот текст (пусто - всех)",
+                        max_length=150,
+                        verbose_name="Комментарий содержит",
+                    ),
+                ),
+                (
+                    "email_domain",
+                    models.CharField(
+                        blank=True,
+                        help_text="Отбирать получателей с адресами в этом домене, например example.com (пусто - всех)",
+                        max_length=150,
+                        verbose_name="Домен адреса",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="segments",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сегмент",
+                "verbose_name_plural": "сегменты",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="segment",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Выберите сегмент вместо списка получателей",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="mailings",
+                to="mail.segment",
+                verbose_name="Сегмент получателей",
+            ),
+        ),
+    ]
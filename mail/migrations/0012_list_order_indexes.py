@@ -0,0 +1,32 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail", "0011_segment"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="attempts",
+            index=models.Index(
+                fields=["attempt_date", "attempt_status", "mailing", "id"],
+                name="mail_attempt_key_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["subject", "id"], name="mail_message_subject_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipient",
+            index=models.Index(
+                fields=["full_name", "id"], name="mail_recipient_name_idx"
+            ),
+        ),
+    ]
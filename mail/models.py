@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
-from users.models import CustomUser
+from django.db.models.functions import Lower
+from users.models import CustomUser, normalize_email
 
 
 class Recipient(models.Model):
@@ -9,8 +12,8 @@ class Recipient(models.Model):
         verbose_name="ФИО получателя рассылки",
         help_text="Введите ФИО получателя",
     )
+    # Уникальность адреса без учёта регистра обеспечивает mail_recipient_email_lower_uniq.
     email = models.EmailField(
-        unique=True,
         verbose_name="Адрес электронной почты",
         help_text="Введите адрес электронной почты получателя",
     )
@@ -27,10 +30,28 @@ class Recipient(models.Model):
     def __str__(self):
         return f"{self.full_name} - {self.email}"
 
+    def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "получатель"
         verbose_name_plural = "получатели"
         ordering = ["full_name"]
+        indexes = [
+            # Список получателей владельца в порядке сортировки.
+            models.Index(fields=["owner", "full_name"], name="mail_recipient_owner_name_idx"),
+            # Список получателей всех владельцев в порядке сортировки.
+            models.Index(fields=["full_name", "id"], name="mail_recipient_name_idx"),
+        ]
+        constraints = [
+            # Адрес уникален без учёта регистра; поиск по нему - email__lower=normalize_email(...).
+            models.UniqueConstraint(
+                Lower("email"),
+                name="mail_recipient_email_lower_uniq",
+                violation_error_message="Такой адрес электронной почты уже есть.",
+            ),
+        ]
 
 
 class Message(models.Model):
@@ -53,6 +74,43 @@ class Message(models.Model):
         verbose_name = "сообщение"
         verbose_name_plural = "сообщения"
         ordering = ["subject"]
+        indexes = [
+            # Список сообщений всех владельцев в порядке сортировки.
+            models.Index(fields=["subject", "id"], name="mail_message_subject_idx"),
+        ]
+
+
+class Segment(models.Model):
+    """Модель сегмента получателей: сохранённый отбор получателей владельца.
+    Сегмент не хранит список получателей, а вычисляется запросом к БД при отправке рассылки."""
+    name = models.CharField(
+        max_length=150,
+        verbose_name="Название сегмента",
+        help_text="Введите название сегмента",
+    )
+    comment_contains = models.CharField(
+        max_length=150,
+        verbose_name="Комментарий содержит",
+        help_text="Отбирать получателей, в комментарии которых есть этот текст (пусто - всех)",
+        blank=True,
+    )
+    email_domain = models.CharField(
+        max_length=150,
+        verbose_name="Домен адреса",
+        help_text="Отбирать получателей с адресами в этом домене, например example.com (пусто - всех)",
+        blank=True,
+    )
+    owner = models.ForeignKey(
+        CustomUser, verbose_name="Владелец", on_delete=models.CASCADE, related_name="segments", null=True, blank=True,
+    )
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "сегмент"
+        verbose_name_plural = "сегменты"
+        ordering = ["name"]
 
 
 class Mailing(models.Model):
@@ -88,7 +146,16 @@ class Mailing(models.Model):
         help_text="Выберите сообщение для рассылки",
     )
     recipients = models.ManyToManyField(
-        Recipient, verbose_name="Получатели", help_text="Выберите получателей для рассылки",
+        Recipient, verbose_name="Получатели", help_text="Выберите получателей для рассылки", blank=True,
+    )
+    segment = models.ForeignKey(
+        Segment,
+        on_delete=models.PROTECT,
+        verbose_name="Сегмент получателей",
+        help_text="Выберите сегмент вместо списка получателей",
+        related_name="mailings",
+        null=True,
+        blank=True,
     )
     owner = models.ForeignKey(
         CustomUser, verbose_name="Владелец", on_delete=models.CASCADE, related_name="mailings", null=True, blank=True,
@@ -104,6 +171,13 @@ class Mailing(models.Model):
         permissions = [
             ("can_finish_mailing", "can finish mailing"),
         ]
+        indexes = [
+            # Поиск рассылок, которые пора запустить или завершить, планировщиком run_scheduler.
+            models.Index(fields=["status", "start_at"], name="mail_mailing_status_start_idx"),
+            models.Index(fields=["status", "end_at"], name="mail_mailing_status_end_idx"),
+            # Рассылки владельца, сгруппированные по статусу.
+            models.Index(fields=["owner", "status"], name="mail_mailing_owner_status_idx"),
+        ]
 
 
 class Attempts(models.Model):
@@ -129,15 +203,151 @@ class Attempts(models.Model):
         on_delete=models.CASCADE,
         verbose_name="Рассылка",
         help_text="Выберите рассылку для попытки",
+        # Индекс по рассылке - первая колонка mail_attempt_mailing_date_idx.
+        db_index=False,
     )
     owner = models.ForeignKey(
-        CustomUser, verbose_name="Владелец", on_delete=models.CASCADE, related_name="mailing_attempts", null=True, blank=True,
+        CustomUser,
+        verbose_name="Владелец",
+        on_delete=models.CASCADE,
+        related_name="mailing_attempts",
+        null=True,
+        blank=True,
+        # Индекс по владельцу - первая колонка составных индексов попыток владельца.
+        db_index=False,
+    )
+    recipient = models.ForeignKey(
+        Recipient, verbose_name="Получатель", on_delete=models.SET_NULL, related_name="attempts", null=True, blank=True,
     )
+    run_id = models.UUIDField(verbose_name="Запуск рассылки", null=True, blank=True)
 
     def __str__(self):
-        return f"{self.mailing.message.subject} - {self.attempt_status} - {self.mail_server_response} - {self.attempt_date}"
+        return (
+            f"{self.mailing.message.subject} - {self.attempt_status} - "
+            f"{self.mail_server_response} - {self.attempt_date}"
+        )
 
     class Meta:
         verbose_name = "попытка рассылки"
         verbose_name_plural = "попытки рассылки"
         ordering = ["attempt_date", "attempt_status", "mailing"]
+        indexes = [
+            # Поиск получателей, которым запуск рассылки уже доставил письмо.
+            models.Index(
+                fields=["run_id", "recipient"],
+                condition=models.Q(attempt_status="успешно"),
+                name="mail_attempt_run_success_idx",
+            ),
+            # Попытки рассылки по дате.
+            models.Index(fields=["mailing", "attempt_date"], name="mail_attempt_mailing_date_idx"),
+            # Попытки владельца по статусу.
+            models.Index(fields=["owner", "attempt_status"], name="mail_attempt_owner_status_idx"),
+            # Список попыток владельца в порядке сортировки.
+            models.Index(fields=["owner", "attempt_date"], name="mail_attempt_owner_date_idx"),
+            # Список попыток всех владельцев и выгрузка попыток в порядке сортировки.
+            models.Index(fields=["attempt_date", "attempt_status", "mailing", "id"], name="mail_attempt_key_idx"),
+        ]
+
+
+class MailingJob(models.Model):
+    """Модель задания на отправку рассылки.
+    Задания складываются в очередь в БД и разбираются воркером run_mail_worker."""
+    QUEUED = "в очереди"
+    RUNNING = "выполняется"
+    DONE = "выполнено"
+    FAILED = "ошибка"
+    STATUS_CHOICES = [
+        (QUEUED, "в очереди"),
+        (RUNNING, "выполняется"),
+        (DONE, "выполнено"),
+        (FAILED, "ошибка"),
+    ]
+    mailing = models.ForeignKey(
+        Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="jobs",
+    )
+    status = models.CharField(
+        max_length=100,
+        verbose_name="Статус задания",
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+    )
+    created_at = models.DateTimeField(verbose_name="Поставлено в очередь", auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name="Начало выполнения", null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name="Окончание выполнения", null=True, blank=True)
+    error = models.TextField(verbose_name="Ошибка", blank=True, default="")
+    run_id = models.UUIDField(verbose_name="Запуск рассылки", default=uuid.uuid4, editable=False, unique=True)
+    heartbeat_at = models.DateTimeField(verbose_name="Последний признак жизни", null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.mailing_id} - {self.status} - {self.created_at}"
+
+    class Meta:
+        verbose_name = "задание рассылки"
+        verbose_name_plural = "задания рассылки"
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="mail_job_status_created_idx"),
+        ]
+        constraints = [
+            # Одна рассылка не может стоять в очереди дважды.
+            models.UniqueConstraint(
+                fields=["mailing"],
+                condition=models.Q(status__in=["в очереди", "выполняется"]),
+                name="mail_job_one_active_per_mailing",
+            ),
+        ]
+
+
+class MailingRetry(models.Model):
+    """Модель письма, отложенного для повторной отправки после временной ошибки SMTP.
+    Повторы разбирает воркер run_mail_worker с экспоненциальной задержкой."""
+    mailing = models.ForeignKey(
+        Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="retries",
+    )
+    recipient = models.ForeignKey(
+        Recipient, on_delete=models.CASCADE, verbose_name="Получатель", related_name="retries",
+    )
+    run_id = models.UUIDField(verbose_name="Запуск рассылки")
+    attempts = models.PositiveIntegerField(verbose_name="Сделано попыток", default=1)
+    next_attempt_at = models.DateTimeField(verbose_name="Следующая попытка")
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True, default="")
+
+    def __str__(self):
+        return f"{self.mailing_id} - {self.recipient_id} - {self.attempts} - {self.next_attempt_at}"
+
+    class Meta:
+        verbose_name = "повтор отправки"
+        verbose_name_plural = "повторы отправки"
+        ordering = ["next_attempt_at"]
+        indexes = [
+            models.Index(fields=["next_attempt_at"], name="mail_retry_next_attempt_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["run_id", "recipient"], name="mail_retry_unique_run_recipient"),
+        ]
+
+
+class MailingStats(models.Model):
+    """Модель счётчиков попыток отправки рассылки.
+    Счётчики увеличиваются при записи попыток и не уменьшаются при их удалении,
+    поэтому итоги по рассылке не зависят от размера истории попыток."""
+    mailing = models.OneToOneField(
+        Mailing, on_delete=models.CASCADE, verbose_name="Рассылка", related_name="stats", primary_key=True,
+    )
+    owner = models.ForeignKey(
+        CustomUser,
+        verbose_name="Владелец",
+        on_delete=models.CASCADE,
+        related_name="mailing_stats",
+        null=True,
+        blank=True,
+    )
+    success = models.PositiveIntegerField(verbose_name="Успешных попыток", default=0)
+    failure = models.PositiveIntegerField(verbose_name="Неуспешных попыток", default=0)
+
+    def __str__(self):
+        return f"{self.mailing_id} - {self.success} - {self.failure}"
+
+    class Meta:
+        verbose_name = "статистика рассылки"
+        verbose_name_plural = "статистика рассылок"
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
+
+from config.settings import LIST_PAGE_SIZE
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Кодирует дату и время с микросекундами: DjangoJSONEncoder округляет их
+    до миллисекунд, и курсор пропускал бы строки внутри одной миллисекунды."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Упаковывает значения ключа сортировки строки в строку для адреса страницы."""
+    data = json.dumps(list(values), cls=CursorEncoder, ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор страницы. Для испорченного курсора возвращает None,
+    и список показывается с первой страницы."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def get_key_field(model, path):
+    """Возвращает поле модели по пути ключа сортировки: "pk", имя поля, имя столбца
+    внешнего ключа ("mailing_id") или путь через связи ("message__subject")."""
+    *relations, name = path.split("__")
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.pk if name == "pk" else model._meta.get_field(name)
+
+
+def clean_cursor(model, key_fields, values):
+    """Приводит значения курсора к типам полей ключа сортировки.
+    Курсор с лишними или недостающими значениями или со значениями не того типа
+    считается испорченным: возвращается None, и список показывается с первой страницы."""
+    if values is None or len(values) != len(key_fields):
+        return None
+    try:
+        values = [get_key_field(model, field).to_python(value) for field, value in zip(key_fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+    return None if None in values else values
+
+
+def keyset_filter(key_fields, values, lookup):
+    """Условие "строка после (или до) строки с ключом values" для сортировки по key_fields.
+    Первое поле дополнительно ограничено нестрогим условием, чтобы БД могла взять
+    диапазон по индексу, а не перебирать строки с начала, как при OFFSET."""
+    condition = Q()
+    for index, field in enumerate(key_fields):
+        condition |= Q(**{field: value for field, value in zip(key_fields[:index], values)}) & Q(
+            **{f"{field}__{lookup}": values[index]}
+        )
+    return Q(**{f"{key_fields[0]}__{lookup}e": values[0]}) & condition
+
+
+def paginate(queryset, key_fields, fields=None, after=None, before=None, size=None):
+    """Возвращает страницу queryset по курсору: строки после курсора after или до курсора before.
+    key_fields - поля сортировки, последним должно идти уникальное поле, обычно pk.
+    Если задан fields, строки читаются как кортежи значений этих полей, иначе как объекты модели
+    (тогда key_fields должны быть полями самой модели).
+    Возвращает строки страницы, курсор следующей страницы и курсор предыдущей (или None)."""
+    size = size or LIST_PAGE_SIZE
+    cursor = clean_cursor(queryset.model, key_fields, decode_cursor(before or after or ""))
+    backwards = cursor is not None and bool(before)
+    if backwards:
+        queryset = queryset.filter(keyset_filter(key_fields, cursor, "lt"))
+        queryset = queryset.order_by(*[f"-{field}" for field in key_fields])
+    else:
+        if cursor is not None:
+            queryset = queryset.filter(keyset_filter(key_fields, cursor, "gt"))
+        queryset = queryset.order_by(*key_fields)
+
+    if fields is None:
+        rows = list(queryset[: size + 1])
+        get_key = lambda row: tuple(getattr(row, field) for field in key_fields)  # noqa: E731
+        strip = lambda row: row  # noqa: E731
+    else:
+        rows = list(queryset.values_list(*fields, *key_fields)[: size + 1])
+        get_key = lambda row: row[len(fields) :]  # noqa: E731
+        strip = lambda row: row[: len(fields)]  # noqa: E731
+
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return [], None, None
+    if backwards:
+        next_cursor = encode_cursor(get_key(rows[-1]))
+        previous_cursor = encode_cursor(get_key(rows[0])) if more else None
+    else:
+        next_cursor = encode_cursor(get_key(rows[-1])) if more else None
+        previous_cursor = encode_cursor(get_key(rows[0])) if cursor is not None else None
+    return [strip(row) for row in rows], next_cursor, previous_cursor
+
+
+class KeysetPaginationMixin:
+    """Примесь списков с постраничным выводом по курсору (?after=... и ?before=...).
+    Метод get_page(after, before) возвращает строки страницы и курсоры соседних страниц.
+    Страница загружается лениво, поэтому при попадании в кэш фрагмента не читается."""
+
+    def get_page(self, after, before):
+        raise NotImplementedError
+
+    def get_queryset(self):
+        after, before = self.request.GET.get("after"), self.request.GET.get("before")
+        self.page = SimpleLazyObject(lambda: self.get_page(after, before))
+        return SimpleLazyObject(lambda: self.page[0])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["next_cursor"] = SimpleLazyObject(lambda: self.page[1] or "")
+        context["previous_cursor"] = SimpleLazyObject(lambda: self.page[2] or "")
+        context["page_key"] = f"{self.request.GET.get('after', '')}:{self.request.GET.get('before', '')}"
+        return context
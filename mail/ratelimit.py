@@ -0,0 +1,66 @@
+import time
+
+import redis
+from django.conf import settings
+
+# Ведро токенов хранится в Redis, поэтому темп отправки общий для всех процессов.
+# Токены пополняются со скоростью rate в секунду, но не больше burst.
+# Скрипт либо забирает токен и возвращает 0, либо возвращает, сколько секунд ждать.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """Ограничитель темпа отправки писем по алгоритму ведра токенов."""
+
+    def __init__(self, client, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self):
+        """Ждёт, пока в ведре появится токен, и забирает его.
+        Если Redis недоступен, не задерживает отправку."""
+        while True:
+            try:
+                wait = float(self.script(keys=[self.key], args=[self.rate, self.burst]))
+            except redis.RedisError:
+                return
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+_limiters = {}
+
+
+def get_rate_limiter():
+    """Возвращает ограничитель темпа для SMTP-аккаунта EMAIL_HOST_USER
+    или None, если ограничение отключено."""
+    if not settings.CACHE_ENABLED or not settings.MAILING_RATE_LIMIT:
+        return None
+    account = settings.EMAIL_HOST_USER
+    if account not in _limiters:
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        _limiters[account] = TokenBucket(
+            client, f"mail:ratelimit:{account}", settings.MAILING_RATE_LIMIT, settings.MAILING_RATE_BURST
+        )
+    return _limiters[account]
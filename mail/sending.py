@@ -0,0 +1,413 @@
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import Attempts, Mailing, MailingJob, MailingRetry, MailingStats
+from .ratelimit import get_rate_limiter
+from .service import adjust_dashboard_stats, get_mailing_recipients, invalidate_cache
+
+
+class MailSession:
+    """SMTP-сессия рассылки. Держит одно соединение на всю рассылку
+    (или на пачку из batch_size писем) и переподключается,
+    если сервер оборвал соединение посреди отправки."""
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.MAILING_CONNECTION_BATCH_SIZE
+        self.connection = get_connection(fail_silently=False)
+        self.rate_limiter = get_rate_limiter()
+        self.opened = False
+        self.sent_in_batch = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.connection.open()
+        self.opened = True
+        self.sent_in_batch = 0
+
+    def close(self):
+        self.opened = False
+        try:
+            self.connection.close()
+        except smtplib.SMTPException:
+            # Соединение уже оборвано, закрывать нечего.
+            pass
+
+    def reconnect(self):
+        self.close()
+        self.open()
+
+    def take_token(self):
+        """Ждёт токен общего для всех процессов ведра токенов на отправку одного письма."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+    def send(self, message, token_taken=False):
+        """Отправляет одно письмо через открытое соединение.
+        Обрыв соединения сервером не считается ошибкой письма:
+        сессия переподключается и повторяет отправку один раз.
+        На каждую отправку, и на повтор после обрыва тоже, берётся токен ограничителя темпа;
+        token_taken означает, что токен на первую отправку уже взят."""
+        if not token_taken:
+            self.take_token()
+        if not self.opened:
+            self.open()
+        elif self.sent_in_batch >= self.batch_size:
+            self.reconnect()
+        try:
+            self.connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            self.reconnect()
+            self.take_token()
+            self.connection.send_messages([message])
+        self.sent_in_batch += 1
+
+
+def send_serial(messages):
+    """Движок последовательной отправки: все письма по очереди через одну сессию.
+    Принимает пары (адрес, письмо), отдаёт пары (адрес, ошибка или None)."""
+    with MailSession() as session:
+        for recipient, message in messages:
+            try:
+                session.send(message)
+                yield recipient, None
+            except Exception as e:
+                yield recipient, e
+
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def get_host_slots(host):
+    """Возвращает семафор, ограничивающий число одновременных SMTP-сессий
+    к одному серверу в пределах процесса."""
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(settings.MAILING_HOST_CONCURRENCY)
+        return _host_slots[host]
+
+
+def send_threaded(messages):
+    """Движок параллельной отправки: письма распределяются по пулу потоков,
+    у каждого потока своя SMTP-сессия. Число потоков задаёт MAILING_CONCURRENCY,
+    число одновременных отправок на один сервер ограничено MAILING_HOST_CONCURRENCY.
+    Результаты отдаются в порядке исходных писем."""
+    concurrency = min(settings.MAILING_CONCURRENCY, settings.MAILING_HOST_CONCURRENCY)
+    host_slots = get_host_slots(settings.EMAIL_HOST)
+    local = threading.local()
+    sessions = []
+
+    def send_one(message):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = MailSession()
+            sessions.append(session)
+        # Токен берётся до слота сервера: поток, ждущий токен, не занимает слот у других потоков.
+        session.take_token()
+        with host_slots:
+            session.send(message, token_taken=True)
+
+    def result(recipient, future):
+        return recipient, future.exception()
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for recipient, message in messages:
+                pending.append((recipient, executor.submit(send_one, message)))
+                # Держим ограниченное окно писем в работе, чтобы не копить всю рассылку в памяти.
+                if len(pending) >= concurrency * 4:
+                    yield result(*pending.popleft())
+            while pending:
+                yield result(*pending.popleft())
+    finally:
+        for session in sessions:
+            session.close()
+
+
+ENGINES = {
+    "serial": send_serial,
+    "threaded": send_threaded,
+}
+
+
+def get_engine():
+    """Возвращает движок отправки, выбранный в настройке MAILING_ENGINE."""
+    return ENGINES[settings.MAILING_ENGINE]
+
+
+class AttemptsWriter:
+    """Буфер попыток отправки рассылки. Копит попытки и записывает их
+    пачками через bulk_create, по одной транзакции на пачку.
+    При первой записи переводит рассылку из статуса "создана" в "запущена"
+    одним условным UPDATE. Каждая записанная пачка - контрольная точка запуска:
+    если процесс упадёт, повторный запуск продолжит с получателей без успешной попытки.
+    Если запуск выполняется в задании очереди, в той же транзакции обновляется
+    признак жизни задания. Пачка записывается, когда наберётся batch_size попыток
+    или пройдёт MAILING_JOB_HEARTBEAT_INTERVAL секунд с прошлой записи, поэтому при медленной
+    отправке контрольные точки не отстают надолго. Между отправками признак жизни
+    задания обновляет фоновый поток JobHeartbeat."""
+
+    def __init__(self, mail, run_id, job=None, batch_size=None):
+        self.mail = mail
+        self.run_id = run_id
+        self.job = job
+        self.batch_size = batch_size or settings.MAILING_ATTEMPTS_BATCH_SIZE
+        self.buffer = []
+        self.retries = []
+        self.activated = False
+        self.flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, recipient_id, attempt_status, mail_server_response):
+        self.buffer.append(
+            Attempts(
+                attempt_date=timezone.now(),
+                attempt_status=attempt_status,
+                mail_server_response=mail_server_response,
+                mailing_id=self.mail.pk,
+                owner_id=self.mail.owner_id,
+                recipient_id=recipient_id,
+                run_id=self.run_id,
+            )
+        )
+        if (
+            len(self.buffer) >= self.batch_size
+            or time.monotonic() - self.flushed_at >= settings.MAILING_JOB_HEARTBEAT_INTERVAL
+        ):
+            self.flush()
+
+    def add_retry(self, recipient_id, error):
+        """Откладывает письмо получателю для повторной отправки.
+        Повтор записывается в БД вместе с пачкой попыток."""
+        self.retries.append(
+            MailingRetry(
+                mailing_id=self.mail.pk,
+                recipient_id=recipient_id,
+                run_id=self.run_id,
+                next_attempt_at=timezone.now() + get_retry_delay(1),
+                last_error=str(error),
+            )
+        )
+
+    def flush(self):
+        if not self.buffer and not self.retries:
+            return
+        with transaction.atomic():
+            if not self.activated:
+                activate_mailing(self.mail)
+                self.activated = True
+            Attempts.objects.bulk_create(self.buffer)
+            count_attempts(self.buffer)
+            MailingRetry.objects.bulk_create(self.retries, ignore_conflicts=True)
+            if self.job is not None:
+                MailingJob.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+        invalidate_cache("mailing_attempts_list", [self.mail.owner_id])
+        self.buffer = []
+        self.retries = []
+        self.flushed_at = time.monotonic()
+
+
+def count_attempts(attempts):
+    """Прибавляет записанные попытки к счётчикам MailingStats их рассылок.
+    Вызывается в транзакции записи попыток, по одному UPDATE на рассылку."""
+    counts = {}
+    owners = {}
+    for attempt in attempts:
+        success, failure = counts.get(attempt.mailing_id, (0, 0))
+        if attempt.attempt_status == Attempts.SUCCESS:
+            success += 1
+        else:
+            failure += 1
+        counts[attempt.mailing_id] = (success, failure)
+        # Владелец нужен только для создания строки счётчиков и у попыток одной рассылки один.
+        owners.setdefault(attempt.mailing_id, attempt.owner_id)
+    if not counts:
+        return
+    MailingStats.objects.bulk_create(
+        [MailingStats(mailing_id=mailing_id, owner_id=owner_id) for mailing_id, owner_id in owners.items()],
+        ignore_conflicts=True,
+    )
+    for mailing_id, (success, failure) in counts.items():
+        MailingStats.objects.filter(mailing_id=mailing_id).update(
+            success=F("success") + success, failure=F("failure") + failure
+        )
+
+
+def activate_mailing(mail):
+    """Переводит рассылку из статуса "создана" в "запущена" одним условным UPDATE.
+    Уже запущенные и завершённые рассылки не трогает."""
+    now = timezone.now()
+    if Mailing.objects.filter(pk=mail.pk, status=Mailing.CREATED).update(status=Mailing.ACTIVE, start_at=now):
+        mail.status = Mailing.ACTIVE
+        mail.start_at = now
+        invalidate_cache("mailing_list", [mail.owner_id])
+        invalidate_cache("mailing_attempts_list", [mail.owner_id])
+        adjust_dashboard_stats(active=1)
+
+
+def is_transient_error(error):
+    """Определяет, временная ли ошибка отправки: ответы SMTP 4xx, таймауты
+    и обрывы соединения стоит повторить позже, ответы 5xx и прочие ошибки - нет."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, message in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+def get_retry_delay(attempt):
+    """Возвращает задержку перед повтором номер attempt: экспоненциальный рост
+    от MAILING_RETRY_BASE_DELAY до MAILING_RETRY_MAX_DELAY секунд со случайным разбросом,
+    чтобы повторы многих писем не приходили на сервер одновременно."""
+    delay = min(settings.MAILING_RETRY_MAX_DELAY, settings.MAILING_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def get_pending_recipients(mail, run_id):
+    """Возвращает получателей рассылки (её сегмента или списка), которым запуск run_id
+    ещё не доставил письмо и письмо которым не отложено для повтора.
+    Отбор выполняется в БД через NOT EXISTS по частичному индексу
+    успешных попыток (run_id, recipient) и уникальному индексу повторов."""
+    delivered = Attempts.objects.filter(run_id=run_id, recipient_id=OuterRef("pk"), attempt_status=Attempts.SUCCESS)
+    retrying = MailingRetry.objects.filter(run_id=run_id, recipient_id=OuterRef("pk"))
+    return get_mailing_recipients(mail).filter(~Exists(delivered), ~Exists(retrying))
+
+
+def iter_recipients(recipients, chunk_size=None):
+    """Потоково отдаёт пары (pk, email) получателей, читая их из БД пачками
+    по chunk_size строк с постраничной выборкой по ключу (pk > последний pk пачки).
+    В памяти одновременно находится не больше одной пачки, сколько бы ни было получателей,
+    и каждый запрос короткий, не держит открытый курсор между записями попыток."""
+    chunk_size = chunk_size or settings.MAILING_RECIPIENT_CHUNK_SIZE
+    last_pk = 0
+    while True:
+        chunk = list(recipients.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "email")[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1][0]
+
+
+def send_mailing(mail, job=None):
+    """Отправляет рассылку выбранным движком отправки тем получателям,
+    которым этот запуск ещё не доставил письмо. Запуск задания очереди
+    продолжает отправку с места обрыва, без задания начинается новый запуск.
+    Для каждого получателя записывает попытку отправки в БД,
+    возвращает число успешных и неуспешных попыток."""
+    run_id = job.run_id if job is not None else uuid.uuid4()
+    email_from = settings.EMAIL_HOST_USER
+    subject = mail.message.subject
+    text = mail.message.text
+    recipients = iter_recipients(get_pending_recipients(mail, run_id))
+    messages = ((recipient_id, EmailMessage(subject, text, email_from, [email])) for recipient_id, email in recipients)
+    results = {Attempts.SUCCESS: 0, Attempts.FAILURE: 0}
+    with AttemptsWriter(mail, run_id, job) as writer:
+        for recipient_id, error in get_engine()(messages):
+            if error is None:
+                writer.add(recipient_id, Attempts.SUCCESS, "Email sent successfully")
+                results[Attempts.SUCCESS] += 1
+            else:
+                # Повтор откладывается до попытки: add может записать пачку, и повтор уйдёт вместе с ней.
+                if is_transient_error(error):
+                    writer.add_retry(recipient_id, error)
+                writer.add(recipient_id, Attempts.FAILURE, str(error))
+                results[Attempts.FAILURE] += 1
+    return results
+
+
+def send_retries(retries):
+    """Повторно отправляет отложенные письма. Доставленные и окончательно
+    неуспешные повторы удаляются, временно неуспешные откладываются снова
+    с увеличенной задержкой, пока не кончится MAILING_RETRY_MAX_ATTEMPTS попыток.
+    Каждая отправка записывается попыткой. Итоги записываются не реже чем раз
+    в MAILING_JOB_HEARTBEAT_INTERVAL секунд, и вместе с ними продлевается аренда
+    ещё не отправленных повторов, чтобы их не забрал другой воркер.
+    Возвращает число успешных и неуспешных попыток."""
+    email_from = settings.EMAIL_HOST_USER
+    messages = (
+        (
+            retry,
+            EmailMessage(
+                retry.mailing.message.subject, retry.mailing.message.text, email_from, [retry.recipient.email]
+            ),
+        )
+        for retry in retries
+        if retry.mailing.status != Mailing.FINISHED
+    )
+    attempts = []
+    done = [retry.pk for retry in retries if retry.mailing.status == Mailing.FINISHED]
+    postponed = []
+    pending = {retry.pk for retry in retries} - set(done)
+    saved_at = time.monotonic()
+    results = {Attempts.SUCCESS: 0, Attempts.FAILURE: 0}
+    for retry, error in get_engine()(messages):
+        attempt_status = Attempts.SUCCESS if error is None else Attempts.FAILURE
+        attempts.append(
+            Attempts(
+                attempt_date=timezone.now(),
+                attempt_status=attempt_status,
+                mail_server_response="Email sent successfully" if error is None else str(error),
+                mailing_id=retry.mailing_id,
+                owner_id=retry.mailing.owner_id,
+                recipient_id=retry.recipient_id,
+                run_id=retry.run_id,
+            )
+        )
+        results[attempt_status] += 1
+        retry.attempts += 1
+        if error is not None and is_transient_error(error) and retry.attempts < settings.MAILING_RETRY_MAX_ATTEMPTS:
+            retry.next_attempt_at = timezone.now() + get_retry_delay(retry.attempts)
+            retry.last_error = str(error)
+            postponed.append(retry)
+        else:
+            done.append(retry.pk)
+        pending.discard(retry.pk)
+        if time.monotonic() - saved_at >= settings.MAILING_JOB_HEARTBEAT_INTERVAL:
+            save_retry_results(attempts, done, postponed, pending)
+            attempts, done, postponed = [], [], []
+            saved_at = time.monotonic()
+    save_retry_results(attempts, done, postponed, pending)
+    return results
+
+
+def save_retry_results(attempts, done, postponed, pending):
+    """Записывает итоги отправки повторов одной транзакцией: попытки, удаление
+    завершённых и новые сроки отложенных повторов. Аренда повторов pending,
+    которые ещё ждут отправки, продлевается на MAILING_JOB_LEASE секунд."""
+    with transaction.atomic():
+        Attempts.objects.bulk_create(attempts)
+        count_attempts(attempts)
+        MailingRetry.objects.filter(pk__in=done).delete()
+        MailingRetry.objects.bulk_update(postponed, ["attempts", "next_attempt_at", "last_error"])
+        if pending:
+            MailingRetry.objects.filter(pk__in=pending).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=settings.MAILING_JOB_LEASE)
+            )
+    invalidate_cache("mailing_attempts_list", {attempt.owner_id for attempt in attempts})
@@ -1,68 +1,371 @@
+import hashlib
+import math
+import random
+import time
+
 from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from config.settings import (
+    CACHE_EARLY_REFRESH_BETA,
+    CACHE_ENABLED,
+    CACHE_LOCK_TIMEOUT,
+    CACHE_LOCK_WAIT,
+    CACHE_STALE_TIMEOUT,
+    LIST_CACHE_TIMEOUT,
+    STATS_CACHE_TIMEOUT,
+)
+from mail.models import Mailing, Attempts, MailingStats, Message, Recipient, Segment
+from mail.pagination import paginate
+
+# Списки хранятся в кэше как кортежи значений полей, а не как QuerySet,
+# поэтому чтение из кэша не обращается к БД.
+RECIPIENT_FIELDS = ("pk", "full_name", "email", "owner_id")
+MESSAGE_FIELDS = ("pk", "subject", "text", "owner_id")
+MAILING_FIELDS = ("pk", "start_at", "end_at", "status", "owner_id", "message_id", "message__subject")
+ATTEMPT_FIELDS = (
+    "pk",
+    "attempt_date",
+    "attempt_status",
+    "mail_server_response",
+    "owner_id",
+    "mailing_id",
+    "mailing__status",
+    "mailing__message__subject",
+)
+
+# Поля сортировки списков для постраничного вывода по курсору: Meta.ordering моделей
+# с первичным ключом в конце, чтобы порядок строк с равными значениями был однозначным.
+# Рассылки листаются отдельно внутри каждого статуса, поэтому статус в ключ не входит.
+RECIPIENT_KEY = ("full_name", "pk")
+MESSAGE_KEY = ("subject", "pk")
+MAILING_KEY = ("message__subject", "pk")
+ATTEMPT_KEY = ("attempt_date", "attempt_status", "mailing_id", "pk")
+
+
+# Право, дающее доступ к спискам всех пользователей, для каждого кэшируемого списка.
+LIST_PERMISSIONS = {
+    "message_list": "mailing.view_message",
+    "recipient_list": "mailing.view_recipient",
+    "mailing_list": "mailing.view_mailing",
+    "mailing_attempts_list": "mailing.view_mailing_attempts",
+}
+
+
+def get_scope(user, perm):
+    """Возвращает область видимости данных пользователя:
+    "all" для пользователей с правом perm, иначе только его собственные данные."""
+    if user.has_perm(perm):
+        return "all"
+    return f"owner:{user.pk}"
 
-from config.settings import CACHE_ENABLED
-from mail.models import Mailing, Attempts, Message, Recipient
 
+def get_cache_version(name, scope):
+    """Возвращает текущую версию кэша списка name в области scope.
+    Версия входит в ключ кэша, поэтому после её увеличения старые данные не читаются."""
+    key = f"{name}:version:{scope}"
+    version = cache.get(key)
+    if version is None:
+        # Версия, вытесненная из кэша, начинается заново с текущего времени,
+        # чтобы не совпасть ни с одной из уже выданных.
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
 
-def get_message_list():
-    """Работает с кэш при просмотре всех сообщений.
-    Записывает и достаёт из кэш."""
+
+def invalidate_cache(name, owner_ids):
+    """Сбрасывает кэш списка name для владельцев owner_ids и для общей области "all".
+    Внутри транзакции сброс откладывается до её фиксации, чтобы в кэш
+    не попали данные, прочитанные до фиксации изменений."""
     if not CACHE_ENABLED:
-        return Message.objects.all()
-    else:
-        key = "message_list"
-        messages = cache.get(key)
-        if messages is not None:
-            return messages
-        else:
-            messages = Message.objects.all()
-            cache.set(key, messages, 60)
-            return messages
-
-
-def get_recipient_list():
-    """Работает с кэш при просмотре всех получателей.
-    Записывает и достаёт из кэш."""
+        return
+    scopes = {"all"} | {f"owner:{owner_id}" for owner_id in owner_ids if owner_id is not None}
+
+    def bump():
+        for scope in scopes:
+            key = f"{name}:version:{scope}"
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns() // 1000, None)
+
+    transaction.on_commit(bump)
+
+
+def recompute(key, compute, timeout):
+    """Вычисляет значение через compute и кладёт его в кэш вместе с временем
+    вычисления и сроком годности. Ключ хранится дольше срока на CACHE_STALE_TIMEOUT,
+    чтобы во время пересчёта было что отдать."""
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    cache.set(key, (value, delta, time.time() + timeout), timeout + CACHE_STALE_TIMEOUT)
+    return value
+
+
+def wait_for_cache(read):
+    """Ждёт до CACHE_LOCK_WAIT сек., пока другой процесс положит значение в кэш.
+    Возвращает прочитанное через read значение или None, если его так и не появилось."""
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = read()
+        if value is not None:
+            return value
+    return None
+
+
+def get_or_compute(key, compute, timeout):
+    """Достаёт значение из кэша по key или вычисляет его через compute без лавины пересчётов.
+    Пересчитывает значение только процесс, взявший короткую блокировку в кэше,
+    остальные отдают прежнее значение или, если его нет, недолго ждут нового.
+    Часто читаемые ключи пересчитываются досрочно с вероятностью, растущей
+    к концу срока и с временем вычисления (XFetch), поэтому не успевают истечь."""
+    lock_key = f"{key}:lock"
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if time.time() - delta * CACHE_EARLY_REFRESH_BETA * math.log(1 - random.random()) < expires_at:
+            return value
+        if not cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+        entry = wait_for_cache(lambda: cache.get(key))
+        # Если вычисляющий процесс не успел, считаем сами, но не ждём дольше.
+        return entry[0] if entry is not None else compute()
+    try:
+        # Пока блокировка была занята, значение мог пересчитать другой процесс.
+        fresh = cache.get(key)
+        if fresh is not None and (entry is None or fresh[2] != entry[2]):
+            return fresh[0]
+        return recompute(key, compute, timeout)
+    finally:
+        cache.delete(lock_key)
+
+
+def get_cached_rows(name, scope, compute, part=""):
+    """Достаёт из кэша строки списка name в области scope или вычисляет их через compute.
+    part отличает разные части одного списка, например его страницы."""
     if not CACHE_ENABLED:
-        return Recipient.objects.all()
-    else:
-        key = "recipient_list"
-        recipients = cache.get(key)
-        if recipients is not None:
-            return recipients
-        else:
-            recipients = Recipient.objects.all()
-            cache.set(key, recipients, 60)
-            return recipients
-
-
-def get_mailing_list():
-    """Работает с кэш при просмотре всех рассылок.
-    Записывает и достаёт из кэш."""
+        return compute()
+    key = f"{name}:{scope}:{get_cache_version(name, scope)}{part}"
+    return get_or_compute(key, compute, LIST_CACHE_TIMEOUT)
+
+
+def get_page_cache_key(name, user):
+    """Возвращает ключ кэша фрагмента страницы со списком name для пользователя.
+    В ключ входят пользователь, его область видимости и версия списка в этой области,
+    поэтому при изменении данных ключ меняется и страница собирается заново."""
+    scope = get_scope(user, LIST_PERMISSIONS[name])
+    version = get_cache_version(name, scope) if CACHE_ENABLED else 0
+    return f"{user.pk}:{scope}:{version}"
+
+
+def scoped(queryset, scope, user):
+    if scope == "all":
+        return queryset
+    return queryset.filter(owner=user)
+
+
+def get_page_part(after, before):
+    """Часть ключа кэша, отличающая страницу списка. Курсор хэшируется, чтобы ключ был коротким."""
+    if not after and not before:
+        return ":page"
+    return ":page:" + hashlib.md5(f"{after or ''}:{before or ''}".encode()).hexdigest()
+
+
+def get_cached_page(name, scope, queryset, key_fields, fields, after, before, part=""):
+    """Достаёт из кэша страницу списка name в области scope или читает её из queryset по курсору.
+    part отличает разные части одного списка, которые листаются отдельно."""
+    return get_cached_rows(
+        name,
+        scope,
+        lambda: paginate(queryset, key_fields, fields, after=after, before=before),
+        part=part + get_page_part(after, before),
+    )
+
+
+def get_message_list(user, after=None, before=None):
+    """Работает с кэш при просмотре сообщений.
+    Записывает и достаёт из кэш страницу списка сообщений, видимых пользователю.
+    Возвращает сообщения страницы и курсоры следующей и предыдущей страниц."""
+    scope = get_scope(user, LIST_PERMISSIONS["message_list"])
+    queryset = scoped(Message.objects.all(), scope, user)
+    rows, next_cursor, previous_cursor = get_cached_page(
+        "message_list", scope, queryset, MESSAGE_KEY, MESSAGE_FIELDS, after, before
+    )
+    return [Message(**dict(zip(MESSAGE_FIELDS, row))) for row in rows], next_cursor, previous_cursor
+
+
+def get_recipient_list(user, after=None, before=None):
+    """Работает с кэш при просмотре получателей.
+    Записывает и достаёт из кэш страницу списка получателей, видимых пользователю.
+    Возвращает получателей страницы и курсоры следующей и предыдущей страниц."""
+    scope = get_scope(user, LIST_PERMISSIONS["recipient_list"])
+    queryset = scoped(Recipient.objects.all(), scope, user)
+    rows, next_cursor, previous_cursor = get_cached_page(
+        "recipient_list", scope, queryset, RECIPIENT_KEY, RECIPIENT_FIELDS, after, before
+    )
+    return [Recipient(**dict(zip(RECIPIENT_FIELDS, row))) for row in rows], next_cursor, previous_cursor
+
+
+def build_mailing(pk, start_at, end_at, status, owner_id, message_id, message_subject):
+    mailing = Mailing(pk=pk, start_at=start_at, end_at=end_at, status=status, owner_id=owner_id)
+    mailing.message = Message(pk=message_id, subject=message_subject)
+    return mailing
+
+
+def get_mailing_list(user, status, after=None, before=None):
+    """Работает с кэш при просмотре рассылок.
+    Записывает и достаёт из кэш страницу рассылок со статусом status, видимых пользователю.
+    Рассылки каждого статуса листаются отдельно, поэтому группа статуса не разрывается
+    границей страницы. Тема сообщения читается тем же запросом через JOIN,
+    поэтому шаблон не обращается к БД за каждой рассылкой.
+    Возвращает рассылки страницы и курсоры следующей и предыдущей страниц."""
+    scope = get_scope(user, LIST_PERMISSIONS["mailing_list"])
+    queryset = scoped(Mailing.objects.filter(status=status), scope, user)
+    rows, next_cursor, previous_cursor = get_cached_page(
+        "mailing_list", scope, queryset, MAILING_KEY, MAILING_FIELDS, after, before, part=f":{status}"
+    )
+    return [build_mailing(*row) for row in rows], next_cursor, previous_cursor
+
+
+def get_segment_recipients(segment):
+    """Возвращает получателей сегмента запросом к БД: получателей владельца сегмента,
+    отобранных условиями сегмента. Адреса хранятся в нижнем регистре, поэтому домен
+    сравнивается без учёта регистра обычным LIKE."""
+    recipients = Recipient.objects.filter(owner_id=segment.owner_id)
+    if segment.comment_contains:
+        recipients = recipients.filter(comment__icontains=segment.comment_contains)
+    if segment.email_domain:
+        recipients = recipients.filter(email__endswith="@" + segment.email_domain.strip().lstrip("@").lower())
+    return recipients
+
+
+def get_mailing_recipients(mailing):
+    """Возвращает получателей рассылки: получателей её сегмента, если он выбран,
+    иначе получателей, выбранных списком."""
+    if mailing.segment_id is not None:
+        return get_segment_recipients(Segment.objects.get(pk=mailing.segment_id))
+    return mailing.recipients.all()
+
+
+def build_attempt(
+    pk, attempt_date, attempt_status, mail_server_response, owner_id, mailing_id, mailing_status, subject
+):
+    attempt = Attempts(
+        pk=pk,
+        attempt_date=attempt_date,
+        attempt_status=attempt_status,
+        mail_server_response=mail_server_response,
+        owner_id=owner_id,
+    )
+    attempt.mailing = Mailing(pk=mailing_id, status=mailing_status)
+    attempt.mailing.message = Message(subject=subject)
+    return attempt
+
+
+def get_mailing_attempts_list(user, after=None, before=None):
+    """Работает с кэш при просмотре попыток отправки рассылок.
+    Записывает и достаёт из кэш страницу списка попыток, видимых пользователю.
+    Возвращает попытки страницы и курсоры следующей и предыдущей страниц."""
+    scope = get_scope(user, LIST_PERMISSIONS["mailing_attempts_list"])
+    queryset = scoped(Attempts.objects.all(), scope, user)
+    rows, next_cursor, previous_cursor = get_cached_page(
+        "mailing_attempts_list", scope, queryset, ATTEMPT_KEY, ATTEMPT_FIELDS, after, before
+    )
+    return [build_attempt(*row) for row in rows], next_cursor, previous_cursor
+
+
+def get_attempt_stats(user):
+    """Работает с кэш при просмотре итогов попыток отправки рассылок.
+    Складывает счётчики MailingStats рассылок, видимых пользователю,
+    поэтому не зависит от числа записанных попыток."""
+    scope = get_scope(user, LIST_PERMISSIONS["mailing_attempts_list"])
+    return get_cached_rows(
+        "mailing_attempts_list",
+        scope,
+        lambda: scoped(MailingStats.objects.all(), scope, user).aggregate(
+            success=Coalesce(Sum("success"), 0), failure=Coalesce(Sum("failure"), 0)
+        ),
+        part=":stats",
+    )
+
+
+DASHBOARD_STATS_KEYS = {
+    "mailings": "dashboard_stats:mailings",
+    "active": "dashboard_stats:active",
+    "recipients": "dashboard_stats:recipients",
+}
+
+
+def compute_dashboard_stats():
+    """Считает статистику главной страницы одним запросом из трёх COUNT."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT (SELECT COUNT(*) FROM {Mailing._meta.db_table}), "
+            f"(SELECT COUNT(*) FROM {Mailing._meta.db_table} WHERE status = %s), "
+            f"(SELECT COUNT(*) FROM {Recipient._meta.db_table})",
+            [Mailing.ACTIVE],
+        )
+        mailings, active, recipients = cursor.fetchone()
+    return {"mailings": mailings, "active": active, "recipients": recipients}
+
+
+def get_dashboard_stats():
+    """Работает с кэш при просмотре главной страницы.
+    Достаёт из кэш число всех рассылок, активных рассылок и получателей,
+    при промахе считает их одним запросом под блокировкой, чтобы не считать их
+    одновременно в каждом процессе. Счётчики в кэше поддерживаются
+    сигналами при создании, изменении и удалении рассылок и получателей."""
     if not CACHE_ENABLED:
-        return Mailing.objects.all()
-    else:
-        key = "mailing_list"
-        mailings = cache.get(key)
-        if mailings is not None:
-            return mailings
-        else:
-            mailings = Mailing.objects.all()
-            cache.set(key, mailings, 60)
-            return mailings
-
-
-def get_mailing_attempts_list():
-    """Работает с кэш при просмотре всех попыток отправки рассылок.
-    Записывает и достаёт из кэш."""
+        return compute_dashboard_stats()
+
+    def read():
+        cached = cache.get_many(DASHBOARD_STATS_KEYS.values())
+        if len(cached) == len(DASHBOARD_STATS_KEYS):
+            return {name: cached[key] for name, key in DASHBOARD_STATS_KEYS.items()}
+        return None
+
+    stats = read()
+    if stats is not None:
+        return stats
+    lock_key = "dashboard_stats:lock"
+    if not cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+        stats = wait_for_cache(read)
+        return stats if stats is not None else compute_dashboard_stats()
+    try:
+        # Пока блокировка была занята, счётчики мог посчитать другой процесс.
+        stats = read()
+        if stats is not None:
+            return stats
+        stats = compute_dashboard_stats()
+        cache.set_many({DASHBOARD_STATS_KEYS[name]: value for name, value in stats.items()}, STATS_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return stats
+
+
+def adjust_dashboard_stats(**deltas):
+    """Сдвигает счётчики статистики главной страницы в кэше на deltas после фиксации транзакции.
+    Отсутствующие в кэше счётчики не трогает: они будут посчитаны заново при чтении."""
     if not CACHE_ENABLED:
-        return Attempts.objects.all()
-    else:
-        key = "mailing_attempts_list"
-        attempts = cache.get(key)
-        if attempts is not None:
-            return attempts
-        else:
-            attempts = Attempts.objects.all()
-            cache.set(key, attempts, 60)
-            return attempts
\ No newline at end of file
+        return
+
+    def adjust():
+        for name, delta in deltas.items():
+            if delta:
+                try:
+                    cache.incr(DASHBOARD_STATS_KEYS[name], delta)
+                except ValueError:
+                    pass
+
+    transaction.on_commit(adjust)
+
+
+def invalidate_dashboard_stats():
+    """Сбрасывает статистику главной страницы, когда изменение нельзя учесть сдвигом счётчиков."""
+    if CACHE_ENABLED:
+        transaction.on_commit(lambda: cache.delete_many(DASHBOARD_STATS_KEYS.values()))
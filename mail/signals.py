@@ -0,0 +1,80 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import Attempts, Mailing, Message, Recipient
+from .sending import count_attempts
+from .service import adjust_dashboard_stats, invalidate_cache
+
+
+@receiver([post_save, post_delete], sender=Recipient)
+def invalidate_recipient_list(sender, instance, **kwargs):
+    """Сбрасывает кэш списка получателей владельца при изменении получателя."""
+    invalidate_cache("recipient_list", [instance.owner_id])
+
+
+@receiver([post_save, post_delete], sender=Message)
+def invalidate_message_list(sender, instance, **kwargs):
+    """Сбрасывает кэш списка сообщений владельца при изменении сообщения.
+    Тема сообщения показывается в списках рассылок и попыток,
+    поэтому сбрасываются и они у владельцев рассылок с этим сообщением."""
+    invalidate_cache("message_list", [instance.owner_id])
+    owner_ids = {instance.owner_id} | set(
+        Mailing.objects.filter(message_id=instance.pk).values_list("owner_id", flat=True)
+    )
+    invalidate_cache("mailing_list", owner_ids)
+    invalidate_cache("mailing_attempts_list", owner_ids)
+
+
+@receiver([post_save, post_delete], sender=Mailing)
+def invalidate_mailing_list(sender, instance, **kwargs):
+    """Сбрасывает кэш списка рассылок владельца при изменении рассылки.
+    Статус рассылки показывается в списке попыток, поэтому сбрасывается и он."""
+    invalidate_cache("mailing_list", [instance.owner_id])
+    invalidate_cache("mailing_attempts_list", [instance.owner_id])
+
+
+@receiver([post_save, post_delete], sender=Attempts)
+def invalidate_mailing_attempts_list(sender, instance, **kwargs):
+    """Сбрасывает кэш списка попыток владельца при изменении попытки."""
+    invalidate_cache("mailing_attempts_list", [instance.owner_id])
+
+
+@receiver(post_save, sender=Attempts)
+def count_saved_attempt(sender, instance, created, **kwargs):
+    """Учитывает попытку, созданную сохранением модели, в счётчиках рассылки.
+    Пачки попыток, записанные при отправке, учитываются там же, где записываются."""
+    if created:
+        count_attempts([instance])
+
+
+@receiver(post_init, sender=Mailing)
+def remember_mailing_status(sender, instance, **kwargs):
+    """Запоминает статус загруженной рассылки, чтобы при сохранении узнать, изменился ли он."""
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=Mailing)
+def count_saved_mailing(sender, instance, created, **kwargs):
+    """Учитывает созданную рассылку или смену её статуса в статистике главной страницы."""
+    was_active = not created and instance._loaded_status == Mailing.ACTIVE
+    adjust_dashboard_stats(mailings=int(created), active=int(instance.status == Mailing.ACTIVE) - int(was_active))
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Mailing)
+def count_deleted_mailing(sender, instance, **kwargs):
+    """Учитывает удалённую рассылку в статистике главной страницы."""
+    adjust_dashboard_stats(mailings=-1, active=-int(instance._loaded_status == Mailing.ACTIVE))
+
+
+@receiver(post_save, sender=Recipient)
+def count_saved_recipient(sender, instance, created, **kwargs):
+    """Учитывает созданного получателя в статистике главной страницы."""
+    if created:
+        adjust_dashboard_stats(recipients=1)
+
+
+@receiver(post_delete, sender=Recipient)
+def count_deleted_recipient(sender, instance, **kwargs):
+    """Учитывает удалённого получателя в статистике главной страницы."""
+    adjust_dashboard_stats(recipients=-1)
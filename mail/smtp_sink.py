@@ -0,0 +1,126 @@
+import random
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Обработчик SMTP-сессии локального приёмника писем.
+    Понимает минимальный набор команд, достаточный для smtplib,
+    письма никуда не сохраняет, только считает."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.count("sessions")
+        self.reply("220 sink ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply("250-sink")
+                self.reply("250 8BITMIME")
+            elif command == b"HELO":
+                self.reply("250 sink")
+            elif command in (b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                if not self.receive_data():
+                    return
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def receive_data(self):
+        """Дочитывает тело письма и отвечает на него с учётом задержки
+        и внедряемых ошибок. Возвращает False, если соединение нужно оборвать."""
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return False
+            if line in (b".\r\n", b".\n"):
+                break
+        server = self.server
+        with server.delivering():
+            if server.latency:
+                time.sleep(server.latency)
+            chance = random.random()
+            if chance < server.failure_rate:
+                server.count("failed")
+                self.reply("451 Temporary failure, try again later")
+            elif chance < server.failure_rate + server.reject_rate:
+                server.count("rejected")
+                self.reply("550 Mailbox unavailable")
+            else:
+                server.count("received")
+                self.reply("250 OK")
+        if random.random() < server.disconnect_rate:
+            return False
+        return True
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Локальный SMTP-приёмник для замеров скорости отправки.
+    Работает в фоновом потоке, умеет добавлять задержку ответа на письмо
+    и внедрять ошибки: временные (451), постоянные (550) и обрывы соединения.
+    Кроме исходов писем считает открытые SMTP-сессии (sessions) и наибольшее
+    число писем, которые сервер принимал одновременно (peak_delivering).
+
+    Пример:
+        with SmtpSink(latency=0.01, failure_rate=0.05) as sink:
+            ...  # отправка на 127.0.0.1:sink.port
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, failure_rate=0, reject_rate=0, disconnect_rate=0):
+        super().__init__((host, port), SinkHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reject_rate = reject_rate
+        self.disconnect_rate = disconnect_rate
+        self.stats = {"received": 0, "failed": 0, "rejected": 0, "sessions": 0, "peak_delivering": 0}
+        self.delivering_now = 0
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, outcome):
+        with self.stats_lock:
+            self.stats[outcome] += 1
+
+    @contextmanager
+    def delivering(self):
+        """Отмечает письмо, которое сервер принимает прямо сейчас."""
+        with self.stats_lock:
+            self.delivering_now += 1
+            self.stats["peak_delivering"] = max(self.stats["peak_delivering"], self.delivering_now)
+        try:
+            yield
+        finally:
+            with self.stats_lock:
+                self.delivering_now -= 1
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
@@ -1,3 +1,1628 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import re
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.db import IntegrityError, connection
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from mail import jobs, sending
+from mail.archiving import ARCHIVE_FIELDS, archive_attempts, get_archive_path
+from mail.cache import LocalTier, TwoTierRedisCache
+from mail.exporting import EXPORT_COLUMNS, get_export_queryset
+from mail.forms import MailingForm, RecipientForm
+from mail.importing import ImportFileError, import_recipients, read_rows
+from mail.models import Attempts, Mailing, MailingJob, MailingRetry, MailingStats, Message, Recipient, Segment
+from mail.service import (
+    ATTEMPT_KEY,
+    MAILING_KEY,
+    MESSAGE_KEY,
+    RECIPIENT_KEY,
+    compute_dashboard_stats,
+    get_cache_version,
+    get_dashboard_stats,
+    get_or_compute,
+    get_segment_recipients,
+)
+from mail.ratelimit import TokenBucket, get_rate_limiter
+from mail.smtp_sink import SmtpSink
+from users.models import CustomUser, normalize_email
+
+# Кэш, который ничего не хранит: страницы в тестах всегда собираются из БД.
+DUMMY_CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+# Кэш в памяти процесса, общий для всех потоков теста.
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests"}}
+
+
+def create_mailings(owner, status, count, start=0):
+    """Заводит владельцу count рассылок со статусом status, у каждой своё сообщение."""
+    messages = Message.objects.bulk_create(
+        [Message(subject=f"Тема {i:04}", text="Текст", owner=owner) for i in range(start, start + count)]
+    )
+    return Mailing.objects.bulk_create([Mailing(message=message, owner=owner, status=status) for message in messages])
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class MailingListViewTest(TestCase):
+    """Список рассылок с группировкой по статусу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create(email="owner@example.com")
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def get_sections(self, url):
+        """Открывает список и возвращает заголовки разделов, темы рассылок и ссылки на соседние страницы."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        headers = re.findall(r"<h2[^>]*>([^<]*)</h2>", content)
+        subjects = re.findall(r"Тема рассылки: ([^<]*)</h4>", content)
+        links = dict(
+            (name, url.replace("&amp;", "&"))
+            for url, name in re.findall(r'href="(\?[^"]*)"[^>]*>(Следующая|Предыдущая) страница', content)
+        )
+        return headers, subjects, links
+
+    def test_query_count_does_not_depend_on_mailings(self):
+        # Сессия, пользователь и права в base.html - четыре запроса, ещё по одному на страницу каждого статуса.
+        for status, name in Mailing.STATUS_CHOICES:
+            create_mailings(self.owner, status, 3)
+        with self.assertNumQueries(7):
+            self.client.get(reverse("mail:mailing_list"))
+        for status, name in Mailing.STATUS_CHOICES:
+            create_mailings(self.owner, status, settings.LIST_PAGE_SIZE, start=3)
+        with self.assertNumQueries(7):
+            self.client.get(reverse("mail:mailing_list"))
+
+    def test_status_section_is_paginated_separately(self):
+        created = create_mailings(self.owner, Mailing.CREATED, settings.LIST_PAGE_SIZE + 5)
+        create_mailings(self.owner, Mailing.FINISHED, 3, start=1000)
+
+        headers, subjects, links = self.get_sections(reverse("mail:mailing_list"))
+        self.assertEqual(headers, ["Созданные рассылки:", "Завершённые рассылки:"])
+        self.assertEqual(len(subjects), settings.LIST_PAGE_SIZE + 3)
+        self.assertEqual(list(links), ["Следующая"])
+        self.assertIn("created_after=", links["Следующая"])
+
+        headers, subjects, links = self.get_sections(reverse("mail:mailing_list") + links["Следующая"])
+        # Раздел созданных рассылок продолжается, его заголовок не повторяется, завершённые остаются на месте.
+        self.assertEqual(headers, ["Созданные рассылки:", "Завершённые рассылки:"])
+        self.assertEqual(subjects[:5], [mailing.message.subject for mailing in created[-5:]])
+        self.assertEqual(len(subjects), 5 + 3)
+        self.assertEqual(list(links), ["Предыдущая"])
+
+
+# Страницы и наибольшее допустимое число запросов к БД при их открытии без кэша.
+# Для каждой страницы: имя, функция, собирающая адрес по заведённым данным,
+# бюджет запросов и признак того, что страницу открывает администратор.
+# Сессия, пользователь и его права в шаблоне base.html стоят четыре запроса на любой странице.
+PAGES = [
+    ("главная", lambda data: reverse("mail:main"), 5, False),
+    ("получатели", lambda data: reverse("mail:recipient_list"), 5, False),
+    ("получатель", lambda data: reverse("mail:recipient_detail", args=[data["recipient"].pk]), 5, False),
+    ("изменение получателя", lambda data: reverse("mail:recipient_update", args=[data["recipient"].pk]), 5, False),
+    ("сообщения", lambda data: reverse("mail:message_list"), 5, False),
+    ("сообщение", lambda data: reverse("mail:message_detail", args=[data["message"].pk]), 5, False),
+    ("изменение сообщения", lambda data: reverse("mail:message_update", args=[data["message"].pk]), 5, False),
+    ("рассылки", lambda data: reverse("mail:mailing_list"), 7, False),
+    ("рассылка", lambda data: reverse("mail:mailing_detail", args=[data["mailing"].pk]), 5, False),
+    ("изменение рассылки", lambda data: reverse("mail:mailing_update", args=[data["mailing"].pk]), 9, False),
+    ("сегменты", lambda data: reverse("mail:segment_list"), 5, False),
+    ("сегмент", lambda data: reverse("mail:segment_detail", args=[data["segment"].pk]), 6, False),
+    ("попытки", lambda data: reverse("mail:mailing_attempts_list"), 6, False),
+    ("админка: получатели", lambda data: reverse("admin:mail_recipient_changelist"), 7, True),
+    ("админка: сообщения", lambda data: reverse("admin:mail_message_changelist"), 6, True),
+    ("админка: рассылки", lambda data: reverse("admin:mail_mailing_changelist"), 6, True),
+    ("админка: рассылка", lambda data: reverse("admin:mail_mailing_change", args=[data["mailing"].pk]), 11, True),
+    ("админка: сегменты", lambda data: reverse("admin:mail_segment_changelist"), 5, True),
+    ("админка: попытки", lambda data: reverse("admin:mail_attempts_changelist"), 6, True),
+    ("админка: задания", lambda data: reverse("admin:mail_mailingjob_changelist"), 5, True),
+    ("админка: повторы", lambda data: reverse("admin:mail_mailingretry_changelist"), 5, True),
+    ("админка: статистика", lambda data: reverse("admin:mail_mailingstats_changelist"), 5, True),
+]
+
+
+def seed_owner_data(owner, start, stop):
+    """Заводит владельцу записи с номерами от start до stop: сегменты, получателей, сообщения,
+    рассылки на всех получателей с попытками, заданиями, повторами и счётчиками."""
+    now = timezone.now()
+    segments = Segment.objects.bulk_create(
+        [Segment(name=f"Сегмент {i}", comment_contains="клиент", owner=owner) for i in range(start, stop)]
+    )
+    recipients = Recipient.objects.bulk_create(
+        [
+            Recipient(full_name=f"Получатель {i}", email=f"recipient-{i}@example.com", owner=owner)
+            for i in range(start, stop)
+        ]
+    )
+    messages = Message.objects.bulk_create(
+        [Message(subject=f"Тема {i}", text="Текст", owner=owner) for i in range(start, stop)]
+    )
+    mailings = Mailing.objects.bulk_create(
+        [
+            Mailing(
+                message=message,
+                owner=owner,
+                status=Mailing.STATUS_CHOICES[i % 3][0],
+                segment=segments[i] if i % 2 else None,
+            )
+            for i, message in enumerate(messages)
+        ]
+    )
+    Mailing.recipients.through.objects.bulk_create(
+        [
+            Mailing.recipients.through(mailing=mailing, recipient=recipient)
+            for mailing in mailings
+            for recipient in recipients
+        ]
+    )
+    Attempts.objects.bulk_create(
+        [
+            Attempts(
+                attempt_date=now,
+                attempt_status=Attempts.SUCCESS,
+                mail_server_response="Email sent successfully",
+                mailing=mailing,
+                owner=owner,
+                recipient=recipient,
+            )
+            for mailing, recipient in zip(mailings, recipients)
+        ]
+    )
+    MailingJob.objects.bulk_create([MailingJob(mailing=mailing, status=MailingJob.DONE) for mailing in mailings])
+    MailingRetry.objects.bulk_create(
+        [
+            MailingRetry(mailing=mailing, recipient=recipient, run_id=uuid.uuid4(), next_attempt_at=now)
+            for mailing, recipient in zip(mailings, recipients)
+        ]
+    )
+    MailingStats.objects.bulk_create([MailingStats(mailing=mailing, owner=owner, success=1) for mailing in mailings])
+    return {"recipient": recipients[0], "message": messages[0], "mailing": mailings[0], "segment": segments[0]}
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class QueryBudgetTest(TestCase):
+    """Страницы сервиса и админки укладываются в бюджет запросов к БД,
+    и число запросов не растёт вместе с данными (нет N+1)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create(email="owner@example.com")
+        cls.admin = CustomUser.objects.create(email="admin@example.com", is_staff=True, is_superuser=True)
+        cls.data = seed_owner_data(cls.owner, 0, 5)
+
+    def measure(self):
+        """Открывает каждую страницу и возвращает число запросов к БД на неё."""
+        users = {False: self.owner, True: self.admin}
+        counts = {}
+        for name, url, budget, as_admin in PAGES:
+            self.client.force_login(users[as_admin])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url(self.data))
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = len(queries.captured_queries)
+        return counts
+
+    def test_pages_fit_query_budget(self):
+        before = self.measure()
+        seed_owner_data(self.owner, 5, 30)
+        after = self.measure()
+        for name, url, budget, as_admin in PAGES:
+            with self.subTest(page=name):
+                self.assertLessEqual(before[name], budget, "первый проход")
+                self.assertLessEqual(after[name], budget, "второй проход")
+                self.assertLessEqual(after[name], before[name], "число запросов растёт с данными")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheStampedeTest(SimpleTestCase):
+    """get_or_compute пересчитывает значение одним потоком, сколько бы потоков ни читали ключ одновременно."""
+
+    threads = 16
+    compute_time = 0.2
+
+    def setUp(self):
+        cache.clear()
+        self.key = "stampede-test"
+        self.computed = 0
+        self.lock = threading.Lock()
+
+    def compute(self):
+        time.sleep(self.compute_time)
+        with self.lock:
+            self.computed += 1
+            return self.computed
+
+    def read_concurrently(self):
+        """Одновременно читает ключ из нескольких потоков и возвращает полученные ими значения."""
+        barrier = threading.Barrier(self.threads)
+        results = [None] * self.threads
+
+        def read(index):
+            barrier.wait()
+            results[index] = get_or_compute(self.key, self.compute, 60)
+
+        workers = [threading.Thread(target=read, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_cold_key_is_computed_once(self):
+        results = self.read_concurrently()
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(set(results), {1})
+
+    def test_expired_key_is_recomputed_once(self):
+        self.read_concurrently()
+        value, delta, expires_at = cache.get(self.key)
+        cache.set(self.key, (value, delta, time.time() - 1), 60)
+        results = self.read_concurrently()
+        self.assertEqual(self.computed, 2)
+        # Пока один поток пересчитывает значение, остальные отдают прежнее.
+        self.assertLessEqual(set(results), {1, 2})
+
+    def test_fresh_key_is_not_recomputed(self):
+        self.read_concurrently()
+        results = self.read_concurrently()
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(set(results), {1})
+
+
+class StopListening(Exception):
+    pass
+
+
+class LocalTierTest(SimpleTestCase):
+    """Локальный уровень TwoTierRedisCache: вытеснение, защита от устаревших значений и подписка."""
+
+    def setUp(self):
+        self.tier = LocalTier("cache:invalidate:test", max_entries=2, timeout=60)
+        self.tier.listening = True
+
+    def test_least_recently_used_key_is_evicted(self):
+        self.tier.set("a", 1, self.tier.generation)
+        self.tier.set("b", 2, self.tier.generation)
+        self.tier.get("a")
+        self.tier.set("c", 3, self.tier.generation)
+        self.assertEqual(list(self.tier.entries), ["a", "c"])
+        self.assertIsNone(self.tier.get("b"))
+
+    def test_expired_key_is_a_miss(self):
+        self.tier.set("a", 1, self.tier.generation)
+        with mock.patch("mail.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(self.tier.get("a"))
+        self.assertNotIn("a", self.tier.entries)
+
+    def test_value_read_before_invalidation_is_not_stored(self):
+        generation = self.tier.generation
+        # Пока значение читалось из Redis, пришла инвалидация: прочитанное могло устареть.
+        self.tier.evict(["a"])
+        self.tier.set("a", 1, generation)
+        self.assertIsNone(self.tier.get("a"))
+
+    def test_nothing_is_stored_until_subscribed(self):
+        self.tier.listening = False
+        self.tier.set("a", 1, self.tier.generation)
+        self.assertEqual(len(self.tier.entries), 0)
+
+    def test_listener_evicts_published_keys(self):
+        self.tier.listening = False
+        seen = []
+
+        def messages():
+            yield {"type": "subscribe", "data": 1}
+            seen.append(self.tier.listening)
+            self.tier.set("a", 1, self.tier.generation)
+            self.tier.set("b", 2, self.tier.generation)
+            yield {"type": "message", "data": b"a"}
+            seen.append(list(self.tier.entries))
+
+        client = mock.Mock()
+        client.pubsub.return_value.listen.side_effect = messages
+        # Разрыв подписки выключает и очищает локальный уровень, после чего подписчик переподключается.
+        with mock.patch("mail.cache.time.sleep", side_effect=StopListening):
+            with self.assertRaises(StopListening):
+                self.tier.listen(lambda: client)
+        client.pubsub.return_value.subscribe.assert_called_once_with(self.tier.channel)
+        self.assertEqual(seen, [True, ["b"]])
+        self.assertFalse(self.tier.listening)
+        self.assertEqual(len(self.tier.entries), 0)
+
+
+class TwoTierRedisCacheTest(SimpleTestCase):
+    """Согласованность локального уровня с Redis; клиент Redis подменён на fakeredis."""
+
+    key = "mailing:version:all"
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patcher = mock.patch.dict("mail.cache.local_tiers", clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = self.make_cache()
+        self.full_key = self.cache.make_and_validate_key(self.key)
+        # Другой процесс: пишет в тот же Redis напрямую, минуя локальный уровень этого процесса.
+        self.other = fakeredis.FakeRedis(server=self.server)
+        self.addCleanup(self.disconnect)
+
+    def make_cache(self):
+        backend = TwoTierRedisCache("redis://localhost:6379/0", {"LOCAL_KEYS": [r":version:"], "LOCAL_TIMEOUT": 60})
+        client = fakeredis.FakeRedis(server=self.server)
+        backend._cache.get_client = lambda key=None, write=False: client
+        return backend
+
+    def disconnect(self):
+        # Поток-подписчик теряет соединение и дальше только ждёт переподключения.
+        self.server.connected = False
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "подписчик не получил сообщение")
+            time.sleep(0.01)
+
+    def read_into_local_tier(self):
+        """Читает ключ, дожидается подписки и читает ещё раз: второе чтение кладёт значение в локальный уровень."""
+        self.cache.get(self.key)
+        self.wait_until(lambda: self.cache.local.listening)
+        value = self.cache.get(self.key)
+        self.assertIn(self.full_key, self.cache.local.entries)
+        return value
+
+    def test_local_copy_is_served_until_another_process_publishes_change(self):
+        self.cache.set(self.key, 1)
+        self.assertEqual(self.read_into_local_tier(), 1)
+        self.other.set(self.full_key, 2)
+        self.assertEqual(self.cache.get(self.key), 1)
+        self.other.publish(self.cache.local.channel, self.full_key)
+        self.wait_until(lambda: self.full_key not in self.cache.local.entries)
+        self.assertEqual(self.cache.get(self.key), 2)
+
+    def test_own_write_drops_local_copy_at_once(self):
+        self.cache.set(self.key, 1)
+        self.read_into_local_tier()
+        self.cache.incr(self.key)
+        self.assertEqual(self.cache.get(self.key), 2)
+
+    def test_clear_is_published_to_other_processes(self):
+        self.cache.set(self.key, 1)
+        self.read_into_local_tier()
+        pubsub = self.other.pubsub()
+        pubsub.subscribe(self.cache.local.channel)
+        pubsub.get_message(timeout=1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache.local.entries), 0)
+        self.assertEqual(pubsub.get_message(timeout=1)["data"], b"*")
+
+    def test_other_keys_are_not_kept_locally(self):
+        self.cache.set("mailing_list:all:1", 1)
+        self.cache.get("mailing_list:all:1")
+        self.wait_until(lambda: self.cache.local.listening)
+        self.assertEqual(self.cache.get("mailing_list:all:1"), 1)
+        self.assertEqual(len(self.cache.local.entries), 0)
+
+
+def is_sequential(plan, table):
+    """Читает ли план запроса таблицу table последовательным перебором."""
+    if connection.vendor == "postgresql":
+        return re.search(rf"Seq Scan on {table}\b", plan) is not None
+    if connection.vendor == "sqlite":
+        return any(re.search(rf"\bSCAN {table}\b", line) and "USING" not in line for line in plan.splitlines())
+    return False
+
+
+def is_fully_sorted(plan):
+    """Сортирует ли план запроса всю выборку целиком, а не читает её в порядке индекса.
+    Досортировка внутри групп с одинаковым началом ключа (Incremental Sort, RIGHT PART OF ORDER BY) не в счёт."""
+    if connection.vendor == "postgresql":
+        return re.search(r"(^|->)\s*Sort\b", plan, re.MULTILINE) is not None
+    if connection.vendor == "sqlite":
+        return "USE TEMP B-TREE FOR ORDER BY" in plan
+    return False
+
+
+class QueryPlanTest(TestCase):
+    """Основные запросы на заведённых данных читают таблицы по индексам, а не последовательным перебором."""
+
+    owners = 50
+    rows = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        """Заводит владельцев, у каждого получателей, по рассылке на каждый статус и попытки,
+        и обновляет статистику таблиц для планировщика запросов."""
+        now = timezone.now()
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(email=f"plans-{i}@example.com", is_active=False) for i in range(cls.owners)]
+        )
+        messages = Message.objects.bulk_create(
+            [Message(subject=f"Тема {i}", text="Текст", owner=user) for i, user in enumerate(users)]
+        )
+        mailings = Mailing.objects.bulk_create(
+            [
+                Mailing(message=message, owner=message.owner, status=status, start_at=now)
+                for message in messages
+                for status, name in Mailing.STATUS_CHOICES
+            ]
+        )
+        for user in users:
+            Recipient.objects.bulk_create(
+                [
+                    Recipient(full_name=f"Получатель {i}", email=f"plans-{user.pk}-{i}@example.com", owner=user)
+                    for i in range(cls.rows)
+                ]
+            )
+        for mailing in mailings[:: len(Mailing.STATUS_CHOICES)]:
+            Attempts.objects.bulk_create(
+                [
+                    Attempts(
+                        attempt_date=now - timedelta(hours=i),
+                        attempt_status=Attempts.SUCCESS if i % 10 else Attempts.FAILURE,
+                        mail_server_response="Email sent successfully",
+                        mailing=mailing,
+                        owner_id=mailing.owner_id,
+                    )
+                    for i in range(cls.rows)
+                ]
+            )
+        with connection.cursor() as cursor:
+            for model in (CustomUser, Message, Mailing, Recipient, Attempts):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        cls.owner, cls.mailing = users[0], mailings[0]
+        cls.admin = CustomUser.objects.create(email="plans-admin@example.com", is_superuser=True)
+
+    def get_queries(self):
+        owner, mailing, now = self.owner, self.mailing, timezone.now()
+        return [
+            ("рассылки владельца по статусу", Mailing, Mailing.objects.filter(owner=owner, status=Mailing.CREATED)),
+            ("рассылки к запуску", Mailing, Mailing.objects.filter(status=Mailing.CREATED, start_at__lte=now)),
+            (
+                "страница рассылок владельца",
+                Mailing,
+                Mailing.objects.filter(owner=owner, status=Mailing.CREATED).order_by(*MAILING_KEY)[:50],
+            ),
+            (
+                "страница получателей владельца",
+                Recipient,
+                Recipient.objects.filter(owner=owner).order_by(*RECIPIENT_KEY)[:50],
+            ),
+            (
+                "пачка получателей сегмента",
+                Recipient,
+                get_segment_recipients(Segment(owner=owner, email_domain="example.com"))
+                .filter(pk__gt=0)
+                .order_by("pk")[:1000],
+            ),
+            (
+                "получатель по адресу",
+                Recipient,
+                Recipient.objects.filter(email__lower=normalize_email(f" Plans-{owner.pk}-0@Example.com")),
+            ),
+            (
+                "пользователь по адресу",
+                CustomUser,
+                CustomUser.objects.filter(email__lower=normalize_email(owner.email.upper())),
+            ),
+            (
+                "попытки рассылки по дате",
+                Attempts,
+                Attempts.objects.filter(mailing=mailing).order_by("attempt_date")[:50],
+            ),
+            (
+                "старые попытки рассылки для архива",
+                Attempts,
+                Attempts.objects.filter(mailing=mailing, attempt_date__lt=now).order_by("attempt_date", "pk")[:50],
+            ),
+            (
+                "неуспешные попытки владельца",
+                Attempts,
+                Attempts.objects.filter(owner=owner, attempt_status=Attempts.FAILURE),
+            ),
+            (
+                "страница попыток владельца",
+                Attempts,
+                Attempts.objects.filter(owner=owner).order_by(*ATTEMPT_KEY)[:50],
+            ),
+            *self.get_ordered_queries(),
+        ]
+
+    def get_ordered_queries(self):
+        """Запросы, которые должны читать строки в порядке индекса, без сортировки всей выборки:
+        страницы списков всех владельцев и выгрузка попыток."""
+        today = timezone.localdate()
+        return [
+            ("страница сообщений всех владельцев", Message, Message.objects.order_by(*MESSAGE_KEY)[:50]),
+            ("страница получателей всех владельцев", Recipient, Recipient.objects.order_by(*RECIPIENT_KEY)[:50]),
+            ("страница попыток всех владельцев", Attempts, Attempts.objects.order_by(*ATTEMPT_KEY)[:50]),
+            (
+                "выгрузка попыток всех владельцев за день",
+                Attempts,
+                get_export_queryset(self.admin, date_from=today, date_to=today),
+            ),
+        ]
+
+    def test_queries_use_indexes(self):
+        for name, model, queryset in self.get_queries():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                self.assertFalse(is_sequential(plan, model._meta.db_table), plan)
+
+    def test_pages_are_read_in_index_order(self):
+        for name, model, queryset in self.get_ordered_queries():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                self.assertFalse(is_fully_sorted(plan), plan)
+
+
+def sink_settings(sink, **options):
+    """Настройки отправки писем на локальный приёмник sink без ограничения темпа."""
+    return override_settings(
+        EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+        EMAIL_HOST=sink.host,
+        EMAIL_PORT=sink.port,
+        EMAIL_USE_TLS=False,
+        EMAIL_USE_SSL=False,
+        EMAIL_HOST_USER="sender@example.com",
+        EMAIL_HOST_PASSWORD="",
+        MAILING_RATE_LIMIT=0,
+        **options,
+    )
+
+
+def build_messages(count, tag=""):
+    """Пары (номер получателя, письмо) для передачи движку отправки."""
+    return (
+        (i, EmailMessage("Тема", "Текст", "sender@example.com", [f"recipient{tag}-{i}@example.com"]))
+        for i in range(count)
+    )
+
+
+def create_mailing_with_recipients(tag, count, **fields):
+    """Заводит владельца, сообщение и рассылку на count новых получателей.
+    tag отличает адреса владельца и получателей от заведённых другими вызовами."""
+    owner = CustomUser.objects.create(email=f"{tag}@example.com")
+    message = Message.objects.create(subject="Тема", text="Текст", owner=owner)
+    mailing = Mailing.objects.create(message=message, owner=owner, **fields)
+    mailing.recipients.add(
+        *Recipient.objects.bulk_create(
+            [Recipient(full_name=f"Получатель {i}", email=f"{tag}-{i}@example.com", owner=owner) for i in range(count)]
+        )
+    )
+    return mailing
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_ATTEMPTS_BATCH_SIZE=50)
+class SendMailingQueriesTest(TestCase):
+    """Отправка рассылки пишет попытки пачками: число запросов к БД растёт с числом пачек, а не писем."""
+
+    def test_attempts_are_written_in_batches(self):
+        for count, batches in ((10, 1), (120, 3)):
+            mailing = create_mailing_with_recipients(f"sender-{count}", count)
+            # Два чтения получателей (пачка и пустой ответ), перевод рассылки в запущенные,
+            # на каждую пачку попыток - транзакция из вставки попыток и двух запросов счётчиков MailingStats.
+            with SmtpSink() as sink, sink_settings(sink), self.subTest(recipients=count):
+                with self.assertNumQueries(3 + 5 * batches):
+                    results = sending.send_mailing(mailing)
+                self.assertEqual(results, {Attempts.SUCCESS: count, Attempts.FAILURE: 0})
+                self.assertEqual(Attempts.objects.filter(mailing=mailing).count(), count)
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class IterRecipientsTest(TestCase):
+    """Получатели рассылки читаются из БД пачками с ограничением LIMIT, а не одним запросом."""
+
+    def test_recipients_are_read_in_chunks(self):
+        owner = CustomUser.objects.create(email="chunks@example.com")
+        Recipient.objects.bulk_create(
+            [Recipient(full_name=f"Получатель {i}", email=f"chunks-{i}@example.com", owner=owner) for i in range(25)]
+        )
+        recipients = Recipient.objects.filter(owner=owner)
+        # Три пачки по 10, 10 и 5 получателей и пустой ответ, по которому чтение заканчивается.
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(sending.iter_recipients(recipients, chunk_size=10))
+        self.assertEqual(rows, list(recipients.order_by("pk").values_list("pk", "email")))
+        self.assertEqual(len(queries), 4)
+        for query in queries:
+            self.assertIn("LIMIT 10", query["sql"])
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_ATTEMPTS_BATCH_SIZE=2)
+class SendMailingRetriesTest(TestCase):
+    """Временно неуспешные письма рассылки откладываются для повтора."""
+
+    def test_every_transient_failure_is_postponed(self):
+        """Последняя попытка закрывает пачку, и её повтор остаётся для записи при выходе из AttemptsWriter."""
+        mailing = create_mailing_with_recipients("retries", 4)
+        with SmtpSink(failure_rate=1) as sink, sink_settings(sink):
+            results = sending.send_mailing(mailing)
+        self.assertEqual(results, {Attempts.SUCCESS: 0, Attempts.FAILURE: 4})
+        self.assertEqual(Attempts.objects.filter(mailing=mailing, attempt_status=Attempts.FAILURE).count(), 4)
+        self.assertEqual(MailingRetry.objects.filter(mailing=mailing).count(), 4)
+
+
+class CountingLimiter:
+    """Ограничитель темпа, который только считает взятые токены и запоминает,
+    занимал ли взявший токен поток в этот момент слот сервера slots."""
+
+    def __init__(self, slots=None):
+        self.slots = slots
+        self.taken = 0
+        self.taken_in_slot = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.taken += 1
+            if self.slots is not None and threading.get_ident() in self.slots.holders:
+                self.taken_in_slot += 1
+
+
+class TrackingSlots:
+    """Семафор слотов сервера, который помнит, какие потоки сейчас его занимают."""
+
+    def __init__(self, value):
+        self.semaphore = threading.BoundedSemaphore(value)
+        self.holders = set()
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self.holders.add(threading.get_ident())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.holders.discard(threading.get_ident())
+        self.semaphore.release()
+
+
+class MailSessionTest(SimpleTestCase):
+    """SMTP-сессия рассылки на локальном SMTP-приёмнике."""
+
+    def test_resend_after_disconnect_takes_a_token(self):
+        """Сервер обрывает соединение после каждого письма: первое письмо уходит с одним токеном,
+        остальные - с токеном на отправку и ещё одним на повтор после переподключения."""
+        limiter = CountingLimiter()
+        with SmtpSink(disconnect_rate=1) as sink, sink_settings(sink):
+            with mock.patch("mail.sending.get_rate_limiter", return_value=limiter):
+                results = list(sending.send_serial(build_messages(3)))
+        self.assertEqual(results, [(i, None) for i in range(3)])
+        self.assertEqual(limiter.taken, 5)
+
+    @override_settings(MAILING_CONNECTION_BATCH_SIZE=10)
+    def test_one_connection_per_batch(self):
+        with SmtpSink() as sink, sink_settings(sink):
+            results = list(sending.send_serial(build_messages(25)))
+        self.assertEqual(results, [(i, None) for i in range(25)])
+        self.assertEqual(sink.stats["received"], 25)
+        self.assertEqual(sink.stats["sessions"], 3)
+
+    def test_reconnects_after_server_disconnect(self):
+        """Сервер обрывает соединение после каждого письма: сессия переподключается,
+        и ни одно письмо не считается неотправленным."""
+        with SmtpSink(disconnect_rate=1) as sink, sink_settings(sink):
+            results = list(sending.send_serial(build_messages(5)))
+        self.assertEqual(results, [(i, None) for i in range(5)])
+        self.assertEqual(sink.stats["received"], 5)
+        self.assertEqual(sink.stats["sessions"], 5)
+
+
+class ThreadedEngineTest(SimpleTestCase):
+    """Параллельный движок отправки на локальном SMTP-приёмнике."""
+
+    def setUp(self):
+        # Семафоры серверов живут весь процесс; тест начинает с пустыми, чтобы они взяли его настройки.
+        patcher = mock.patch.dict(sending._host_slots, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_is_taken_outside_the_host_slot(self):
+        """Поток, ждущий токен ограничителя темпа, не держит слот сервера."""
+        with SmtpSink() as sink, sink_settings(sink, MAILING_CONCURRENCY=4, MAILING_HOST_CONCURRENCY=2):
+            slots = sending._host_slots[sink.host] = TrackingSlots(2)
+            limiter = CountingLimiter(slots)
+            with mock.patch("mail.sending.get_rate_limiter", return_value=limiter):
+                results = list(sending.send_threaded(build_messages(20)))
+        self.assertEqual(results, [(i, None) for i in range(20)])
+        self.assertEqual(limiter.taken, 20)
+        self.assertEqual(limiter.taken_in_slot, 0)
+
+    def test_host_concurrency_is_capped_across_mailings(self):
+        """Две рассылки, отправляемые одновременно, вместе не превышают MAILING_HOST_CONCURRENCY
+        отправок на один сервер, но и не отправляют меньше разрешённого."""
+        results = {}
+
+        def send(tag):
+            results[tag] = list(sending.send_threaded(build_messages(20, tag)))
+
+        with SmtpSink(latency=0.02) as sink, sink_settings(sink, MAILING_CONCURRENCY=4, MAILING_HOST_CONCURRENCY=2):
+            threads = [threading.Thread(target=send, args=(tag,)) for tag in ("a", "b")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sink.stats["peak_delivering"], 2)
+        self.assertEqual(sink.stats["received"], 40)
+        for tag, result in results.items():
+            with self.subTest(mailing=tag):
+                self.assertEqual(result, [(i, None) for i in range(20)])
+
+
+class RetryPolicyTest(SimpleTestCase):
+    """Какие ошибки отправки повторяются и через сколько."""
+
+    def test_transient_errors(self):
+        errors = [
+            smtplib.SMTPDataError(451, b"Temporary failure"),
+            smtplib.SMTPResponseException(421, b"Service not available"),
+            smtplib.SMTPRecipientsRefused({"recipient@example.com": (450, b"Mailbox busy")}),
+            smtplib.SMTPServerDisconnected("Connection unexpectedly closed"),
+            socket.timeout("timed out"),
+            ConnectionRefusedError(),
+        ]
+        for error in errors:
+            with self.subTest(error=repr(error)):
+                self.assertTrue(sending.is_transient_error(error))
+
+    def test_permanent_errors(self):
+        errors = [
+            smtplib.SMTPDataError(550, b"Mailbox unavailable"),
+            smtplib.SMTPSenderRefused(553, b"Sender rejected", "sender@example.com"),
+            smtplib.SMTPRecipientsRefused(
+                {"a@example.com": (450, b"Mailbox busy"), "b@example.com": (550, b"No such user")}
+            ),
+            smtplib.SMTPNotSupportedError(),
+            ValueError("bad header"),
+        ]
+        for error in errors:
+            with self.subTest(error=repr(error)):
+                self.assertFalse(sending.is_transient_error(error))
+
+    @override_settings(MAILING_RETRY_BASE_DELAY=60, MAILING_RETRY_MAX_DELAY=600)
+    def test_delay_grows_up_to_the_limit(self):
+        """Без разброса задержка - половина расчётной: 30, 60, 120, 240 сек., дальше предел 300."""
+        with mock.patch("mail.sending.random.uniform", side_effect=lambda low, high: low):
+            delays = [sending.get_retry_delay(attempt).total_seconds() for attempt in range(1, 8)]
+        self.assertEqual(delays, [30, 60, 120, 240, 300, 300, 300])
+
+    @override_settings(MAILING_RETRY_BASE_DELAY=60, MAILING_RETRY_MAX_DELAY=600)
+    def test_jitter_stays_within_bounds(self):
+        for attempt, delay in ((1, 60), (3, 240), (10, 600)):
+            with self.subTest(attempt=attempt):
+                for _ in range(200):
+                    seconds = sending.get_retry_delay(attempt).total_seconds()
+                    self.assertGreaterEqual(seconds, delay / 2)
+                    self.assertLessEqual(seconds, delay)
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_RETRY_MAX_ATTEMPTS=3)
+class SendRetriesTest(TestCase):
+    """Повторная отправка отложенных писем и её предел по числу попыток."""
+
+    def setUp(self):
+        self.mailing = create_mailing_with_recipients("resend", 1)
+        self.retry = MailingRetry.objects.create(
+            mailing=self.mailing,
+            recipient=self.mailing.recipients.get(),
+            run_id=uuid.uuid4(),
+            next_attempt_at=timezone.now(),
+        )
+
+    def resend(self, **sink_options):
+        with SmtpSink(**sink_options) as sink, sink_settings(sink):
+            return jobs.process_due_retries()
+
+    def test_transient_failure_is_postponed(self):
+        self.assertEqual(self.resend(failure_rate=1), 1)
+        self.retry.refresh_from_db()
+        self.assertEqual(self.retry.attempts, 2)
+        self.assertGreater(self.retry.next_attempt_at, timezone.now())
+        self.assertIn("451", self.retry.last_error)
+        self.assertEqual(Attempts.objects.filter(mailing=self.mailing, attempt_status=Attempts.FAILURE).count(), 1)
+
+    def test_retries_stop_at_max_attempts(self):
+        MailingRetry.objects.filter(pk=self.retry.pk).update(attempts=2)
+        self.resend(failure_rate=1)
+        self.assertFalse(MailingRetry.objects.exists())
+        self.assertEqual(Attempts.objects.filter(mailing=self.mailing, attempt_status=Attempts.FAILURE).count(), 1)
+
+    def test_permanent_failure_is_not_retried(self):
+        self.resend(reject_rate=1)
+        self.assertFalse(MailingRetry.objects.exists())
+
+    def test_delivered_retry_is_removed(self):
+        self.resend()
+        self.assertFalse(MailingRetry.objects.exists())
+        self.assertEqual(Attempts.objects.filter(mailing=self.mailing, attempt_status=Attempts.SUCCESS).count(), 1)
+
+    def test_second_worker_skips_retries_being_sent(self):
+        """Пока первый воркер отправляет забранные повторы, второй их не получает:
+        забранные повторы сдвинуты вперёд на MAILING_JOB_LEASE секунд."""
+        claimed = []
+
+        def first_worker(retries):
+            claimed.append([retry.pk for retry in retries])
+            # Второй воркер обращается к очереди, пока первый ещё отправляет.
+            claimed.append(jobs.process_due_retries())
+
+        with mock.patch("mail.jobs.send_retries", side_effect=first_worker):
+            self.assertEqual(jobs.process_due_retries(), 1)
+        self.assertEqual(claimed, [[self.retry.pk], 0])
+        self.retry.refresh_from_db()
+        self.assertGreater(self.retry.next_attempt_at, timezone.now())
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_JOB_HEARTBEAT_INTERVAL=0.05)
+class JobHeartbeatTest(TransactionTestCase):
+    """Признак жизни задания обновляется фоновым потоком, даже когда отправка надолго застряла."""
+
+    def test_heartbeat_is_refreshed_while_send_blocks(self):
+        mailing = create_mailing_with_recipients("heartbeat", 1)
+        stale = timezone.now() - timedelta(hours=1)
+        job = MailingJob.objects.create(mailing=mailing, status=MailingJob.RUNNING, heartbeat_at=stale)
+        heartbeats = []
+
+        def blocked_send(mail, job):
+            # Одна отправка висит дольше нескольких интервалов признака жизни.
+            time.sleep(0.3)
+            heartbeats.append(MailingJob.objects.get(pk=job.pk).heartbeat_at)
+
+        started = timezone.now()
+        with mock.patch("mail.jobs.send_mailing", side_effect=blocked_send):
+            job = jobs.run_job(job)
+        self.assertEqual(job.status, MailingJob.DONE)
+        self.assertGreaterEqual(heartbeats[0], started)
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_JOB_LEASE=600)
+class ResumeRunTest(TestCase):
+    """Продолжение прерванного запуска рассылки и повторный захват брошенных заданий."""
+
+    def setUp(self):
+        self.mailing = create_mailing_with_recipients("resume", 4)
+        self.job = MailingJob.objects.create(mailing=self.mailing)
+        self.delivered, self.postponed, self.other_run, self.untouched = self.mailing.recipients.order_by("pk")
+
+    def test_pending_recipients_skip_this_run_progress(self):
+        """Получатели, которым запуск уже доставил письмо или отложил повтор, пропускаются.
+        Доставка в другом запуске рассылки не в счёт."""
+        Attempts.objects.create(
+            attempt_date=timezone.now(),
+            attempt_status=Attempts.SUCCESS,
+            mailing=self.mailing,
+            recipient=self.delivered,
+            run_id=self.job.run_id,
+        )
+        MailingRetry.objects.create(
+            mailing=self.mailing, recipient=self.postponed, run_id=self.job.run_id, next_attempt_at=timezone.now()
+        )
+        Attempts.objects.create(
+            attempt_date=timezone.now(),
+            attempt_status=Attempts.SUCCESS,
+            mailing=self.mailing,
+            recipient=self.other_run,
+            run_id=uuid.uuid4(),
+        )
+        pending = sending.get_pending_recipients(self.mailing, self.job.run_id)
+        self.assertQuerySetEqual(pending.order_by("pk"), [self.other_run, self.untouched])
+
+    def test_resumed_run_sends_only_to_the_rest(self):
+        Attempts.objects.create(
+            attempt_date=timezone.now(),
+            attempt_status=Attempts.SUCCESS,
+            mailing=self.mailing,
+            recipient=self.delivered,
+            run_id=self.job.run_id,
+        )
+        with SmtpSink() as sink, sink_settings(sink):
+            results = sending.send_mailing(self.mailing, job=self.job)
+        self.assertEqual(results, {Attempts.SUCCESS: 3, Attempts.FAILURE: 0})
+        self.assertEqual(sink.stats["received"], 3)
+        self.assertEqual(Attempts.objects.filter(run_id=self.job.run_id, recipient=self.delivered).count(), 1)
+
+    def test_job_with_stale_heartbeat_is_reclaimed(self):
+        started = timezone.now() - timedelta(hours=1)
+        MailingJob.objects.filter(pk=self.job.pk).update(
+            status=MailingJob.RUNNING, started_at=started, heartbeat_at=timezone.now() - timedelta(seconds=601)
+        )
+        job = jobs.claim_job()
+        self.assertEqual(job.pk, self.job.pk)
+        self.assertEqual(job.run_id, self.job.run_id)
+        self.assertEqual(job.started_at, started)
+        self.assertGreater(job.heartbeat_at, timezone.now() - timedelta(seconds=5))
+
+    def test_job_with_fresh_heartbeat_is_not_reclaimed(self):
+        MailingJob.objects.filter(pk=self.job.pk).update(
+            status=MailingJob.RUNNING, heartbeat_at=timezone.now() - timedelta(seconds=599)
+        )
+        self.assertIsNone(jobs.claim_job())
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class JobQueueTest(TestCase):
+    """Очередь заданий рассылки: постановка, захват и выполнение."""
+
+    def setUp(self):
+        self.mailing = create_mailing_with_recipients("queue", 2)
+
+    def test_active_job_is_not_duplicated(self):
+        first = jobs.enqueue_mailing(self.mailing)
+        self.assertEqual(jobs.enqueue_mailing(self.mailing), first)
+        MailingJob.objects.filter(pk=first.pk).update(status=MailingJob.RUNNING)
+        self.assertEqual(jobs.enqueue_mailing(self.mailing), first)
+        self.assertEqual(MailingJob.objects.filter(mailing=self.mailing).count(), 1)
+
+    def test_failed_job_is_requeued_with_its_run_id(self):
+        failed = jobs.enqueue_mailing(self.mailing)
+        MailingJob.objects.filter(pk=failed.pk).update(
+            status=MailingJob.FAILED, error="SMTP недоступен", finished_at=timezone.now()
+        )
+        job = jobs.enqueue_mailing(self.mailing)
+        self.assertEqual((job.pk, job.run_id), (failed.pk, failed.run_id))
+        self.assertEqual((job.status, job.error, job.finished_at), (MailingJob.QUEUED, "", None))
+        self.assertEqual(MailingJob.objects.filter(mailing=self.mailing).count(), 1)
+
+    def test_done_job_is_followed_by_a_new_run(self):
+        done = jobs.enqueue_mailing(self.mailing)
+        MailingJob.objects.filter(pk=done.pk).update(status=MailingJob.DONE)
+        job = jobs.enqueue_mailing(self.mailing)
+        self.assertNotEqual(job.pk, done.pk)
+        self.assertNotEqual(job.run_id, done.run_id)
+
+    def test_conflict_without_active_job_is_raised(self):
+        """Если вставку задания отклонила БД, а активного задания уже нет, ошибка не теряется."""
+        with mock.patch.object(MailingJob.objects, "create", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                jobs.enqueue_mailing(self.mailing)
+
+    def test_claim_job_returns_none_on_empty_queue(self):
+        self.assertIsNone(jobs.claim_job())
+
+    def test_claim_job_takes_the_oldest_queued_job(self):
+        first = jobs.enqueue_mailing(self.mailing)
+        jobs.enqueue_mailing(create_mailing_with_recipients("queue-second", 1))
+        job = jobs.claim_job()
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual(job.status, MailingJob.RUNNING)
+        self.assertIsNotNone(job.started_at)
+
+    def test_run_job_records_the_outcome(self):
+        jobs.enqueue_mailing(self.mailing)
+        with SmtpSink() as sink, sink_settings(sink):
+            job = jobs.run_job(jobs.claim_job())
+        self.assertEqual(job.status, MailingJob.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(sink.stats["received"], 2)
+
+    def test_run_job_records_the_error(self):
+        jobs.enqueue_mailing(self.mailing)
+        with mock.patch("mail.jobs.send_mailing", side_effect=smtplib.SMTPAuthenticationError(535, b"Bad login")):
+            job = jobs.run_job(jobs.claim_job())
+        self.assertEqual(job.status, MailingJob.FAILED)
+        self.assertIn("535", job.error)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SchedulerTest(TestCase):
+    """Планировщик ставит наступившие рассылки в очередь и завершает истёкшие,
+    а счётчики главной страницы в кэше остаются равны посчитанным по БД."""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.due = create_mailing_with_recipients("due", 1, start_at=now - timedelta(minutes=1))
+        self.future = create_mailing_with_recipients("future", 1, start_at=now + timedelta(hours=1))
+        self.missed = create_mailing_with_recipients(
+            "missed", 1, start_at=now - timedelta(hours=2), end_at=now - timedelta(hours=1)
+        )
+        self.running = create_mailing_with_recipients(
+            "running", 1, status=Mailing.ACTIVE, start_at=now - timedelta(hours=2), end_at=now - timedelta(minutes=1)
+        )
+        # Счётчики попадают в кэш до работы планировщика и дальше только сдвигаются.
+        get_dashboard_stats()
+
+    def assertDashboardStatsFresh(self):
+        self.assertEqual(get_dashboard_stats(), compute_dashboard_stats())
+
+    def test_due_mailing_is_queued_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(jobs.dispatch_due_mailings(), 1)
+        self.assertEqual(MailingJob.objects.filter(mailing=self.due).count(), 1)
+        self.assertFalse(MailingJob.objects.exclude(mailing=self.due).exists())
+        self.due.refresh_from_db()
+        self.assertEqual(self.due.status, Mailing.ACTIVE)
+        self.assertDashboardStatsFresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(jobs.dispatch_due_mailings(), 0)
+        self.assertEqual(MailingJob.objects.filter(mailing=self.due).count(), 1)
+        self.assertDashboardStatsFresh()
+
+    def test_expired_mailings_are_finished(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(jobs.finish_expired_mailings(), 2)
+        statuses = dict(Mailing.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[self.missed.pk], Mailing.FINISHED)
+        self.assertEqual(statuses[self.running.pk], Mailing.FINISHED)
+        self.assertEqual(statuses[self.due.pk], Mailing.CREATED)
+        self.assertEqual(statuses[self.future.pk], Mailing.CREATED)
+        self.assertEqual(get_dashboard_stats()["active"], 0)
+        self.assertDashboardStatsFresh()
+
+
+class TokenBucketTest(SimpleTestCase):
+    """Ведро токенов в Redis: скрипт выполняется на fakeredis с интерпретатором Lua."""
+
+    def setUp(self):
+        self.bucket = TokenBucket(fakeredis.FakeRedis(), "ratelimit-test", rate=10, burst=3)
+
+    def wait(self):
+        """Один запуск скрипта: 0, если токен взят, иначе сколько секунд ждать."""
+        return float(self.bucket.script(keys=[self.bucket.key], args=[self.bucket.rate, self.bucket.burst]))
+
+    def test_burst_then_limit(self):
+        self.assertEqual([self.wait() for _ in range(3)], [0, 0, 0])
+        wait = self.wait()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1 / self.bucket.rate)
+
+    def test_tokens_refill_up_to_burst(self):
+        for _ in range(3):
+            self.wait()
+        # За 0.5 сек. при 10 токенах в секунду набралось бы 5, но ведро вмещает 3.
+        time.sleep(0.5)
+        self.assertEqual([self.wait() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.wait(), 0)
+
+    def test_acquire_waits_for_a_token(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        started = time.monotonic()
+        self.bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_acquire_does_not_block_when_redis_is_down(self):
+        server = fakeredis.FakeServer()
+        server.connected = False
+        bucket = TokenBucket(fakeredis.FakeRedis(server=server), "ratelimit-test", rate=1, burst=1)
+        with self.assertRaises(redis.ConnectionError):
+            bucket.script(keys=[bucket.key], args=[bucket.rate, bucket.burst])
+        started = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    @override_settings(MAILING_RATE_LIMIT=0)
+    def test_limit_can_be_disabled(self):
+        self.assertIsNone(get_rate_limiter())
+
+
+@override_settings(CACHES=DUMMY_CACHES, MAILING_ATTEMPTS_BATCH_SIZE=3)
+class MailingStatsTest(TestCase):
+    """Счётчики MailingStats совпадают с числом попыток рассылки в таблице попыток."""
+
+    def assertStatsMatchAttempts(self, mailing):
+        stats = MailingStats.objects.get(mailing=mailing)
+        attempts = Attempts.objects.filter(mailing=mailing)
+        self.assertEqual(
+            (stats.success, stats.failure),
+            (
+                attempts.filter(attempt_status=Attempts.SUCCESS).count(),
+                attempts.filter(attempt_status=Attempts.FAILURE).count(),
+            ),
+        )
+
+    def test_stats_after_sending(self):
+        mailing = create_mailing_with_recipients("stats", 8)
+        with SmtpSink(reject_rate=0.5) as sink, sink_settings(sink):
+            sending.send_mailing(mailing)
+            sending.send_mailing(mailing)
+        self.assertEqual(Attempts.objects.filter(mailing=mailing).count(), 16)
+        self.assertStatsMatchAttempts(mailing)
+
+    def test_stats_after_saving_an_attempt(self):
+        mailing = create_mailing_with_recipients("stats-save", 1)
+        for status in (Attempts.SUCCESS, Attempts.FAILURE, Attempts.FAILURE):
+            Attempts.objects.create(
+                attempt_date=timezone.now(), attempt_status=status, mailing=mailing, owner=mailing.owner
+            )
+        self.assertStatsMatchAttempts(mailing)
+        # Попытка без владельца учитывается в той же строке счётчиков рассылки.
+        Attempts.objects.create(attempt_date=timezone.now(), attempt_status=Attempts.SUCCESS, mailing=mailing)
+        self.assertEqual(MailingStats.objects.filter(mailing=mailing).count(), 1)
+        self.assertStatsMatchAttempts(mailing)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheInvalidationTest(TestCase):
+    """Изменение получателя, сообщения, рассылки или попытки сбрасывает кэш списка
+    в области владельца и в общей области, но только после фиксации транзакции."""
+
+    def setUp(self):
+        cache.clear()
+        self.mailing = create_mailing_with_recipients("invalidation", 1)
+        self.owner = self.mailing.owner
+
+    def get_versions(self, name):
+        return [get_cache_version(name, scope) for scope in (f"owner:{self.owner.pk}", "all")]
+
+    def assertInvalidatedOnCommit(self, name, change):
+        before = self.get_versions(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            self.assertEqual(self.get_versions(name), before)
+        after = self.get_versions(name)
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+
+    def test_saving_and_deleting_invalidates_lists(self):
+        owner, mailing = self.owner, self.mailing
+        cases = [
+            (
+                "recipient_list",
+                lambda: Recipient.objects.create(full_name="Новый", email="new@example.com", owner=owner),
+            ),
+            ("message_list", lambda: Message.objects.create(subject="Новое", text="Текст", owner=owner)),
+            ("mailing_list", lambda: Mailing.objects.create(message=mailing.message, owner=owner)),
+            (
+                "mailing_attempts_list",
+                lambda: Attempts.objects.create(
+                    attempt_date=timezone.now(), attempt_status=Attempts.SUCCESS, mailing=mailing, owner=owner
+                ),
+            ),
+        ]
+        for name, create in cases:
+            with self.subTest(list=name):
+                created = []
+                self.assertInvalidatedOnCommit(name, lambda: created.append(create()))
+                instance = created[0]
+                self.assertInvalidatedOnCommit(name, instance.save)
+                self.assertInvalidatedOnCommit(name, instance.delete)
+
+    def test_message_change_invalidates_lists_showing_its_subject(self):
+        for name in ("mailing_list", "mailing_attempts_list"):
+            with self.subTest(list=name):
+                self.assertInvalidatedOnCommit(name, self.mailing.message.save)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WarmPageTest(TestCase):
+    """Повторный просмотр списка берёт страницу из кэша: к БД уходят только запросы
+    сессии, пользователя и его прав. После изменения данных страница собирается заново."""
+
+    # Страница списка и запросы к БД при пустом кэше.
+    PAGES = (
+        ("mail:recipient_list", 5),
+        ("mail:message_list", 5),
+        ("mail:mailing_list", 7),
+        ("mail:mailing_attempts_list", 6),
+    )
+    # Сессия, пользователь и два запроса прав.
+    WARM_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create(email="warm@example.com")
+        cls.data = seed_owner_data(cls.owner, 0, 5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+
+    def test_warm_page_skips_list_queries(self):
+        for name, cold in self.PAGES:
+            with self.subTest(page=name):
+                with self.assertNumQueries(cold):
+                    self.client.get(reverse(name))
+                with self.assertNumQueries(self.WARM_QUERIES):
+                    response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+
+    def test_change_rebuilds_the_page(self):
+        url = reverse("mail:recipient_list")
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipient.objects.create(full_name="Аааа Новый", email="warm-new@example.com", owner=self.owner)
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, "warm-new@example.com")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardStatsTest(TestCase):
+    """Счётчики главной страницы в кэше сдвигаются сигналами и остаются равны посчитанным по БД."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = CustomUser.objects.create(email="dashboard@example.com")
+        self.message = Message.objects.create(subject="Тема", text="Текст", owner=self.owner)
+        Mailing.objects.create(message=self.message, owner=self.owner, status=Mailing.ACTIVE)
+        # Счётчики попадают в кэш один раз и дальше только сдвигаются.
+        get_dashboard_stats()
+
+    def change(self, action):
+        """Выполняет action в транзакции и проверяет счётчики после её фиксации."""
+        with self.captureOnCommitCallbacks(execute=True):
+            result = action()
+        self.assertEqual(get_dashboard_stats(), compute_dashboard_stats())
+        return result
+
+    def test_mailing_lifecycle(self):
+        mailing = self.change(lambda: Mailing.objects.create(message=self.message, owner=self.owner))
+        self.assertEqual(get_dashboard_stats()["mailings"], 2)
+        # Статус меняется у заново загруженной рассылки: прежний статус запоминается при загрузке.
+        mailing = Mailing.objects.get(pk=mailing.pk)
+        mailing.status = Mailing.ACTIVE
+        self.change(mailing.save)
+        self.assertEqual(get_dashboard_stats()["active"], 2)
+        # Повторное сохранение без смены статуса счётчики не сдвигает.
+        self.change(mailing.save)
+        mailing = Mailing.objects.get(pk=mailing.pk)
+        mailing.status = Mailing.FINISHED
+        self.change(mailing.save)
+        self.assertEqual(get_dashboard_stats()["active"], 1)
+        active = Mailing.objects.get(status=Mailing.ACTIVE)
+        self.change(active.delete)
+        self.change(Mailing.objects.get(pk=mailing.pk).delete)
+        self.assertEqual(get_dashboard_stats(), {"mailings": 0, "active": 0, "recipients": 0})
+
+    def test_recipients(self):
+        recipient = self.change(
+            lambda: Recipient.objects.create(full_name="Получатель", email="dashboard-r@example.com", owner=self.owner)
+        )
+        self.change(recipient.save)
+        self.change(recipient.delete)
+
+
+class ImportRecipientsTest(TestCase):
+    """Импорт получателей из файлов CSV и XLSX с отчётом об отклонённых строках."""
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create(email="importer@example.com")
+        self.rejected = []
+
+    def report(self, line, email, error):
+        self.rejected.append((line, email, error))
+
+    def import_csv(self, text, **options):
+        rows = read_rows(io.BytesIO(text.encode()), "recipients.csv")
+        return import_recipients(rows, self.owner, self.report, **options)
+
+    def test_csv_is_imported(self):
+        created = self.import_csv(
+            "email;full_name;comment\nFirst@Example.com;Первый;важный\nsecond@example.com;Второй;\n"
+        )
+        self.assertEqual(created, 2)
+        self.assertEqual(self.rejected, [])
+        self.assertEqual(
+            list(self.owner.recipients.order_by("email").values_list("email", "full_name", "comment")),
+            [("first@example.com", "Первый", "важный"), ("second@example.com", "Второй", None)],
+        )
+
+    def test_xlsx_is_imported(self):
+        workbook = Workbook()
+        workbook.active.append(["Email", "Full_Name"])
+        workbook.active.append(["first@example.com", "Первый"])
+        workbook.active.append([None, None])
+        workbook.active.append(["second@example.com", "Второй"])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        created = import_recipients(read_rows(file, "recipients.XLSX"), self.owner, self.report)
+        self.assertEqual(created, 2)
+        self.assertEqual(
+            set(self.owner.recipients.values_list("email", flat=True)), {"first@example.com", "second@example.com"}
+        )
+
+    def test_file_not_in_utf8_is_refused_before_import(self):
+        file = io.BytesIO("email,full_name\nfirst@example.com,Первый\n".encode("cp1251"))
+        with self.assertRaises(ImportFileError):
+            read_rows(file, "recipients.csv")
+        self.assertFalse(Recipient.objects.exists())
+
+    def test_duplicates_differing_only_in_case_are_rejected(self):
+        # Адрес, записанный до нормализации, хранится в исходном регистре.
+        Recipient.objects.bulk_create([Recipient(email="Old@Example.com", full_name="Старый")])
+        created = self.import_csv(
+            "email,full_name\nNew@Example.com,Новый\nnew@example.COM,Новый ещё раз\nOLD@example.com,Старый ещё раз\n"
+        )
+        self.assertEqual(created, 1)
+        self.assertEqual(
+            self.rejected,
+            [
+                (3, "new@example.com", "Адрес повторяется в файле."),
+                (4, "Old@Example.com", "Такой адрес электронной почты уже есть."),
+            ],
+        )
+
+    def test_duplicates_in_different_chunks_are_rejected(self):
+        created = self.import_csv("email,full_name\nsame@example.com,Первый\nSAME@example.com,Второй\n", chunk_size=1)
+        self.assertEqual(created, 1)
+        self.assertEqual(self.rejected, [(3, "same@example.com", "Такой адрес электронной почты уже есть.")])
+
+    def test_invalid_rows_are_reported(self):
+        created = self.import_csv(
+            "email,full_name\nnot-an-email,Первый\n,Второй\nok@example.com,\nok@example.com,Третий\n"
+        )
+        self.assertEqual(created, 1)
+        self.assertEqual([line for line, email, error in self.rejected], [2, 3, 4])
+        self.assertEqual(self.rejected[0][1], "not-an-email")
+        self.assertEqual(self.rejected[1][2], "Не указан адрес электронной почты.")
+        self.assertEqual(self.rejected[2][2], "Не указано ФИО.")
+
+    def test_address_added_between_check_and_insert_is_skipped(self):
+        real_filter = Recipient.objects.filter
+        raced = []
+
+        def filter_then_race(*args, **kwargs):
+            """Первая проверка по БД ещё не видит адрес, который другой запрос добавляет сразу после неё."""
+            queryset = real_filter(*args, **kwargs)
+            if raced:
+                return queryset
+            existing = list(queryset.values_list("email", flat=True))
+            Recipient.objects.create(email="Race@example.com", full_name="Другой запрос")
+            raced.append(True)
+            return mock.Mock(values_list=mock.Mock(return_value=existing))
+
+        with mock.patch.object(Recipient.objects, "filter", side_effect=filter_then_race):
+            created = self.import_csv("email,full_name\nfirst@example.com,Первый\nrace@EXAMPLE.com,Гонка\n")
+        self.assertEqual(created, 1)
+        self.assertEqual(self.rejected, [(3, "race@example.com", "Такой адрес электронной почты уже есть.")])
+        self.assertEqual(
+            list(Recipient.objects.order_by("email").values_list("email", "owner")),
+            [("first@example.com", self.owner.pk), ("race@example.com", None)],
+        )
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class ExportAttemptsTest(TestCase):
+    """Потоковая выгрузка попыток: пользователь получает только свои попытки,
+    фильтр по владельцу действует только для видящих попытки всех владельцев."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(email="export-admin@example.com", is_staff=True, is_superuser=True)
+        cls.owner = CustomUser.objects.create(email="export-owner@example.com")
+        cls.other = CustomUser.objects.create(email="export-other@example.com")
+        seed_owner_data(cls.owner, 0, 3)
+        seed_owner_data(cls.other, 3, 5)
+
+    def export(self, user, export_format="csv", **filters):
+        self.client.force_login(user)
+        return self.client.get(reverse("mail:mailing_attempts_export", args=[export_format]), filters)
+
+    def exported_owners(self, response):
+        """Владельцы попыток в выгрузке CSV в порядке строк."""
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(EXPORT_COLUMNS))
+        owner_id = EXPORT_COLUMNS.index("owner_id")
+        return [int(line.split(",")[owner_id]) for line in lines[1:]]
+
+    def test_response_is_streamed(self):
+        response = self.export(self.owner)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="attempts.csv"')
+
+    def test_ndjson_rows_are_objects(self):
+        response = self.export(self.owner, "ndjson")
+        self.assertIsInstance(response, StreamingHttpResponse)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0]), list(EXPORT_COLUMNS))
+        self.assertEqual({row["owner_email"] for row in rows}, {self.owner.email})
+
+    def test_user_gets_only_own_attempts(self):
+        self.assertEqual(self.exported_owners(self.export(self.owner)), [self.owner.pk] * 3)
+
+    def test_owner_filter_is_ignored_for_user(self):
+        self.assertEqual(self.exported_owners(self.export(self.owner, owner=self.other.pk)), [self.owner.pk] * 3)
+
+    def test_staff_gets_all_attempts_and_owner_filter(self):
+        self.assertEqual(
+            sorted(self.exported_owners(self.export(self.admin))), [self.owner.pk] * 3 + [self.other.pk] * 2
+        )
+        self.assertEqual(self.exported_owners(self.export(self.admin, owner=self.other.pk)), [self.other.pk] * 2)
+
+    def test_bad_request(self):
+        self.assertEqual(self.export(self.owner, "xml").status_code, 404)
+        self.assertEqual(self.export(self.owner, date_from="вчера").status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("mail:mailing_attempts_export", args=["csv"])).status_code, 302)
+
+
+class ArchiveAttemptsTest(TestCase):
+    """Перенос старых попыток в сжатые архивы NDJSON во временном каталоге."""
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = os.path.join(archive_dir.name, "archive")
+        patcher = override_settings(ATTEMPTS_ARCHIVE_DIR=self.archive_dir)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.mailing = create_mailing_with_recipients("archive", 3)
+        self.recipients = list(self.mailing.recipients.order_by("pk"))
+        self.january = [
+            self.create_attempt(datetime(2024, 1, day, 12), recipient)
+            for day, recipient in enumerate(self.recipients, 10)
+        ]
+        self.february = self.create_attempt(datetime(2024, 2, 1, 12), self.recipients[0], Attempts.FAILURE)
+        self.fresh = self.create_attempt(datetime.now(), self.recipients[1])
+
+    def create_attempt(self, attempt_date, recipient, status=Attempts.SUCCESS):
+        return Attempts.objects.create(
+            attempt_date=timezone.make_aware(attempt_date),
+            attempt_status=status,
+            mail_server_response="ответ сервера",
+            mailing=self.mailing,
+            owner=self.mailing.owner,
+            recipient=recipient,
+        )
+
+    def read_archive(self, month):
+        with gzip.open(get_archive_path(month), "rt", encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_old_attempts_are_archived_by_month_and_deleted(self):
+        self.assertEqual(archive_attempts(days=30, batch_size=2), 4)
+        self.assertEqual(list(Attempts.objects.values_list("pk", flat=True)), [self.fresh.pk])
+        self.assertEqual(
+            sorted(os.listdir(self.archive_dir)), ["attempts-2024-01.ndjson.gz", "attempts-2024-02.ndjson.gz"]
+        )
+        january = self.read_archive(date(2024, 1, 1))
+        self.assertEqual([row["id"] for row in january], [attempt.pk for attempt in self.january])
+        self.assertEqual(list(january[0]), list(ARCHIVE_FIELDS))
+        self.assertEqual(january[0]["recipient_id"], self.recipients[0].pk)
+        self.assertEqual(january[0]["mail_server_response"], "ответ сервера")
+        self.assertEqual(datetime.fromisoformat(january[0]["attempt_date"]), self.january[0].attempt_date)
+        [february] = self.read_archive(date(2024, 2, 1))
+        self.assertEqual((february["id"], february["attempt_status"]), (self.february.pk, Attempts.FAILURE))
+
+    def test_archive_of_month_is_appended(self):
+        archive_attempts(days=30)
+        later = self.create_attempt(datetime(2024, 1, 31, 12), self.recipients[2])
+        self.assertEqual(archive_attempts(days=30), 1)
+        rows = self.read_archive(date(2024, 1, 1))
+        self.assertEqual([row["id"] for row in rows], [attempt.pk for attempt in self.january] + [later.pk])
+
+    def test_mailing_stats_are_kept(self):
+        archive_attempts(days=30)
+        self.assertEqual(
+            MailingStats.objects.values_list("mailing", "success", "failure").get(), (self.mailing.pk, 4, 1)
+        )
+
+    def test_dry_run_changes_nothing(self):
+        self.assertEqual(archive_attempts(days=30, dry_run=True), 4)
+        self.assertEqual(Attempts.objects.count(), 5)
+        self.assertFalse(os.path.exists(self.archive_dir))
+
+    def test_archive_dir_in_media_root_is_refused(self):
+        with override_settings(MEDIA_ROOT=os.path.dirname(self.archive_dir)):
+            with self.assertRaises(ImproperlyConfigured):
+                archive_attempts(days=30)
+        self.assertEqual(Attempts.objects.count(), 5)
+        self.assertFalse(os.path.exists(self.archive_dir))
+
+
+class RecipientEmailCaseTest(TestCase):
+    """Адреса получателей не различаются по регистру."""
+
+    def setUp(self):
+        self.recipient = Recipient.objects.create(email=" Recipient@Example.COM", full_name="Получатель")
+
+    def test_email_is_stored_normalized(self):
+        self.assertEqual(self.recipient.email, "recipient@example.com")
+
+    def test_form_rejects_same_email_in_other_case(self):
+        form = RecipientForm(data={"email": "RECIPIENT@example.com", "full_name": "Двойник"})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["email"], ["Такой адрес электронной почты уже есть."])
+
+    def test_form_keeps_own_email_on_update(self):
+        form = RecipientForm(
+            data={"email": "Recipient@example.com", "full_name": "Другое ФИО"}, instance=self.recipient
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_database_rejects_same_email_in_other_case(self):
+        with self.assertRaises(IntegrityError):
+            Recipient.objects.bulk_create([Recipient(email="RECIPIENT@example.com", full_name="Двойник")])
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class SegmentTest(TestCase):
+    """Сегмент отбирает получателей своего владельца при отправке, а форма рассылки
+    требует ровно один источник получателей: сегмент или список."""
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create(email="segment-owner@example.com")
+        self.other = CustomUser.objects.create(email="segment-other@example.com")
+        self.message = Message.objects.create(subject="Тема", text="Текст", owner=self.owner)
+        self.client_recipient, self.foreign_domain, self.partner = Recipient.objects.bulk_create(
+            [
+                Recipient(
+                    full_name="Клиент", email="client@clients.example.com", comment="VIP клиент", owner=self.owner
+                ),
+                Recipient(
+                    full_name="Клиент вне домена", email="client@example.org", comment="клиент", owner=self.owner
+                ),
+                Recipient(
+                    full_name="Партнёр", email="partner@clients.example.com", comment="партнёр", owner=self.owner
+                ),
+                Recipient(
+                    full_name="Чужой клиент", email="other@clients.example.com", comment="клиент", owner=self.other
+                ),
+            ]
+        )[:3]
+        self.segment = Segment.objects.create(
+            name="Клиенты", comment_contains="клиент", email_domain="@Clients.Example.com", owner=self.owner
+        )
+
+    def form(self, user=None, **data):
+        data = {"status": Mailing.CREATED, "message": self.message.pk, **data}
+        return MailingForm(data=data, user=user or self.owner)
+
+    def test_segment_selects_owner_recipients_by_conditions(self):
+        self.assertEqual(list(get_segment_recipients(self.segment)), [self.client_recipient])
+
+    def test_mailing_with_segment_sends_to_segment_recipients(self):
+        mailing = Mailing.objects.create(message=self.message, owner=self.owner, segment=self.segment)
+        # Сегмент вычисляется при отправке: получатель, добавленный после создания рассылки, тоже получит письмо.
+        added = Recipient.objects.create(
+            full_name="Новый клиент", email="new@clients.example.com", comment="клиент", owner=self.owner
+        )
+        with SmtpSink() as sink, sink_settings(sink):
+            results = sending.send_mailing(mailing)
+        self.assertEqual(results, {Attempts.SUCCESS: 2, Attempts.FAILURE: 0})
+        self.assertEqual(
+            set(Attempts.objects.filter(mailing=mailing).values_list("recipient", flat=True)),
+            {self.client_recipient.pk, added.pk},
+        )
+
+    def test_form_accepts_segment_or_recipients(self):
+        self.assertTrue(self.form(segment=self.segment.pk).is_valid())
+        self.assertTrue(self.form(recipients=[self.partner.pk]).is_valid())
+
+    def test_form_rejects_segment_with_recipients(self):
+        form = self.form(segment=self.segment.pk, recipients=[self.partner.pk])
+        self.assertEqual(form.non_field_errors(), ["Выберите либо сегмент, либо получателей списком."])
+
+    def test_form_rejects_neither_segment_nor_recipients(self):
+        self.assertEqual(self.form().non_field_errors(), ["Выберите сегмент или получателей рассылки."])
+
+    def test_other_owners_segment_is_rejected(self):
+        form = self.form(user=self.other, segment=self.segment.pk)
+        self.assertFalse(form.is_valid())
+        self.assertIn("segment", form.errors)
+
+    def test_create_view_rejects_other_owners_segment(self):
+        self.client.force_login(self.other)
+        response = self.client.post(
+            reverse("mail:mailing_create"),
+            {"status": Mailing.CREATED, "message": self.message.pk, "segment": self.segment.pk},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("segment", response.context["form"].errors)
+        self.assertFalse(Mailing.objects.exists())
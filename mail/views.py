@@ -1,17 +1,60 @@
 from datetime import datetime
 
-from django.conf import settings
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.mail import send_mail
-from django.http import HttpResponseForbidden
+from django.core.cache import cache
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse_lazy
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import DetailView, ListView, TemplateView
-from django.views.generic.edit import CreateView, DeleteView, UpdateView
+from django.views.generic.edit import CreateView, DeleteView, FormView, UpdateView
+
+from config.settings import CACHE_ENABLED, PAGE_CACHE_TIMEOUT, RECIPIENT_IMPORT_REPORT_LIMIT
+from .models import Mailing, Attempts, Message, Recipient, Segment
+from .exporting import EXPORT_FORMATS, get_export_queryset, iter_export_rows
+from .forms import AttemptsExportForm, RecipientForm, RecipientImportForm, MailingForm, MessageForm, SegmentForm
+from .importing import ImportFileError, import_recipients, read_rows
+from .jobs import enqueue_mailing
+from .pagination import KeysetPaginationMixin, paginate
+from .service import (
+    get_attempt_stats,
+    get_dashboard_stats,
+    get_segment_recipients,
+    get_mailing_attempts_list,
+    get_mailing_list,
+    get_message_list,
+    get_page_cache_key,
+    get_recipient_list,
+)
+
+
+class CachedListMixin:
+    """Примесь списков с кэшированием фрагмента страницы по пользователю.
+    Список загружается лениво, поэтому при попадании в кэш фрагмента не читается вовсе."""
+    cache_name = None
+
+    def get_context_object_name(self, object_list):
+        # Шаблоны используют object_list, а поиск имени по модели списка загрузил бы его.
+        return None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cache_timeout"] = PAGE_CACHE_TIMEOUT if CACHE_ENABLED else 0
+        context["cache_key"] = get_page_cache_key(self.cache_name, self.request.user)
+        return context
 
-from .models import Mailing, Attempts, Message, Recipient
-from .forms import RecipientForm, MailingForm, MessageForm
-from .service import get_mailing_attempts_list, get_mailing_list, get_message_list, get_recipient_list
+
+class SingleObjectOnceMixin:
+    """Примесь контроллеров, которые обращаются к объекту и в test_func, и при обработке запроса.
+    Объект загружается из БД один раз за запрос."""
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, "_single_object"):
+            self._single_object = super().get_object()
+        return self._single_object
 
 
 class MailingView(TemplateView):
@@ -21,21 +64,18 @@ class MailingView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["recipients_all"] = Recipient.objects.all()
-        context["mailing_all"] = Mailing.objects.all()
-        context["mailing_active"] = Mailing.objects.filter(status=Mailing.ACTIVE)
+        context["stats"] = get_dashboard_stats()
         return context
 
 
-class RecipientListView(LoginRequiredMixin, ListView):
+class RecipientListView(LoginRequiredMixin, CachedListMixin, KeysetPaginationMixin, ListView):
     """Контроллер отображения списка получателей."""
     model = Recipient
     template_name = "mail/recipient_list.html"
+    cache_name = "recipient_list"
 
-    def get_queryset(self):
-        if self.request.user.has_perm("mailing.view_recipient"):
-            return get_recipient_list()
-        return get_recipient_list().filter(owner=self.request.user)
+    def get_page(self, after, before):
+        return get_recipient_list(self.request.user, after, before)
 
 
 class RecipientDetailView(LoginRequiredMixin, DetailView):
@@ -59,7 +99,34 @@ class RecipientCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class RecipientUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class RecipientImportView(LoginRequiredMixin, FormView):
+    """Контроллер импорта получателей из файла CSV или XLSX. Показывает число
+    импортированных получателей и первые отклонённые строки с причинами."""
+    form_class = RecipientImportForm
+    template_name = "mail/recipient_import.html"
+
+    def form_valid(self, form):
+        rejected = []
+        total_rejected = 0
+
+        def report(line, email, error):
+            nonlocal total_rejected
+            total_rejected += 1
+            if len(rejected) < RECIPIENT_IMPORT_REPORT_LIMIT:
+                rejected.append({"line": line, "email": email, "error": error})
+
+        upload = form.cleaned_data["file"]
+        try:
+            created = import_recipients(read_rows(upload, upload.name), self.request.user, report)
+        except ImportFileError as error:
+            form.add_error("file", str(error))
+            return self.form_invalid(form)
+        return self.render_to_response(
+            self.get_context_data(form=form, created=created, rejected=rejected, total_rejected=total_rejected)
+        )
+
+
+class RecipientUpdateView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, UpdateView):
     """Контроллер изменения получателя."""
     model = Recipient
     form_class = RecipientForm
@@ -68,7 +135,7 @@ class RecipientUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
 
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
@@ -77,28 +144,27 @@ class RecipientUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return reverse_lazy("mail:recipient_detail", kwargs={"pk": self.object.pk})
 
 
-class RecipientDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class RecipientDeleteView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, DeleteView):
     model = Recipient
     template_name = "mail/recipient_confirm_delete.html"
     success_url = reverse_lazy("mail:recipient_list")
 
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
 
 
-class MessageListView(LoginRequiredMixin, ListView):
+class MessageListView(LoginRequiredMixin, CachedListMixin, KeysetPaginationMixin, ListView):
     """Контроллер отображения списка сообщений."""
     model = Message
     template_name = "mail/message_list.html"
+    cache_name = "message_list"
 
-    def get_queryset(self):
-        if self.request.user.has_perm("mailing.view_message"):
-            return get_message_list()
-        return get_message_list().filter(owner=self.request.user)
+    def get_page(self, after, before):
+        return get_message_list(self.request.user, after, before)
 
 
 class MessageDetailView(LoginRequiredMixin, DetailView):
@@ -122,7 +188,7 @@ class MessageCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class MessageUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class MessageUpdateView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, UpdateView):
     """Контроллер изменения сообщения."""
     model = Message
     form_class = MessageForm
@@ -131,7 +197,7 @@ class MessageUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
 
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
@@ -140,7 +206,7 @@ class MessageUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return reverse_lazy("mail:message_detail", kwargs={"pk": self.object.pk})
 
 
-class MessageDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class MessageDeleteView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, DeleteView):
     """Контроллер удаления сообщения."""
     model = Message
     template_name = "mail/message_confirm_delete.html"
@@ -148,34 +214,66 @@ class MessageDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
 
 
-class MailingListView(LoginRequiredMixin, ListView):
-    """Контроллер отображения списка рассылок."""
-    model = Mailing
-    template_name = "mail/mailing_list.html"
+# Разделы списка рассылок: префикс параметров адреса (?created_after=...) и статус рассылок раздела.
+MAILING_SECTIONS = (
+    ("created", Mailing.CREATED),
+    ("active", Mailing.ACTIVE),
+    ("finished", Mailing.FINISHED),
+)
+
 
-    def get_queryset(self):
-        if self.request.user.has_perm("mailing.view_mailing"):
-            return get_mailing_list()
-        return get_mailing_list().filter(owner=self.request.user)
+class MailingListView(LoginRequiredMixin, CachedListMixin, TemplateView):
+    """Контроллер отображения списка рассылок с группировкой по статусу.
+    Каждый раздел листается своим курсором, поэтому раздел не разрывается границей страницы
+    и его заголовок не повторяется. Страницы разделов загружаются лениво,
+    поэтому при попадании в кэш фрагмента не читаются."""
+    template_name = "mail/mailing_list.html"
+    cache_name = "mailing_list"
+
+    def get_section_url(self, prefix, direction, cursor):
+        """Адрес списка, на котором раздел prefix сдвинут на страницу по курсору cursor,
+        а остальные разделы остаются на своих страницах."""
+        query = self.request.GET.copy()
+        query.pop(f"{prefix}_after", None)
+        query.pop(f"{prefix}_before", None)
+        query[f"{prefix}_{direction}"] = cursor
+        return "?" + query.urlencode()
+
+    def get_section_context(self, prefix, status):
+        after, before = self.request.GET.get(f"{prefix}_after"), self.request.GET.get(f"{prefix}_before")
+        page = SimpleLazyObject(lambda: get_mailing_list(self.request.user, status, after, before))
+        return {
+            f"mailing_{prefix}": SimpleLazyObject(lambda: page[0]),
+            f"{prefix}_next_url": SimpleLazyObject(
+                lambda: self.get_section_url(prefix, "after", page[1]) if page[1] else ""
+            ),
+            f"{prefix}_previous_url": SimpleLazyObject(
+                lambda: self.get_section_url(prefix, "before", page[2]) if page[2] else ""
+            ),
+        }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        mailing = self.get_queryset()
-        context["mailing_created"] = mailing.filter(status=Mailing.CREATED)
-        context["mailing_active"] = mailing.filter(status=Mailing.ACTIVE)
-        context["mailing_finished"] = mailing.filter(status=Mailing.FINISHED)
+        for prefix, status in MAILING_SECTIONS:
+            context.update(self.get_section_context(prefix, status))
+        context["page_key"] = ":".join(
+            self.request.GET.get(f"{prefix}_{direction}", "")
+            for prefix, status in MAILING_SECTIONS
+            for direction in ("after", "before")
+        )
         return context
 
 
 class MailingDetailView(LoginRequiredMixin, DetailView):
     """Контроллер отображения подробностей о рассылке."""
     model = Mailing
+    queryset = Mailing.objects.select_related("message", "stats", "segment")
     template_name = "mail/mailing_detail.html"
 
 
@@ -185,6 +283,11 @@ class MailingCreateView(LoginRequiredMixin, CreateView):
     template_name = "mail/mailing_form.html"
     success_url = reverse_lazy("mail:mailing_list")
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
         mailing = form.save()
         user = self.request.user
@@ -193,16 +296,21 @@ class MailingCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class MailingUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class MailingUpdateView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, UpdateView):
     """Контроллер изменения рассылки."""
     model = Mailing
     form_class = MailingForm
     template_name = "mail/mailing_form.html"
     success_url = reverse_lazy("mail:mailing_list")
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
@@ -211,7 +319,7 @@ class MailingUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return reverse_lazy("mail:mailing_detail", kwargs={"pk": self.object.pk})
 
 
-class MailingDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class MailingDeleteView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, DeleteView):
     """Контроллер удаления рассылки."""
     model = Mailing
     template_name = "mail/mailing_confirm_delete.html"
@@ -219,74 +327,128 @@ class MailingDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
     def test_func(self):
         recipient = self.get_object()
-        return self.request.user == recipient.owner
+        return self.request.user.pk == recipient.owner_id
+
+    def handle_no_permissions(self):
+        return HttpResponseForbidden("У вас нет прав на это действие.")
+
+
+class SegmentListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """Контроллер отображения списка сегментов получателей пользователя."""
+    model = Segment
+    template_name = "mail/segment_list.html"
+
+    def get_page(self, after, before):
+        return paginate(Segment.objects.filter(owner=self.request.user), ("name", "pk"), after=after, before=before)
+
+
+class SegmentDetailView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, DetailView):
+    """Контроллер отображения сегмента с числом получателей, которых он сейчас отбирает."""
+    model = Segment
+    template_name = "mail/segment_detail.html"
+
+    def test_func(self):
+        segment = self.get_object()
+        return self.request.user.pk == segment.owner_id
 
     def handle_no_permissions(self):
         return HttpResponseForbidden("У вас нет прав на это действие.")
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["recipients_count"] = get_segment_recipients(self.object).count()
+        return context
 
-class AttemptsListView(LoginRequiredMixin, ListView):
-    """Контроллер отображения списка попыток отправки."""
+
+class SegmentCreateView(LoginRequiredMixin, CreateView):
+    """Контроллер создания сегмента получателей."""
+    model = Segment
+    form_class = SegmentForm
+    template_name = "mail/segment_form.html"
+    success_url = reverse_lazy("mail:segment_list")
+
+    def form_valid(self, form):
+        form.instance.owner = self.request.user
+        return super().form_valid(form)
+
+
+class SegmentUpdateView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, UpdateView):
+    """Контроллер изменения сегмента получателей."""
+    model = Segment
+    form_class = SegmentForm
+    template_name = "mail/segment_form.html"
+
+    def test_func(self):
+        segment = self.get_object()
+        return self.request.user.pk == segment.owner_id
+
+    def handle_no_permissions(self):
+        return HttpResponseForbidden("У вас нет прав на это действие.")
+
+    def get_success_url(self):
+        return reverse_lazy("mail:segment_detail", kwargs={"pk": self.object.pk})
+
+
+class SegmentDeleteView(LoginRequiredMixin, SingleObjectOnceMixin, UserPassesTestMixin, DeleteView):
+    """Контроллер удаления сегмента получателей. Сегмент, выбранный в рассылках, не удаляется."""
+    model = Segment
+    template_name = "mail/segment_confirm_delete.html"
+    success_url = reverse_lazy("mail:segment_list")
+
+    def test_func(self):
+        segment = self.get_object()
+        return self.request.user.pk == segment.owner_id
+
+    def handle_no_permissions(self):
+        return HttpResponseForbidden("У вас нет прав на это действие.")
+
+    def form_valid(self, form):
+        if self.object.mailings.exists():
+            return self.render_to_response(self.get_context_data(in_use=True))
+        return super().form_valid(form)
+
+
+class AttemptsListView(LoginRequiredMixin, CachedListMixin, KeysetPaginationMixin, ListView):
+    """Контроллер отображения списка попыток отправки постранично."""
     model = Attempts
     template_name = "mail/mailing_attempts_list.html"
+    cache_name = "mailing_attempts_list"
 
-    def get_queryset(self):
-        if self.request.user.has_perm("mailing.view_mailing_attempts"):
-            return get_mailing_attempts_list()
-        return get_mailing_attempts_list().filter(owner=self.request.user)
+    def get_page(self, after, before):
+        return get_mailing_attempts_list(self.request.user, after, before)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        attempt = self.get_queryset()
-        context["success"] = attempt.filter(attempt_status="успешно").count()
-        context["failure"] = attempt.filter(attempt_status="неуспешно").count()
-        context["total"] = attempt.count()
+        stats = SimpleLazyObject(lambda: get_attempt_stats(self.request.user))
+        context["success"] = SimpleLazyObject(lambda: stats["success"])
+        context["failure"] = SimpleLazyObject(lambda: stats["failure"])
+        context["total"] = SimpleLazyObject(lambda: stats["success"] + stats["failure"])
         return context
 
 
+@login_required
+def export_attempts(request, export_format):
+    """Контроллер выгрузки попыток отправки в CSV или NDJSON с фильтрами из строки запроса
+    (mailing, owner, status, date_from, date_to). Ответ отдаётся потоково по мере чтения
+    строк из БД, поэтому выгрузка любого размера не держит в памяти больше одной пачки строк."""
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    form = AttemptsExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    stream, content_type = EXPORT_FORMATS[export_format]
+    rows = iter_export_rows(get_export_queryset(request.user, **form.cleaned_data))
+    response = StreamingHttpResponse(stream(rows), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="attempts.{export_format}"'
+    return response
+
+
 def sending_mail(request, pk):
     """Контроллер отправки рассылок. Принимает pk рассылки,
-    отправляет согласно списка рассылки, вносит необходимые данные в БД"""
+    ставит рассылку в очередь на отправку воркеру run_mail_worker"""
     mail = Mailing.objects.get(pk=pk)
-    email_from = settings.EMAIL_HOST_USER
-    attempts_list = []
-    subject = mail.message.subject
-    message = mail.message.text
-    owner = mail.owner
-    recipients_list = [recipient.email for recipient in mail.recipients.all()]
-    for recipient in recipients_list:
-        try:
-            send_mail(subject, message, email_from, recipient_list=[recipient])
-            if mail.status == Mailing.CREATED:
-                mail.status = Mailing.ACTIVE
-                mail.start_at = datetime.now()
-                mail.save()
-            mailing_attempts = Attempts(
-                attempt_date=datetime.now(),
-                attempt_status=Attempts.SUCCESS,
-                mail_server_response="Email sent successfully",
-                mailing=mail,
-                owner=owner,
-            )
-            mailing_attempts.save()
-            result = "Sending mail successful"
-            attempts_list.append((result, subject, message, recipient))
-        except Exception as e:
-            if mail.status == Mailing.CREATED:
-                mail.status = Mailing.ACTIVE
-                mail.start_at = datetime.now()
-                mail.save()
-            mailing_attempts = Attempts(
-                attempt_date=datetime.now(),
-                attempt_status=Attempts.FAILURE,
-                mail_server_response=str(e),
-                mailing=mail,
-                owner=owner,
-            )
-            mailing_attempts.save()
-            result = f"Sending mail failed with: {str(e)}"
-            attempts_list.append((result, subject, message, recipient))
-    context = {"attempts_list": attempts_list}
+    job = enqueue_mailing(mail)
+    context = {"mail": mail, "job": job}
     return render(request, "mail/send_mail_result.html", context)
 
 
@@ -298,4 +460,13 @@ def finish_mailing(request, pk):
     mail.end_at = datetime.now()
     mail.save()
     context = {"mail": mail}
-    return render(request, "mail/finished_mailing_info.html", context)
\ No newline at end of file
+    return render(request, "mail/finished_mailing_info.html", context)
+
+
+def cache_stats(request):
+    """Контроллер статистики кэша для персонала. Возвращает в JSON попадания и промахи
+    локального уровня кэша и Redis в обслужившем запрос процессе."""
+    if not request.user.is_staff:
+        return HttpResponseForbidden("У вас нет прав на это действие.")
+    get_stats = getattr(cache, "get_stats", None)
+    return JsonResponse(get_stats() if get_stats is not None else {})
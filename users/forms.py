@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, PasswordResetForm, SetPasswordForm
 
-from .models import CustomUser
+from .models import CustomUser, normalize_email
 
 
 class UserRegisterForm(UserCreationForm):
@@ -38,6 +38,12 @@ class UserRegisterForm(UserCreationForm):
         self.fields["password1"].widget.attrs.update({"class": "form-control", "placeholder": "Введите пароль"})
         self.fields["password2"].widget.attrs.update({"class": "form-control", "placeholder": "Введите пароль"})
 
+    def clean_email(self):
+        email = normalize_email(self.cleaned_data.get("email"))
+        if CustomUser.objects.filter(email__lower=email).exists():
+            raise forms.ValidationError("Этот адрес электронной почты уже зарегистрирован.")
+        return email
+
     def clean_phone_number(self):
         phone_number = self.cleaned_data.get("phone_number")
         if phone_number and not phone_number.isdigit():
@@ -82,11 +88,11 @@ class UserUpdateForm(forms.ModelForm):
             raise forms.ValidationError("Номер телефона должен содержать только цифры.")
         return phone_number
 
-    def clean_email_address(self):
-        email_address = self.cleaned_data.get("email")
-        if CustomUser.objects.filter(email=email_address).exclude(pk=self.instance.pk).exists():
+    def clean_email(self):
+        email = normalize_email(self.cleaned_data.get("email"))
+        if CustomUser.objects.filter(email__lower=email).exclude(pk=self.instance.pk).exists():
             raise forms.ValidationError("Этот адрес электронной почты уже зарегистрирован.")
-        return email_address
+        return email
 
 
 class UserForgotPasswordForm(PasswordResetForm):
@@ -102,6 +108,13 @@ class UserForgotPasswordForm(PasswordResetForm):
         for field in self.fields:
             self.fields[field].widget.attrs.update({"class": "form-control", "autocomplete": "off"})
 
+    def get_users(self, email):
+        """
+        Поиск активных пользователей по нормализованному адресу через индекс LOWER(email)
+        """
+        users = CustomUser.objects.filter(email__lower=normalize_email(email), is_active=True)
+        return (user for user in users if user.has_usable_password())
+
 
 class UserSetNewPasswordForm(SetPasswordForm):
     """
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models.functions import Lower, Trim
+
+
+def normalize_user_emails(apps, schema_editor):
+    """Приводит адреса пользователей к нормализованному виду. Учётные записи с адресами,
+    совпадающими без учёта регистра, автоматически не сливаются: их нужно разобрать вручную.
+    """
+    CustomUser = apps.get_model("users", "CustomUser")
+    duplicates = list(
+        CustomUser.objects.order_by()
+        .values_list(Lower(Trim("email")), flat=True)
+        .annotate(count=models.Count("pk"))
+        .filter(count__gt=1)
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Адреса нескольких пользователей совпадают без учёта регистра: "
+            + ", ".join(duplicates)
+        )
+    CustomUser.objects.exclude(email=Lower(Trim("email"))).update(
+        email=Lower(Trim("email"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_user_emails, migrations.RunPython.noop),
+    ]
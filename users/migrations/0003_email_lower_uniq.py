@@ -0,0 +1,29 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.functions.text
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_normalize_emails"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="customuser",
+            managers=[
+                ("objects", users.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="customuser",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("email"),
+                name="users_customuser_email_lower_uniq",
+                violation_error_message="Этот адрес электронной почты уже зарегистрирован.",
+            ),
+        ),
+    ]
@@ -1,9 +1,45 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models.functions import Lower
+
+# Поиск по адресу через email__lower=... идёт по функциональному уникальному индексу LOWER(email).
+models.EmailField.register_lookup(Lower)
+
+
+def normalize_email(email):
+    """Нормализованный вид адреса электронной почты: без пробелов по краям и в нижнем регистре.
+    Адреса хранятся и сравниваются только в этом виде, поэтому Foo@X.ru и foo@x.ru - один адрес."""
+    return (email or "").strip().lower()
+
+
+class CustomUserManager(UserManager):
+    """Менеджер пользователей, у которых логином служит адрес электронной почты."""
+
+    @classmethod
+    def normalize_email(cls, email):
+        return normalize_email(email)
+
+    def get_by_natural_key(self, email):
+        return self.get(email__lower=normalize_email(email))
+
+    def create_user(self, email, password=None, **extra_fields):
+        extra_fields.setdefault("is_staff", False)
+        extra_fields.setdefault("is_superuser", False)
+        user = self.model(email=normalize_email(email), **extra_fields)
+        user.set_password(password)
+        user.save(using=self._db)
+        return user
+
+    def create_superuser(self, email, password=None, **extra_fields):
+        extra_fields.setdefault("is_staff", True)
+        extra_fields.setdefault("is_superuser", True)
+        return self.create_user(email, password, **extra_fields)
 
 
 class CustomUser(AbstractUser):
     username = None
+    # Поле логина должно быть уникальным само по себе, поэтому простой уникальный индекс остаётся
+    # рядом с функциональным: адреса хранятся нормализованными, и оба индекса совпадают по смыслу.
     email = models.EmailField(unique=True, verbose_name="Электронная почта")
     first_name = models.CharField(
         max_length=50,
@@ -45,9 +81,22 @@ class CustomUser(AbstractUser):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
 
+    objects = CustomUserManager()
+
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        constraints = [
+            models.UniqueConstraint(
+                Lower("email"),
+                name="users_customuser_email_lower_uniq",
+                violation_error_message="Этот адрес электронной почты уже зарегистрирован.",
+            ),
+        ]
 
     def __str__(self):
         return self.email
+
+    def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
+        super().save(*args, **kwargs)
@@ -1,3 +1,70 @@
-from django.test import TestCase
+from django.contrib.auth import SESSION_KEY
+from django.core import mail
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from users.forms import UserRegisterForm, UserUpdateForm
+from users.models import CustomUser
+
+# Кэш, который ничего не хранит: страницы в тестах всегда собираются из БД.
+DUMMY_CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class UsersListViewTest(TestCase):
+    """Список пользователей укладывается в бюджет запросов к БД при любом числе пользователей."""
+
+    def test_query_count_does_not_depend_on_users(self):
+        user = CustomUser.objects.create(email="user@example.com")
+        self.client.force_login(user)
+        # Сессия, пользователь и права в base.html - четыре запроса, ещё один на страницу списка.
+        for count in (3, 60):
+            CustomUser.objects.bulk_create([CustomUser(email=f"user-{count}-{i}@example.com") for i in range(count)])
+            with self.subTest(users=count), self.assertNumQueries(5):
+                response = self.client.get(reverse("users:users_list"))
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+class EmailCaseTest(TestCase):
+    """Адреса пользователей не различаются по регистру: второй такой же адрес отклоняется,
+    а вход и восстановление пароля работают с адресом в любом регистре."""
+
+    password = "Nj7-qLx2-vTr9"
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(" User@Example.COM ", self.password)
+
+    def test_email_is_stored_normalized(self):
+        self.assertEqual(self.user.email, "user@example.com")
+        self.assertEqual(CustomUser.objects.get_by_natural_key("USER@example.com"), self.user)
+
+    def test_registration_with_same_email_in_other_case_is_rejected(self):
+        form = UserRegisterForm(
+            data={"email": "USER@example.com", "password1": self.password, "password2": self.password}
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn("email", form.errors)
+
+    def test_update_to_other_users_email_in_other_case_is_rejected(self):
+        other = CustomUser.objects.create_user("other@example.com")
+        form = UserUpdateForm(data={"email": "User@example.com"}, instance=other)
+        self.assertFalse(form.is_valid())
+        self.assertIn("email", form.errors)
+
+    def test_database_rejects_same_email_in_other_case(self):
+        # bulk_create не вызывает save(), поэтому адрес не нормализуется и спасает только индекс LOWER(email).
+        with self.assertRaises(IntegrityError):
+            CustomUser.objects.bulk_create([CustomUser(email="USER@example.com")])
+
+    def test_login_with_email_in_other_case(self):
+        response = self.client.post(reverse("users:login"), {"username": "USER@Example.com", "password": self.password})
+        self.assertRedirects(response, "/", fetch_redirect_response=False)
+        self.assertEqual(int(self.client.session[SESSION_KEY]), self.user.pk)
+
+    def test_password_reset_with_email_in_other_case(self):
+        response = self.client.post(reverse("users:password_reset"), {"email": "uSeR@EXAMPLE.com"})
+        self.assertRedirects(response, reverse("mail:main"), fetch_redirect_response=False)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["user@example.com"])
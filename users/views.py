@@ -15,6 +15,7 @@ from django.views.generic.edit import CreateView, UpdateView
 from .forms import UserForgotPasswordForm, UserRegisterForm, UserSetNewPasswordForm, UserUpdateForm
 from .models import CustomUser
 from django.http import HttpResponseForbidden
+from mail.pagination import KeysetPaginationMixin, paginate
 
 
 class RegisterView(CreateView):
@@ -132,11 +133,14 @@ class UserPasswordResetConfirmView(SuccessMessageMixin, PasswordResetConfirmView
         return context
 
 
-class UsersListView(LoginRequiredMixin, ListView):
-    """Контроллер отображения списка пользователей сервиса."""
+class UsersListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """Контроллер отображения списка пользователей сервиса постранично."""
 
     model = CustomUser
-    template_name = "customuser_list.html"
+    template_name = "users/customuser_list.html"
+
+    def get_page(self, after, before):
+        return paginate(CustomUser.objects.all(), ("pk",), after=after, before=before)
 
 
 class BlockUserView(LoginRequiredMixin, View):